@@ -0,0 +1,165 @@
+"""Adaptive admission control: per route class concurrency limits with load shedding"""
+import os
+import asyncio
+import time
+from collections import deque
+from typing import List, Optional
+
+from .logger import log_error
+
+class RouteClass:
+    """Admission state for one class of routes.
+
+    ``limit`` is how many requests may run at once. It adapts AIMD-style:
+    every completion under ``target`` latency raises it a little, every
+    completion over it cuts it by 10%. Requests over the limit wait in a
+    FIFO for at most ``max_wait`` seconds and are then shed.
+    """
+    def __init__(self, name: str, priority: int, prefixes: tuple, methods: tuple,
+                 target: float, max_limit: int, max_wait: float, min_limit: int = 1):
+        self.name = name
+        self.priority = priority  # Lower numbers are more important
+        self.prefixes = prefixes
+        self.methods = methods
+        self.target = target
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.max_wait = max_wait
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self.latency = 0.0  # EWMA of service time
+        self.queue_delay = 0.0  # EWMA of time spent waiting for admission
+        self.admitted = 0
+        self.shed = 0
+
+    def matches(self, method: str, path: str) -> bool:
+        return (not self.methods or method in self.methods) and path.startswith(self.prefixes)
+
+    @property
+    def overloaded(self) -> bool:
+        """Busy and missing its latency target, or queueing"""
+        if self._waiters:
+            return True
+        return self.in_flight > 0 and (self.latency > self.target or self.queue_delay > self.target / 2)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    async def acquire(self, shed_now: bool) -> bool:
+        """Wait for a slot; False means the request should be shed"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            self.queue_delay *= 0.9
+            return True
+        if shed_now:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done():  # Admitted just as the wait ran out
+                self.admitted += 1
+                return True
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self.shed += 1
+            self.queue_delay = 0.8 * self.queue_delay + 0.2 * self.max_wait
+            return False
+        except BaseException:
+            # Cancelled (e.g. the client went away): give back the slot if _wake already granted it
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            else:
+                waiter.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+        self.admitted += 1
+        self.queue_delay = 0.8 * self.queue_delay + 0.2 * (time.monotonic() - start)
+        return True
+
+    def release(self, latency: float):
+        self.in_flight -= 1
+        self.latency = 0.8 * self.latency + 0.2 * latency
+        if latency > self.target:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / max(self.limit, 1))
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "priority": self.priority,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "latency_ms": round(self.latency * 1000, 2),
+            "queue_delay_ms": round(self.queue_delay * 1000, 2),
+            "admitted": self.admitted,
+            "shed": self.shed
+        }
+
+class AdmissionController:
+    """Classifies requests and admits, queues or sheds them.
+
+    When a more important class is overloaded, requests of less important
+    classes that cannot start right away are shed immediately instead of
+    queueing, so cheap reads give way to payments. Runs on the event loop
+    only, so it needs no locks.
+    """
+    def __init__(self, classes: List[RouteClass], enabled: bool = True):
+        self.classes = sorted(classes, key=lambda c: c.priority)
+        self.enabled = enabled
+
+    def classify(self, method: str, path: str) -> Optional[RouteClass]:
+        if not self.enabled:
+            return None
+        return next((c for c in self.classes if c.matches(method, path)), None)
+
+    async def acquire(self, route_class: RouteClass) -> bool:
+        shed_now = any(c.overloaded for c in self.classes if c.priority < route_class.priority)
+        return await route_class.acquire(shed_now)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "classes": {c.name: c.stats() for c in self.classes}}
+
+    def reset(self):
+        for c in self.classes:
+            c.latency = c.queue_delay = 0.0
+            c.limit = float(c.max_limit)
+            c.admitted = c.shed = 0
+
+# name -> (priority, path prefixes, methods, default "target_ms,max_concurrency,max_wait_ms")
+DEFAULT_CLASSES = {
+    "payments": (0, ("/gateway/pay", "/transfers/bulk"), ("POST",), "500,32,2000"),
+    "chat": (1, ("/agent/chat",), ("POST",), "1000,16,500"),
+    "reads": (2, ("/balances", "/transactions", "/activities", "/orders", "/analytics",
+                  "/products", "/users", "/banks", "/export"), ("GET",), "200,64,100"),
+}
+
+def controller_from_env() -> AdmissionController:
+    """Build route classes from ADMISSION_<CLASS>=target_ms,max_concurrency,max_wait_ms"""
+    classes = []
+    for name, (priority, prefixes, methods, default) in DEFAULT_CLASSES.items():
+        value = os.getenv(f"ADMISSION_{name.upper()}", default)
+        try:
+            target, max_limit, max_wait = (float(v) for v in value.split(","))
+        except ValueError:
+            log_error(f"Invalid ADMISSION_{name.upper()}={value!r}, using {default}")
+            target, max_limit, max_wait = (float(v) for v in default.split(","))
+        classes.append(RouteClass(name, priority, prefixes, methods, target / 1000, int(max_limit), max_wait / 1000))
+    return AdmissionController(classes, enabled=os.getenv("ADMISSION_ENABLED", "1") == "1")
+
+# Global instance, applied by AdmissionMiddleware in main.py
+admission = controller_from_env()
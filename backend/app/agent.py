@@ -1,3 +1,4 @@
+import os
 import re
 import json
 from uuid import uuid4
@@ -5,13 +6,19 @@ from typing import Optional
 from pydantic import BaseModel
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from .db import db
-from .rsa_utils import load_public_key, encrypt_with_public
+from .rsa_utils import key_manager
 from .gateway import gateway_pay, PaymentRequest
 from .logger import log_info, log_error
 from .speech import voice
+from .expiry import expiry_scheduler
+from .conversation_store import create_conversation_store
+from .analytics import rollups
+from .intents import create_resolver
+from .inventory import inventory, OutOfStockError
+from .models import json_default
 
 class ChatMessage(BaseModel):
     message: str
@@ -19,10 +26,30 @@ class ChatMessage(BaseModel):
 
 router = APIRouter()
 
-PUB = load_public_key()
+def _expire_pending_action(user_id: str, action: dict):
+    """Log a confirmation the user never answered"""
+    db.log_activity(user_id, "cancellation", {
+        "kind": "purchase" if action["type"] == "buy" else "transfer",
+        "reason": "expired"
+    })
 
-# Store pending actions that need confirmation
-pending_actions = {}
+# Store pending actions that need confirmation; shared across workers when
+# CONVERSATION_STORE=sqlite
+pending_actions = expiry_scheduler.register(create_conversation_store(
+    float(os.getenv("PENDING_ACTION_TTL", "300")), _expire_pending_action
+))
+expiry_scheduler.register_gauge("pending_actions", lambda: len(pending_actions))
+
+def set_pending_action(user_id: str, action: dict):
+    pending_actions.put(user_id, action)
+
+def pop_pending_action(user_id: str):
+    return pending_actions.pop(user_id)
+
+CONFIRM_RE = re.compile(
+    r"^(?:yes|yep|yeah|yup|y|ok|okay|sure|confirm|confirmed|proceed|go ahead|do it)"
+    r"(?:[ ,]+(?:please|thanks|confirm|go ahead|do it))*[.!]*$"
+)
 
 def parse_command(message: str):
     """Parse natural language commands for buying and transferring"""
@@ -44,8 +71,8 @@ def parse_command(message: str):
     for p in keyboard_products:
         log_info(f"- {p['title']} (rating: {p.get('rating', 'N/A')})")
     
-    # Handle confirmations more naturally
-    if any(word in msg for word in ['yes', 'confirm', 'ok', 'sure', 'proceed', 'go ahead', 'do it']):
+    # Confirmations must be the whole message: "yeah no, cancel that" or "absolutely not" must not pay
+    if CONFIRM_RE.match(msg):
         return {"type": "confirm"}
 
     # Extract various patterns
@@ -62,6 +89,14 @@ def parse_command(message: str):
     max_price = float(amount_match.group(1)) if amount_match else None
     min_rating = float(rating_match.group(1)) if rating_match else None
     
+    # Handle spending questions, e.g. "how much did I spend on accessories this month";
+    # anchored so buy requests like "find headphones I can spend $50 on" still buy
+    if re.match(r'^(?:how much|what)\b.*\b(?:spend|spent|spending)\b', msg) or re.match(r'^(?:my )?spending\b', msg):
+        categories = {p.get("category", "").lower(): p.get("category") for p in db.products.values()}
+        category = next((name for key, name in categories.items() if key and key in msg), None)
+        period = "day" if "today" in msg else "month" if "month" in msg else "all"
+        return {"type": "spending", "category": category, "period": period}
+
     # Handle buy commands
     if any(keyword in msg for keyword in buy_keywords):
         # Clean up the rating criteria from item name
@@ -115,12 +150,27 @@ def parse_command(message: str):
     
     return None
 
+# Regex parser first; phrasings it misses go to the cached, batched model backend (INTENT_BACKEND)
+intent_resolver = create_resolver(parse_command)
+
+def resolve_command(message: str):
+    """parse_command with the model fallback, returning the same command shapes"""
+    cmd = intent_resolver.resolve(message)
+    if cmd and cmd["type"] == "transfer" and not cmd.get("to_phone"):
+        # The model may only know the recipient's name
+        name = (cmd.get("to_name") or "").lower()
+        user = next((u for u in db.users.values() if name and u["name"].lower().startswith(name)), None)
+        if not user:
+            return None
+        cmd["to_phone"] = user["phone"]
+    return cmd
+
 def execute_pending_action(user_id: str):
     """Execute a previously confirmed action"""
-    if user_id not in pending_actions:
+    action = pop_pending_action(user_id)
+    if not action:
         return {"ok": False, "reason": "No pending action"}
     
-    action = pending_actions.pop(user_id)
     if action["type"] == "buy":
         result = process_purchase(user_id, action["product"], action.get("max_price"))
         if result["ok"]:
@@ -138,7 +188,7 @@ def execute_pending_action(user_id: str):
             voice.speak_transaction(
                 action["amount"],
                 "transfer_sent",
-                {"recipient_name": next(u["name"] for u in db.users.values() if u["phone"] == action["to_phone"])}
+                {"recipient_name": db.get_user_by_phone(action["to_phone"])["name"]}
             )
         return result
     
@@ -151,7 +201,7 @@ def process_transfer(user_id: str, to_phone: str, amount: float):
     log_info(f"Processing transfer request from {sender['name']} (${amount:.2f})")
     
     # Find recipient by phone
-    recipient = next((u for u in db.users.values() if u["phone"] == to_phone), None)
+    recipient = db.get_user_by_phone(to_phone)
     if not recipient:
         log_error(f"Transfer failed: Recipient not found with phone {to_phone}")
         return {"ok": False, "reason": "Recipient not found"}
@@ -168,7 +218,7 @@ def process_transfer(user_id: str, to_phone: str, amount: float):
     
     # Encrypt and process payment
     pt = json.dumps(payload).encode()
-    encrypted = encrypt_with_public(pt, PUB)
+    encrypted = key_manager.encrypt(pt)
     payment_request = PaymentRequest(payload=encrypted)
     
     res = gateway_pay(payment_request)
@@ -194,7 +244,7 @@ def process_purchase(user_id: str, product: dict, max_price: float = None):
             "order_id": order_id,
         }
         pt = json.dumps(payload).encode()
-        encrypted = encrypt_with_public(pt, PUB)
+        encrypted = key_manager.encrypt(pt)
         
         payment_request = PaymentRequest(payload=encrypted)
         res = gateway_pay(payment_request)
@@ -205,13 +255,15 @@ def process_purchase(user_id: str, product: dict, max_price: float = None):
             return {
                 "ok": True, 
                 "reply": f"Successfully purchased '{product['title']}' for ${product['price']:.2f}",
-                "order": completed_order
+                "order": completed_order.to_dict()
             }
         else:
             # Cancel order if payment failed
             db.cancel_order(order_id, "Payment failed")
             return {"ok": False, "reason": "Payment failed", "details": res}
-            
+
+    except OutOfStockError as e:
+        return {"ok": False, "reason": str(e)}
     except Exception as e:
         log_error(f"Purchase processing error: {str(e)}")
         return {"ok": False, "reason": "Failed to process purchase", "details": str(e)}
@@ -236,8 +288,8 @@ def find_best_product_matches(query: str, max_price: float = None, min_rating: f
     log_info(f"Cleaned query: '{clean_query}'")
     log_info(f"Searching with constraints: max_price={max_price}, min_rating={min_rating}")
     
-    # Get initial matches
-    matches = db.find_best_price_products(clean_query, max_price)
+    # Get initial matches, leaving out products whose stock is all sold or reserved
+    matches = [p for p in db.find_best_price_products(clean_query, max_price) if inventory.available(p) > 0]
     
     # Apply rating filter if specified
     if min_rating:
@@ -255,8 +307,8 @@ def find_best_product_matches(query: str, max_price: float = None, min_rating: f
         features = []
         if "rating" in product:
             features.append(f"{product['rating']}⭐")
-        if "stock" in product and product["stock"] > 0:
-            features.append(f"{product['stock']} in stock")
+        if "stock" in product:
+            features.append(f"{inventory.available(product)} in stock")
             
         feature_text = f" ({', '.join(features)})" if features else ""
         return f"{product['title']} by {brand} - ${product['price']:.2f}{feature_text}"
@@ -285,13 +337,13 @@ def find_best_product_matches(query: str, max_price: float = None, min_rating: f
     
     return matches, (text_response, speech_response)
 
-@router.post("/agent/chat")
-async def agent_chat(data: ChatMessage, request: Request):
-    user_id = getattr(request.state, "user_id", None)
-    if not user_id:
-        log_error("Could not find user_id in request state. Auth middleware might have failed.")
-        return JSONResponse(status_code=401, content={"ok": False, "reason": "Invalid or missing authentication"})
-        
+def chat_steps(user_id: str, data: ChatMessage):
+    """Handle a chat message as a sequence of (kind, payload) steps.
+
+    Intermediate steps are ("intent", ...) and ("product", ...); the last
+    step is always ("reply", response) where response is the regular
+    /agent/chat body.
+    """
     # Debug startup state
     all_products = db.get_products()
     log_info(f"Total products in DB: {len(all_products)}")
@@ -306,10 +358,11 @@ async def agent_chat(data: ChatMessage, request: Request):
         log_info(f"Found {len(high_rated_keyboards)} keyboards with rating >= 4.2")
         if high_rated_keyboards:
             keyboard = high_rated_keyboards[0]
-            return {
+            yield "reply", {
                 "ok": True,
                 "reply": f"I found {keyboard['title']} with a rating of {keyboard['rating']} for ${keyboard['price']:.2f}"
             }
+            return
     
     user = db.users.get(user_id)
     log_info(f"✓ Session verified for {user['name']} (ID: {user_id})")
@@ -324,19 +377,24 @@ async def agent_chat(data: ChatMessage, request: Request):
 
     # Check for pending confirmation
     if user_id in pending_actions:
-        cmd = parse_command(data.message)
+        cmd = resolve_command(data.message)
+        yield "intent", {"intent": cmd}
         if cmd and cmd.get("type") == "confirm":
-            return execute_pending_action(user_id)
+            yield "reply", execute_pending_action(user_id)
+            return
         else:
             # Cancel pending action if user didn't confirm
-            old_action = pending_actions.pop(user_id)
-            action_type = "purchase" if old_action["type"] == "buy" else "transfer"
-            return respond(f"Cancelled previous {action_type} request. Processing your new request: " + data.message)
+            old_action = pop_pending_action(user_id)
+            action_type = "purchase" if old_action and old_action["type"] == "buy" else "transfer"
+            yield "reply", respond(f"Cancelled previous {action_type} request. Processing your new request: " + data.message)
+            return
 
     # Parse new command
-    cmd = parse_command(data.message)
+    cmd = resolve_command(data.message)
+    yield "intent", {"intent": cmd}
     if not cmd:
-        return {"ok": True, "reply": "I can help you:\n1. Buy items (e.g., 'buy me a mouse' or 'buy headphones for $100')\n2. Transfer money (e.g., 'send $50 to +10000000002')"}
+        yield "reply", {"ok": True, "reply": "I can help you:\n1. Buy items (e.g., 'buy me a mouse' or 'buy headphones for $100')\n2. Transfer money (e.g., 'send $50 to +10000000002')"}
+        return
 
     # Handle different command types
     if cmd["type"] == "buy":
@@ -350,51 +408,68 @@ async def agent_chat(data: ChatMessage, request: Request):
         )
         
         if not matches:
-            return respond(text_response)
+            yield "reply", respond(text_response)
+            return
+
+        # Stream the top suggestions before the confirmation prompt
+        for product in matches[:3]:
+            yield "product", {"product": product}
             
         chosen = matches[0]
-        pending_actions[user_id] = {
+        set_pending_action(user_id, {
             "type": "buy",
             "product": chosen,
             "max_price": cmd.get("max_price")
-        }
+        })
         
         confirm_msg = f"I found {chosen['title']} for ${chosen['price']:.2f}. Would you like me to proceed with the purchase? (say 'yes' to confirm)"
         if data.use_voice and voice.voice_enabled:
             voice.speak(speech_response)
             voice.speak("Would you like me to proceed with the purchase?")
-        return respond(confirm_msg)
+        yield "reply", respond(confirm_msg)
+        return
     
     elif cmd["type"] == "transfer":
         # Verify recipient exists
-        recipient = next((u for u in db.users.values() if u["phone"] == cmd["to_phone"]), None)
+        recipient = db.get_user_by_phone(cmd["to_phone"])
         if not recipient:
-            return respond(f"I couldn't find a user with phone number {cmd['to_phone']}", success=False)
+            yield "reply", respond(f"I couldn't find a user with phone number {cmd['to_phone']}", success=False)
+            return
         
         # Check sender's balance
         sender = db.users.get(user_id)
         sender_account = db.bank_accounts.get(sender["account_id"])
         if cmd["amount"] > sender_account["balance"]:
             error_msg = f"Sorry, you don't have enough balance for this transfer. Your current balance is ${sender_account['balance']:.2f}"
-            return respond(error_msg, success=False)
+            yield "reply", respond(error_msg, success=False)
+            return
         
         # Store pending transfer
-        pending_actions[user_id] = {
+        set_pending_action(user_id, {
             "type": "transfer",
             "to_phone": cmd["to_phone"],
             "amount": cmd["amount"]
-        }
+        })
         
         confirm_msg = f"Would you like to transfer ${cmd['amount']:.2f} to {recipient['name']} ({cmd['to_phone']})? (say 'yes' to confirm)"
-        return respond(confirm_msg)
-    
+        yield "reply", respond(confirm_msg)
+        return
+    
+    elif cmd["type"] == "spending":
+        summary = rollups.summary(user_id, cmd["period"], category=cmd.get("category"))
+        when = {"day": "today", "month": "this month", "all": "so far"}[cmd["period"]]
+        on = f" on {cmd['category']}" if cmd.get("category") else ""
+        yield "reply", respond(f"You spent ${summary['spent']:.2f}{on} {when} ({summary['spent_count']} transactions)")
+        return
+
     elif cmd["type"] == "balance":
         user = db.users.get(user_id)
         account = db.bank_accounts.get(user["account_id"])
         balance_msg = f"Your current balance is ${account['balance']:.2f}"
         if data.use_voice:
             voice.speak_transaction(account['balance'], "balance")
-        return respond(balance_msg)
+        yield "reply", respond(balance_msg)
+        return
     
     help_text = (
         "I can help you with:\n\n"
@@ -410,7 +485,10 @@ async def agent_chat(data: ChatMessage, request: Request):
         "3. Account:\n"
         "   - 'check balance'\n"
         "   - 'show my wallet'\n"
-        "   - 'how much money do I have'"
+        "   - 'how much money do I have'\n\n"
+        "4. Spending:\n"
+        "   - 'how much did I spend this month'\n"
+        "   - 'what did I spend on accessories today'"
     )
     
     help_speech = (
@@ -420,4 +498,34 @@ async def agent_chat(data: ChatMessage, request: Request):
     
     if data.use_voice:
         voice.speak(help_speech)
-    return respond(help_text)
+    yield "reply", respond(help_text)
+
+def _authenticated_user(request: Request):
+    user_id = getattr(request.state, "user_id", None)
+    if not user_id:
+        log_error("Could not find user_id in request state. Auth middleware might have failed.")
+    return user_id
+
+@router.post("/agent/chat")
+def agent_chat(data: ChatMessage, request: Request):
+    # Plain def: intent resolution and payments block, so this runs in the threadpool
+    user_id = _authenticated_user(request)
+    if not user_id:
+        return JSONResponse(status_code=401, content={"ok": False, "reason": "Invalid or missing authentication"})
+
+    for kind, payload in chat_steps(user_id, data):
+        if kind == "reply":
+            return payload
+
+@router.post("/agent/chat/stream")
+async def agent_chat_stream(data: ChatMessage, request: Request):
+    """Same as /agent/chat, streamed as NDJSON: intent, product suggestions, then the reply"""
+    user_id = _authenticated_user(request)
+    if not user_id:
+        return JSONResponse(status_code=401, content={"ok": False, "reason": "Invalid or missing authentication"})
+
+    def ndjson():
+        for kind, payload in chat_steps(user_id, data):
+            yield json.dumps({"type": kind, **payload}, default=json_default) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
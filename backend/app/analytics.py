@@ -0,0 +1,92 @@
+"""Incrementally maintained spending/receiving rollups per user, period and category"""
+import time
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+PERIODS = ("day", "month", "all")
+
+def period_key(period: str, ts: float = None) -> str:
+    """Bucket key for a timestamp: YYYY-MM-DD, YYYY-MM or 'all' (UTC)"""
+    if period == "all":
+        return "all"
+    t = time.gmtime(time.time() if ts is None else ts)
+    if period == "day":
+        return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}"
+    if period == "month":
+        return f"{t.tm_year:04d}-{t.tm_mon:02d}"
+    raise ValueError(f"Invalid period: {period}")
+
+class SpendingRollups:
+    """Per-user totals updated on every purchase and transfer.
+
+    Each event touches one bucket per period (day, month, all time), so
+    writes are O(1) and a query only reads the buckets it asks for,
+    regardless of how much history the user has.
+    """
+    def __init__(self):
+        # user_id -> period key -> category -> [spent, received, spent count, received count]
+        self._buckets: Dict[str, Dict[str, Dict[str, List[float]]]] = {}
+        self._loader: Optional[Callable[[], dict]] = None
+        self._lock = Lock()
+
+    def _materialize(self):
+        # Caller holds the lock
+        if self._loader is not None:
+            self._buckets, self._loader = self._loader(), None
+
+    def defer(self, loader: Callable[[], dict]):
+        """Replace the buckets with loader()'s result on first use (snapshot restore)"""
+        with self._lock:
+            self._buckets, self._loader = {}, loader
+
+    def buckets(self) -> dict:
+        """The raw buckets, for snapshots"""
+        with self._lock:
+            self._materialize()
+            return self._buckets
+
+    def record(self, user_id: str, category: str, spent: float = 0.0, received: float = 0.0, ts: float = None):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self._materialize()
+            periods = self._buckets.setdefault(user_id, {})
+            for period in PERIODS:
+                bucket = periods.setdefault(period_key(period, ts), {}).setdefault(category, [0.0, 0.0, 0, 0])
+                if spent:
+                    bucket[0] += spent
+                    bucket[2] += 1
+                if received:
+                    bucket[1] += received
+                    bucket[3] += 1
+
+    def summary(self, user_id: str, period: str = "month", key: str = None, category: str = None) -> dict:
+        """Totals for one period bucket, broken down by category"""
+        key = key or period_key(period)
+        with self._lock:
+            self._materialize()
+            categories = dict(self._buckets.get(user_id, {}).get(key, {}))
+            categories = {name: list(values) for name, values in categories.items()}
+
+        if category:
+            match = next((name for name in categories if name.lower() == category.lower()), category)
+            categories = {match: categories.get(match, [0.0, 0.0, 0, 0])}
+
+        return {
+            "period": period,
+            "key": key,
+            "spent": round(sum(v[0] for v in categories.values()), 2),
+            "received": round(sum(v[1] for v in categories.values()), 2),
+            "spent_count": sum(v[2] for v in categories.values()),
+            "received_count": sum(v[3] for v in categories.values()),
+            "categories": {
+                name: {"spent": round(v[0], 2), "received": round(v[1], 2), "spent_count": v[2], "received_count": v[3]}
+                for name, v in categories.items()
+            }
+        }
+
+    def reset(self):
+        with self._lock:
+            self._buckets, self._loader = {}, None
+
+# Global instance
+rollups = SpendingRollups()
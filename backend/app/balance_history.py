@@ -0,0 +1,127 @@
+"""Append-only per-account balance event log with periodic checkpoints"""
+import os
+import time
+from array import array
+from bisect import bisect_right
+from threading import Lock
+from typing import Callable, Dict, Iterable, Optional
+
+class AccountHistory:
+    """Balance deltas of one account, oldest first.
+
+    Every ``checkpoint_every`` events the running balance is checkpointed,
+    so a point-in-time lookup is a bisect over checkpoints plus a replay of
+    at most ``checkpoint_every`` deltas.
+    """
+    __slots__ = ("opening", "current", "ts", "deltas", "cp_ts", "cp_index", "cp_balance")
+
+    def __init__(self, opening: float):
+        self.opening = opening
+        self.current = opening
+        self.ts = array("d")
+        self.deltas = array("d")
+        self.cp_ts = array("d")
+        self.cp_index = array("q")
+        self.cp_balance = array("d")
+
+    def append(self, ts: float, delta: float, checkpoint_every: int):
+        if self.ts and ts < self.ts[-1]:
+            ts = self.ts[-1]  # Keep the log sorted even if the clock steps back
+        self.ts.append(ts)
+        self.deltas.append(delta)
+        self.current += delta
+        if len(self.deltas) % checkpoint_every == 0:
+            self.cp_ts.append(ts)
+            self.cp_index.append(len(self.deltas))
+            self.cp_balance.append(self.current)
+
+    def balance_at(self, at: float) -> float:
+        i = bisect_right(self.cp_ts, at) - 1
+        if i < 0:
+            balance, j = self.opening, 0
+        else:
+            balance, j = self.cp_balance[i], self.cp_index[i]
+        ts, deltas = self.ts, self.deltas
+        while j < len(deltas) and ts[j] <= at:
+            balance += deltas[j]
+            j += 1
+        return balance
+
+class BalanceHistory:
+    """Balance event logs for every account that has moved money.
+
+    Writers are the ledger shards, which call ``record`` under their own
+    lock, so the events of one account are always appended in order.
+    After a snapshot restore the logs are rebuilt from the transaction
+    records on first use (see ``defer``), before any balance moves again.
+    """
+    def __init__(self, checkpoint_every: int = 64):
+        self.checkpoint_every = checkpoint_every
+        self._accounts: Dict[str, AccountHistory] = {}
+        self._loader: Optional[Callable[[], Dict[str, AccountHistory]]] = None
+        self._lock = Lock()
+
+    def _materialize(self):
+        if self._loader is not None:
+            with self._lock:
+                if self._loader is not None:
+                    self._accounts, self._loader = self._loader(), None
+
+    def defer(self, loader: Callable[[], Dict[str, AccountHistory]]):
+        """Replace the logs with loader()'s result on first use (snapshot restore)"""
+        with self._lock:
+            self._accounts, self._loader = {}, loader
+
+    def rebuild(self, transactions: Iterable, account_for_user: Callable[[str], Optional[dict]]) -> Dict[str, AccountHistory]:
+        """Logs replayed from transfer records, each opened at the balance before its first transfer.
+
+        Every balance change is a transfer, so current balance minus the
+        account's net transfers is its opening balance. Call only while no
+        transfer is in flight: ``open`` and ``record`` materialize a
+        deferred rebuild before the shards touch a balance.
+        """
+        changes: Dict[str, tuple] = {}  # account id -> (account, [(ts, delta)])
+        for tx in transactions:
+            for user_id, delta in ((tx.from_id, -tx.amount), (tx.to_id, tx.amount)):
+                account = account_for_user(user_id)
+                if account is not None:
+                    changes.setdefault(account["id"], (account, []))[1].append((tx.ts, delta))
+        accounts = {}
+        for account_id, (account, events) in changes.items():
+            events.sort(key=lambda event: event[0])
+            history = AccountHistory(account["balance"] - sum(delta for _, delta in events))
+            for ts, delta in events:
+                history.append(ts, delta, self.checkpoint_every)
+            accounts[account_id] = history
+        return accounts
+
+    def open(self, account: dict) -> AccountHistory:
+        """Start an account's log from its current balance if it has none.
+
+        Must be called before the account's balance is first mutated.
+        """
+        self._materialize()
+        history = self._accounts.get(account["id"])
+        if history is None:
+            with self._lock:
+                history = self._accounts.setdefault(account["id"], AccountHistory(account["balance"]))
+        return history
+
+    def record(self, account: dict, delta: float, ts: float = None):
+        """Append a balance change, opening the log first if needed"""
+        self.open(account).append(time.time() if ts is None else ts, delta, self.checkpoint_every)
+
+    def balance_at(self, account_id: str, at: float) -> Optional[float]:
+        """Balance as of time ``at``, or None if the account never changed"""
+        self._materialize()
+        history = self._accounts.get(account_id)
+        if history is None:
+            return None
+        return history.balance_at(at)
+
+    def reset(self):
+        with self._lock:
+            self._accounts, self._loader = {}, None
+
+# Global instance
+balance_history = BalanceHistory(checkpoint_every=int(os.getenv("BALANCE_CHECKPOINT_EVERY", "64")))
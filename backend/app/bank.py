@@ -3,6 +3,13 @@ from uuid import uuid4
 import time
 from .logger import log_info, log_error
 from .speech import voice
+from .events import broker
+from .ledger import ledger
+from .analytics import rollups
+from .versions import versions
+from .models import Transaction
+from .ledger_file import ledger_file
+from .velocity import velocity, bulk_velocity, VelocityChecker
 
 def get_balance(user_id: str):
     user = db.users.get(user_id)
@@ -13,8 +20,12 @@ def get_balance(user_id: str):
     log_info(f"Balance check for user {user_id}: ${balance:.2f}")
     return balance
 
-def transfer(from_id: str, to_id: str, amount: float, meta: dict = None):
+def transfer(from_id: str, to_id: str, amount: float, meta: dict = None, notify: bool = True,
+             limits: VelocityChecker = velocity):
     meta = meta or {}
+    if not amount > 0:
+        log_error(f"Transfer failed: invalid amount {amount!r}")
+        return {"ok": False, "reason": "amount must be positive"}
     sender = db.users.get(from_id)
     recipient = db.users.get(to_id)
 
@@ -31,48 +42,78 @@ def transfer(from_id: str, to_id: str, amount: float, meta: dict = None):
         log_error("Transfer failed: Missing bank account")
         return {"ok": False, "reason": "bank account not found"}
     
-    if sender_account["balance"] < amount:
-        log_error(f"Transfer failed: Insufficient funds (${sender_account['balance']:.2f} < ${amount:.2f})")
-        return {"ok": False, "reason": "insufficient funds"}
-    
-    # Execute transfer
-    log_info(f"Initiating transfer: ${amount:.2f} from {sender['name']} to {recipient['name']}")
+    # Velocity limits count the transfer up front so concurrent payments can't overshoot them
+    now = time.time()
+    reason = limits.record(from_id, amount, now)
+    if reason:
+        log_error(f"Transfer failed: {reason} (${amount:.2f} from {sender['name']})")
+        return {"ok": False, "reason": reason}
+
+    # Each bank's shard is the single writer for its accounts
+    reason = ledger.transfer(sender_account, recipient_account, amount)
+    if reason:
+        limits.undo(from_id, amount, now)
+        log_error(f"Transfer failed: {reason} (${sender_account['balance']:.2f} available, ${amount:.2f} requested)")
+        return {"ok": False, "reason": reason}
+    sender_balance = sender_account["balance"]
+    recipient_balance = recipient_account["balance"]
     
-    db.bank_accounts[sender["account_id"]]["balance"] -= amount
-    db.bank_accounts[recipient["account_id"]]["balance"] += amount
+    log_info(f"Transfer complete: ${amount:.2f} from {sender['name']} to {recipient['name']}")
+    log_info(f"New balances - {sender['name']}: ${sender_balance:.2f}, {recipient['name']}: ${recipient_balance:.2f}")
     
-    log_info(f"Transfer complete: ${amount:.2f}")
-    log_info(f"New balances - {sender['name']}: ${sender_account['balance']:.2f}, {recipient['name']}: ${recipient_account['balance']:.2f}")
+    # Create transaction record; the ids are the users' own strings, so records share them
+    tx = Transaction(str(uuid4()), sender["id"], recipient["id"], amount, now, meta)
+    db.add_transaction(tx)
+    ledger_file.append(tx)
+    versions.bump(from_id, "balance", "transactions")
+    versions.bump(to_id, "balance", "transactions")
+
+    # Shop payments are counted per product category by confirm_order
+    if to_id == db.shop_id:
+        rollups.record(to_id, "Sales", received=amount, ts=tx.ts)
+    else:
+        rollups.record(from_id, "Transfers", spent=amount, ts=tx.ts)
+        rollups.record(to_id, "Transfers", received=amount, ts=tx.ts)
     
-    # Create transaction record
-    tx = {
-        "id": str(uuid4()),
-        "from": from_id,
-        "to": to_id,
-        "amount": amount,
-        "ts": time.time(),
-        "meta": meta,
-        "type": "transfer"
-    }
-    db.transactions.append(tx)
+    # Push the new state to both parties' event streams
+    broker.publish(from_id, "transaction", tx)
+    broker.publish(from_id, "balance", {"balance": sender_balance})
+    broker.publish(to_id, "transaction", tx)
+    broker.publish(to_id, "balance", {"balance": recipient_balance})
     
     # Log activity for sender
     db.log_activity(from_id, "transfer_sent", {
         "amount": amount,
         "to_user": db.users[to_id]["name"],
-        "transaction_id": tx["id"]
+        "transaction_id": tx.id
     })
     
     # Log activity for receiver
     db.log_activity(to_id, "transfer_received", {
         "amount": amount,
         "from_user": db.users[from_id]["name"],
-        "transaction_id": tx["id"]
+        "transaction_id": tx.id
     })
 
     # Voice notifications
-    voice.speak_transaction(amount, "transfer_sent", {
-        "recipient_name": recipient["name"]
-    })
+    if notify:
+        voice.speak_transaction(amount, "transfer_sent", {
+            "recipient_name": recipient["name"]
+        })
     
     return {"ok": True, "tx": tx}
+
+def transfer_batch(from_id: str, items: list):
+    """Apply a chunk of transfers from one sender in order.
+
+    ``items`` are (to_id, amount, meta) tuples. Each transfer is checked
+    and applied on its own, so one failure does not affect the rest; a
+    single voice summary replaces the per-transfer announcements.
+    Velocity is checked against the bulk limits rather than the per-payment ones.
+    """
+    results = [transfer(from_id, to_id, amount, meta=meta, notify=False, limits=bulk_velocity)
+               for to_id, amount, meta in items]
+    sent = [r["tx"].amount for r in results if r["ok"]]
+    if sent:
+        voice.speak(f"Bulk transfer complete. {len(sent)} payments totalling ${sum(sent):.2f} sent")
+    return results
@@ -0,0 +1,129 @@
+import os
+import re
+import csv
+import json
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from .db import db
+from .bank import transfer_batch
+from .logger import log_info, log_error
+
+router = APIRouter()
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse for generators that are still reading the request body.
+
+    The stock response listens for a client disconnect by calling
+    receive() alongside the body iterator, which would steal the upload's
+    chunks; here the iterator is the only reader of receive().
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "100"))
+MAX_LINE_BYTES = 4096
+
+async def _lines(request: Request):
+    """Yield decoded lines from the request body without buffering it"""
+    buf = b""
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace").strip()
+        if len(buf) > MAX_LINE_BYTES:
+            raise ValueError("line too long")
+    if buf:
+        yield buf.decode("utf-8", errors="replace").strip()
+
+def _parse_row(line: str, fmt: str, columns: list) -> dict:
+    if fmt == "ndjson":
+        return json.loads(line)
+    values = next(csv.reader([line]))
+    return dict(zip(columns, (v.strip() for v in values)))
+
+def _validate_row(row: dict, user_id: str):
+    """Return (to_id, amount, meta) for a valid row, or raise ValueError"""
+    phone = str(row.get("to_phone", "")).strip()
+    if not re.match(r'^\+\d{11}$', phone):
+        raise ValueError("invalid to_phone")
+    try:
+        amount = round(float(row.get("amount")), 2)
+    except (TypeError, ValueError):
+        raise ValueError("invalid amount")
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    recipient = db.get_user_by_phone(phone)
+    if not recipient:
+        raise ValueError("recipient not found")
+    if recipient["id"] == user_id:
+        raise ValueError("cannot transfer to yourself")
+    return recipient["id"], amount, {"bulk": True, "reference": row.get("reference")}
+
+@router.post("/transfers/bulk")
+async def bulk_transfer(request: Request):
+    """Stream a CSV (to_phone,amount[,reference]) or NDJSON upload of transfers
+    from the logged-in user and stream back one NDJSON result per row"""
+    user_id = getattr(request.state, "user_id", None)
+    if not user_id:
+        return JSONResponse(status_code=401, content={"ok": False, "reason": "Invalid or missing authentication"})
+
+    content_type = request.headers.get("content-type", "")
+    fmt = "ndjson" if "ndjson" in content_type or "json" in content_type else "csv"
+    log_info(f"Bulk transfer upload from {user_id} ({fmt})")
+
+    async def results():
+        summary = {"type": "summary", "rows": 0, "succeeded": 0, "failed": 0, "total": 0.0}
+        columns = ["to_phone", "amount", "reference"]
+        chunk, chunk_rows = [], []
+        row_num = 0
+
+        async def flush():
+            # Apply the chunk off the event loop; the bank checks each sender balance atomically
+            applied = await run_in_threadpool(transfer_batch, user_id, chunk)
+            out = []
+            for num, res in zip(chunk_rows, applied):
+                if res["ok"]:
+                    summary["succeeded"] += 1
+                    summary["total"] += res["tx"].amount
+                    out.append({"row": num, "ok": True, "tx_id": res["tx"].id})
+                else:
+                    summary["failed"] += 1
+                    out.append({"row": num, "ok": False, "reason": res["reason"]})
+            chunk.clear()
+            chunk_rows.clear()
+            return "".join(json.dumps(r) + "\n" for r in out)
+
+        try:
+            async for line in _lines(request):
+                if not line:
+                    continue
+                if fmt == "csv" and row_num == 0 and "to_phone" in line:
+                    columns = [c.strip() for c in next(csv.reader([line]))]
+                    continue
+                row_num += 1
+                summary["rows"] += 1
+                try:
+                    chunk.append(_validate_row(_parse_row(line, fmt, columns), user_id))
+                    chunk_rows.append(row_num)
+                except (ValueError, TypeError, AttributeError) as e:
+                    summary["failed"] += 1
+                    yield json.dumps({"row": row_num, "ok": False, "reason": str(e) or "invalid row"}) + "\n"
+                    continue
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    yield await flush()
+            if chunk:
+                yield await flush()
+        except Exception as e:
+            log_error(f"Bulk transfer aborted at row {row_num}: {str(e)}")
+            summary["error"] = str(e)
+
+        summary["total"] = round(summary["total"], 2)
+        yield json.dumps(summary) + "\n"
+
+    return DuplexStreamingResponse(results(), media_type="application/x-ndjson")
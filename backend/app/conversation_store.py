@@ -0,0 +1,177 @@
+"""Pluggable stores for chat state awaiting confirmation (pending_actions)"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional
+
+from .expiry import ExpiryQueue
+from .logger import log_info, log_error
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+class MemoryConversationStore:
+    """Process-local store; correct only when the chat tier runs one worker.
+
+    One lock covers the actions and their expiry queue, so an expiry sweep
+    can't delete an action that a concurrent ``put`` has just replaced.
+    """
+    def __init__(self, ttl: float, on_expire: Callable[[str, dict], None], name: str = "pending_actions"):
+        self.name = name
+        self.ttl = ttl
+        self.expired_total = 0
+        self._actions: Dict[str, dict] = {}
+        self._on_expire = on_expire
+        self._lock = threading.Lock()
+        # Swept by expire_due below under the store lock, never by the queue's own expire_due
+        self._expiry = ExpiryQueue(name, ttl, on_expire=None)
+
+    def put(self, user_id: str, action: dict):
+        with self._lock:
+            self._actions[user_id] = action
+            self._expiry.schedule(user_id)
+
+    def get(self, user_id: str) -> Optional[dict]:
+        return self._actions.get(user_id)
+
+    def pop(self, user_id: str, default=None) -> Optional[dict]:
+        """Atomically remove and return a user's pending action"""
+        with self._lock:
+            self._expiry.cancel(user_id)
+            return self._actions.pop(user_id, default)
+
+    def expire_due(self, now: float = None) -> int:
+        expired = []
+        with self._lock:
+            # pop_due only returns keys whose current generation is due, and no put
+            # can reschedule a key between that check and the pop below
+            for user_id in self._expiry.pop_due(now):
+                action = self._actions.pop(user_id, None)
+                if action:
+                    expired.append((user_id, action))
+        for user_id, action in expired:
+            try:
+                self._on_expire(user_id, action)
+            except Exception as e:
+                log_error(f"Expiry callback failed for {self.name}:{user_id}", e)
+        self.expired_total += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._actions.clear()
+            self._expiry.clear()
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._actions
+
+    def __len__(self):
+        return len(self._actions)
+
+class SQLiteConversationStore:
+    """Store shared by every worker process on the host through one SQLite file.
+
+    Each thread keeps its own connection. Pops and expiry sweeps run in
+    ``BEGIN IMMEDIATE`` transactions, so exactly one worker gets a given
+    action even when several race on the same user.
+    """
+    def __init__(self, path: str, ttl: float, on_expire: Callable[[str, dict], None],
+                 name: str = "pending_actions"):
+        self.name = name
+        self.path = path
+        self.ttl = ttl
+        self.expired_total = 0
+        self._on_expire = on_expire
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS pending_actions ("
+            " user_id TEXT PRIMARY KEY, action TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS pending_actions_expiry ON pending_actions (expires_at)")
+        log_info(f"Conversation store using SQLite at {path}")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, user_id: str, action: dict):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO pending_actions (user_id, action, expires_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(action, default=str), time.time() + self.ttl)
+        )
+
+    def get(self, user_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT action FROM pending_actions WHERE user_id = ? AND expires_at > ?",
+            (user_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pop(self, user_id: str, default=None) -> Optional[dict]:
+        """Atomically remove and return a user's pending action"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT action, expires_at FROM pending_actions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row:
+                conn.execute("DELETE FROM pending_actions WHERE user_id = ?", (user_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not row or row[1] <= time.time():
+            return default  # Expired rows are reported by expire_due
+        return json.loads(row[0])
+
+    def expire_due(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT user_id, action FROM pending_actions WHERE expires_at <= ?", (now,)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM pending_actions WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for user_id, action in rows:
+            try:
+                self._on_expire(user_id, json.loads(action))
+            except Exception as e:
+                log_error(f"Expiry callback failed for {self.name}:{user_id}", e)
+        self.expired_total += len(rows)
+        return len(rows)
+
+    def clear(self):
+        """Drop only expired rows: live ones belong to other workers or must survive a restart"""
+        self._conn().execute("DELETE FROM pending_actions WHERE expires_at <= ?", (time.time(),))
+
+    def __contains__(self, user_id: str) -> bool:
+        return self._conn().execute(
+            "SELECT 1 FROM pending_actions WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM pending_actions").fetchone()[0]
+
+def create_conversation_store(ttl: float, on_expire: Callable[[str, dict], None]):
+    """Build the store selected by CONVERSATION_STORE (memory or sqlite)"""
+    backend = os.getenv("CONVERSATION_STORE", "memory")
+    if backend == "sqlite":
+        path = os.getenv("CONVERSATION_DB_PATH", os.path.join(DATA_DIR, "conversations.db"))
+        return SQLiteConversationStore(path, ttl, on_expire)
+    if backend != "memory":
+        log_error(f"Unknown CONVERSATION_STORE={backend!r}, using memory")
+    return MemoryConversationStore(ttl, on_expire)
@@ -1,26 +1,109 @@
-from typing import Dict, List
+from typing import Callable, Dict, List, Tuple
 from uuid import uuid4
+from threading import Lock, RLock
+import os
 import time
 from .logger import log_info, log_error
+from .expiry import ExpiryQueue, expiry_scheduler
+from .events import broker
+from .analytics import rollups
+from .versions import versions
+from .inventory import inventory
+from .models import Activity, Order, Transaction
+
+PENDING_ORDER_TTL = float(os.getenv("PENDING_ORDER_TTL", "900"))
+CANCELLED_ORDER_RETENTION = float(os.getenv("CANCELLED_ORDER_RETENTION", "604800"))
+
+class LazyCollection:
+    """Database attribute that can be loaded on first access.
+
+    Only consulted while the attribute is missing from the instance
+    ``__dict__`` (see ``Database.defer``); once loaded, lookups bypass it.
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        instance.materialize(self.name)
+        return instance.__dict__[self.name]
 
 class Database:
+    users = LazyCollection()
+    users_by_phone = LazyCollection()
+    bank_accounts = LazyCollection()
+    transactions = LazyCollection()
+    user_transactions = LazyCollection()
+    activities = LazyCollection()
+    products = LazyCollection()
+    banks = LazyCollection()
+    brands = LazyCollection()
+    shop_id = LazyCollection()
+    activity_log = LazyCollection()
+    orders = LazyCollection()
+    user_orders = LazyCollection()
+
     def __init__(self):
+        self._deferred: Dict[str, Tuple[Tuple[str, ...], Callable[[], dict]]] = {}
+        self._load_lock = RLock()
         self.users: Dict[str, dict] = {}
+        self.users_by_phone: Dict[str, dict] = {}  # phone -> user
         self.sessions: Dict[str, str] = {}  # token -> user_id
         self.bank_accounts: Dict[str, dict] = {}
-        self.transactions: List[dict] = []
-        self.activities: List[dict] = []
+        self.transactions: List[Transaction] = []
+        self.user_transactions: Dict[str, List[Transaction]] = {}  # user_id -> transactions, oldest first
+        self.activities: List[Activity] = []
         self.products: Dict[str, dict] = {}
         self.banks: Dict[str, dict] = {}
         self.brands: Dict[str, dict] = {}
         self.shop_id: str = None
-        self.activity_log: Dict[str, List[dict]] = {}
-        self.orders: Dict[str, dict] = {}  # Store orders
-        self.pending_orders: Dict[str, dict] = {}  # Store pending orders
+        self.activity_log: Dict[str, List[Activity]] = {}
+        self.orders: Dict[str, Order] = {}  # Store orders
+        self.pending_orders: Dict[str, Order] = {}  # Store pending orders
+        self.user_orders: Dict[str, List[str]] = {}  # user_id -> order ids, oldest first
+        # Striped per-order locks: confirm, cancel and expiry each settle a pending order exactly once
+        self._order_locks = [Lock() for _ in range(64)]
+
+        # Pending orders are cancelled after a TTL; cancelled orders are dropped after a retention period
+        self.pending_order_expiry = expiry_scheduler.register(
+            ExpiryQueue("pending_orders", PENDING_ORDER_TTL, self._expire_pending_order)
+        )
+        self.cancelled_order_expiry = expiry_scheduler.register(
+            ExpiryQueue("cancelled_orders", CANCELLED_ORDER_RETENTION, self._drop_cancelled_order)
+        )
+        expiry_scheduler.register_gauge("pending_orders", lambda: len(self.pending_orders))
+        expiry_scheduler.register_gauge("orders", lambda: len(self.orders))
 
         # Initialize default brands first
         self._init_default_brands()
 
+    def defer(self, names: Tuple[str, ...], loader: Callable[[], dict]):
+        """Drop the named collections and load them together with loader() on first access.
+
+        loader returns a dict with a value for each name; collections that
+        share objects must be deferred together.
+        """
+        with self._load_lock:
+            for name in names:
+                self.__dict__.pop(name, None)
+                self._deferred[name] = (names, loader)
+
+    def materialize(self, name: str):
+        """Load a deferred collection (and the ones deferred with it) now"""
+        with self._load_lock:
+            entry = self._deferred.get(name)
+            if entry is None:
+                if name not in self.__dict__:
+                    raise AttributeError(name)
+                return
+            names, loader = entry
+            values = loader()
+            for n in names:
+                self.__dict__[n] = values[n]
+                self._deferred.pop(n, None)
+            log_info(f"Loaded {', '.join(names)}")
+
     def _init_default_brands(self):
         """Initialize default brands with fixed IDs"""
         self.brands = {
@@ -38,6 +121,25 @@ class Database:
             }
         }
         
+    def add_user(self, user: dict):
+        """Add a user and index it by phone"""
+        self.users[user["id"]] = user
+        self.users_by_phone[user["phone"]] = user
+
+    def get_user_by_phone(self, phone: str) -> dict:
+        return self.users_by_phone.get(phone)
+
+    def add_transaction(self, tx: Transaction):
+        """Record a transaction globally and in both parties' histories"""
+        self.transactions.append(tx)
+        self.user_transactions.setdefault(tx.from_id, []).append(tx)
+        if tx.to_id != tx.from_id:
+            self.user_transactions.setdefault(tx.to_id, []).append(tx)
+
+    def get_user_transactions(self, user_id: str) -> List[Transaction]:
+        """A user's sent and received transactions, oldest first"""
+        return self.user_transactions.get(user_id, [])
+
     def get_bank_name(self, bank_id: str) -> str:
         return self.banks.get(bank_id, {}).get("name", "Unknown Bank")
     
@@ -161,16 +263,8 @@ class Database:
             if not isinstance(user_id, str):
                 raise ValueError(f"Invalid user_id: {user_id}")
                 
-            # Create activity entry
-            activity = {
-                "id": str(uuid4()),
-                "user_id": user_id,
-                "type": activity_type,
-                "timestamp": time.time()
-            }
-            
-            # Add all additional details
-            activity.update(details)
+            # Create activity entry with all additional details
+            activity = Activity(str(uuid4()), user_id, activity_type, time.time(), details)
             
             # Initialize user's activity log if needed
             if user_id not in self.activity_log:
@@ -179,6 +273,8 @@ class Database:
             # Add to both user's log and global activities
             self.activity_log[user_id].append(activity)
             self.activities.append(activity)
+            versions.bump(user_id, "activities")
+            broker.publish(user_id, "activity", activity)
             
             log_info(f"Activity logged for user {user_id}: {activity_type}")
             return activity
@@ -187,7 +283,7 @@ class Database:
             log_error(f"Failed to log activity for user {user_id}: {str(e)}")
             raise
     
-    def get_user_activities(self, user_id: str, activity_type: str = None) -> List[dict]:
+    def get_user_activities(self, user_id: str, activity_type: str = None) -> List[Activity]:
         """Get user activities, optionally filtered by type"""
         try:
             if not user_id:
@@ -195,25 +291,25 @@ class Database:
                 
             # Get activities from both sources
             user_activities = self.activity_log.get(user_id, [])
-            global_activities = [a for a in self.activities if a.get("user_id") == user_id]
+            global_activities = [a for a in self.activities if a.user_id == user_id]
             
             # Combine and deduplicate
             all_activities = []
             seen = set()
             
             for activity in user_activities + global_activities:
-                if activity["id"] not in seen:
-                    seen.add(activity["id"])
+                if activity.id not in seen:
+                    seen.add(activity.id)
                     all_activities.append(activity)
             
             # Filter by type if specified
             if activity_type:
-                all_activities = [a for a in all_activities if a.get("type") == activity_type]
+                all_activities = [a for a in all_activities if a.type == activity_type]
                 
             # Sort by timestamp descending
             return sorted(
                 all_activities,
-                key=lambda x: x.get("timestamp", 0),
+                key=lambda x: x.timestamp,
                 reverse=True
             )
             
@@ -222,59 +318,98 @@ class Database:
             return []  # Return empty list on error
         
     def create_pending_order(self, user_id: str, products: List[dict], total: float) -> str:
-        """Create a pending order for the user"""
+        """Create a pending order for the user, reserving its stock (raises OutOfStockError)"""
         order_id = str(uuid4())
-        order = {
-            "id": order_id,
-            "user_id": user_id,
-            "products": products,
-            "total": total,
-            "status": "pending",
-            "created_at": time.time()
-        }
+        inventory.reserve(order_id, [self.products.get(p["id"], p) for p in products])
+        order = Order(order_id, user_id, products, total, "pending", time.time())
         self.pending_orders[order_id] = order
+        self.user_orders.setdefault(user_id, []).append(order_id)
+        self.pending_order_expiry.schedule(order_id)
         return order_id
         
-    def confirm_order(self, order_id: str, payment_id: str = None) -> dict:
+    def confirm_order(self, order_id: str, payment_id: str = None) -> Order:
         """Confirm a pending order after successful payment"""
-        if order_id not in self.pending_orders:
-            raise KeyError(f"Order not found: {order_id}")
-            
-        order = self.pending_orders.pop(order_id)
-        order["status"] = "completed"
-        order["completed_at"] = time.time()
-        order["payment_id"] = payment_id
-        
-        self.orders[order_id] = order
+        with self._order_lock(order_id):
+            # Checked under the lock: the order may have just expired or been cancelled
+            order = self.pending_orders.get(order_id)
+            if order is None or order.status != "pending":
+                raise KeyError(f"Order not found: {order_id}")
+
+            del self.pending_orders[order_id]
+            self.pending_order_expiry.cancel(order_id)
+            inventory.commit(order_id)
+            order.status = "completed"
+            order.completed_at = time.time()
+            order.payment_id = payment_id
+
+            self.orders[order_id] = order
+
+        # Purchases count towards the spending rollups by product category
+        for p in order.products:
+            category = self.products.get(p["id"], {}).get("category", "Other")
+            rollups.record(order.user_id, category, spent=p["price"], ts=order.completed_at)
         
         # Log activity
         self.log_activity(
-            order["user_id"],
+            order.user_id,
             "purchase",
             {
                 "order_id": order_id,
-                "products": [p["title"] for p in order["products"]],
-                "total": order["total"],
-                "timestamp": order["completed_at"]
+                "products": [p["title"] for p in order.products],
+                "total": order.total,
+                "timestamp": order.completed_at
             }
         )
         
         return order
         
-    def cancel_order(self, order_id: str, reason: str = None) -> dict:
+    def cancel_order(self, order_id: str, reason: str = None) -> Order:
         """Cancel a pending order"""
-        if order_id not in self.pending_orders:
-            raise KeyError(f"Order not found: {order_id}")
-            
-        order = self.pending_orders.pop(order_id)
-        order["status"] = "cancelled"
-        order["cancelled_at"] = time.time()
-        order["cancel_reason"] = reason
-        
-        self.orders[order_id] = order
+        with self._order_lock(order_id):
+            order = self.pending_orders.get(order_id)
+            if order is None or order.status != "pending":
+                raise KeyError(f"Order not found: {order_id}")
+
+            del self.pending_orders[order_id]
+            self.pending_order_expiry.cancel(order_id)
+            inventory.release(order_id)
+            order.status = "cancelled"
+            order.cancelled_at = time.time()
+            order.cancel_reason = reason
+
+            self.orders[order_id] = order
+            self.cancelled_order_expiry.schedule(order_id)
         return order
+
+    def _order_lock(self, order_id: str) -> Lock:
+        return self._order_locks[hash(order_id) % len(self._order_locks)]
+
+    def _expire_pending_order(self, order_id: str):
+        """Cancel a pending order whose TTL ran out"""
+        try:
+            order = self.cancel_order(order_id, "Expired")
+        except KeyError:
+            return  # Confirmed or cancelled first; cancel_order re-checks under the order lock
+        self.log_activity(order.user_id, "cancellation", {
+            "kind": "order",
+            "order_id": order_id,
+            "total": order.total,
+            "reason": "expired"
+        })
+
+    def _drop_cancelled_order(self, order_id: str):
+        """Remove a cancelled order, and its entry in the user's index, once its retention period is over"""
+        with self._order_lock(order_id):
+            order = self.orders.get(order_id)
+            if order is None or order.status != "cancelled":
+                return
+            del self.orders[order_id]
+        # Removed in place: list.remove and create_pending_order's append never lose each other's update
+        order_ids = self.user_orders.get(order.user_id)
+        if order_ids and order_id in order_ids:
+            order_ids.remove(order_id)
         
-    def get_order(self, order_id: str) -> dict:
+    def get_order(self, order_id: str) -> Order:
         """Get an order by ID"""
         if order_id in self.orders:
             return self.orders[order_id]
@@ -282,24 +417,29 @@ class Database:
             return self.pending_orders[order_id]
         raise KeyError(f"Order not found: {order_id}")
         
-    def get_user_orders(self, user_id: str, include_pending: bool = True) -> List[dict]:
-        """Get all orders for a user"""
+    def get_user_orders(self, user_id: str, include_pending: bool = True, status: str = None,
+                        limit: int = None, offset: int = 0) -> List[Order]:
+        """Get a user's orders, newest first, with optional status filter and pagination"""
+        order_ids = self.user_orders.get(user_id, [])
         orders = []
-        
-        # Get completed/cancelled orders
-        orders.extend([
-            order for order in self.orders.values()
-            if order["user_id"] == user_id
-        ])
-        
-        # Include pending orders if requested
-        if include_pending:
-            orders.extend([
-                order for order in self.pending_orders.values()
-                if order["user_id"] == user_id
-            ])
-            
-        return sorted(orders, key=lambda x: x["created_at"], reverse=True)
+        skipped = 0
+
+        # The index is kept in creation order, so walk it backwards instead of sorting
+        for order_id in reversed(order_ids):
+            order = self.orders.get(order_id) or self.pending_orders.get(order_id)
+            if order is None:
+                continue  # Being dropped after its retention period
+            if not include_pending and order.status == "pending":
+                continue
+            if status and order.status != status:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            orders.append(order)
+            if limit is not None and len(orders) >= limit:
+                break
+        return orders
 
 # Create global database instance
 db = Database()
@@ -0,0 +1,108 @@
+"""Process pool for RSA payload decryption used by the gateway"""
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional
+
+from .rsa_utils import KEY_DIR, KeyManager, key_manager
+from .logger import log_info, log_error
+
+# Keys loaded once per worker process by _init_worker
+_worker_keys: KeyManager = None
+
+def _init_worker(key_dir: str):
+    global _worker_keys
+    _worker_keys = KeyManager(key_dir)
+    _worker_keys.reload()
+
+def _decrypt_payload(token: str) -> dict:
+    """Runs inside a worker: RSA-decrypt and parse the payment JSON"""
+    return json.loads(_worker_keys.decrypt(token).decode())
+
+class DecryptPool:
+    """Runs RSA decryption in worker processes.
+
+    ``decrypt`` hands one payload to a worker, so concurrent /gateway/pay
+    requests decrypt on separate cores instead of contending for the
+    GIL. ``decrypt_many`` spreads a batch over all workers at once; it
+    backs /gateway/pay/batch, which then applies the payments in order.
+    With ``workers=0`` the pool is disabled and payloads are decrypted
+    inline with the keys loaded in this process.
+    """
+    def __init__(self, workers: int = 0, key_dir: str = KEY_DIR):
+        self.workers = workers
+        self.key_dir = key_dir
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """Spawn the worker processes (no-op if disabled or already running)"""
+        if self.workers <= 0 or self._executor is not None:
+            return
+        # Spawned, not forked: a fork would copy locks held by the speech, intent,
+        # expiry and key-loader threads. Workers load their own keys either way
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.key_dir,),
+        )
+        log_info(f"Decrypt pool started with {self.workers} workers")
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            log_info("Decrypt pool stopped")
+
+    def _decrypt_inline(self, token: str) -> dict:
+        return json.loads(key_manager.decrypt(token).decode())
+
+    def decrypt(self, b64cipher: str) -> dict:
+        """Decrypt a single payload, blocking until a worker returns it"""
+        if self._executor is None:
+            return self._decrypt_inline(b64cipher)
+        key_manager.wait()  # Workers load the key files, which may still be being generated
+        return self._executor.submit(_decrypt_payload, b64cipher).result()
+
+    def decrypt_many(self, payloads: Iterable[str]) -> List[dict]:
+        """Decrypt a batch in parallel; results keep the input order.
+
+        A payload that fails to decrypt yields its exception in place of
+        the dict so callers can report per-item errors.
+        """
+        payloads = list(payloads)
+        if self._executor is None:
+            futures = None
+        else:
+            key_manager.wait()
+            futures = [self._executor.submit(_decrypt_payload, p) for p in payloads]
+
+        results = []
+        for i, payload in enumerate(payloads):
+            try:
+                if futures is None:
+                    results.append(self._decrypt_inline(payload))
+                else:
+                    results.append(futures[i].result())
+            except Exception as e:
+                log_error(f"Batch decrypt failed for item {i}", e)
+                results.append(e)
+        return results
+
+def _workers_from_env() -> int:
+    value = os.getenv("GATEWAY_DECRYPT_WORKERS", "0")
+    if value == "auto":
+        return os.cpu_count() or 1
+    try:
+        return max(0, int(value))
+    except ValueError:
+        log_error(f"Invalid GATEWAY_DECRYPT_WORKERS={value!r}, decrypting inline")
+        return 0
+
+# Global instance, started/stopped by the app lifecycle in main.py
+decrypt_pool = DecryptPool(workers=_workers_from_env())
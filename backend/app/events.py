@@ -0,0 +1,115 @@
+"""Per-user event fan-out for the /events server-sent event stream"""
+import os
+import json
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Set
+
+from .logger import log_info, log_error
+from .speech import voice
+from .models import json_default
+
+# User of the request being handled; set by AuthMiddleware so events raised
+# without an explicit user (e.g. speech callbacks) can still be routed
+current_user_id: ContextVar = ContextVar("current_user_id", default=None)
+
+class Subscription:
+    """Bounded event buffer for one connected client.
+
+    Publishers may run on any thread; the buffer drops its oldest event
+    when full so a slow client can never hold up a payment.
+    """
+    def __init__(self, user_id: str, maxsize: int):
+        self.user_id = user_id
+        self.dropped = 0
+        self._events = deque(maxlen=maxsize)
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def push(self, event: dict):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def get(self, timeout: float):
+        """Return buffered events, waiting up to ``timeout`` seconds for one"""
+        if not self._events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        return events
+
+class EventBroker:
+    """Fans published events out to every subscription of the target user"""
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = Lock()
+        self.published = 0
+
+    def subscribe(self, user_id: str) -> Subscription:
+        """Must be called from the event loop that will consume the subscription"""
+        sub = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(sub)
+        log_info(f"Event stream opened for user {user_id}")
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+        log_info(f"Event stream closed for user {sub.user_id}")
+
+    def publish(self, user_id: str, event_type: str, data: dict):
+        """Queue an event for a user's open streams; a no-op if none are open"""
+        if not user_id:
+            return
+        subs = self._subscribers.get(user_id)
+        if not subs:
+            return
+        event = {"event": event_type, "data": data}
+        with self._lock:
+            subs = list(subs)
+        for sub in subs:
+            try:
+                sub.push(event)
+            except RuntimeError:
+                # Event loop already closed; the stream is going away
+                pass
+        self.published += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            subs = [s for group in self._subscribers.values() for s in group]
+        return {
+            "users": len(self._subscribers),
+            "subscriptions": len(subs),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subs)
+        }
+
+def format_sse(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], default=json_default)}\n\n"
+
+def _forward_speech(text: str):
+    """Speech callback: forward voice output to the current user's streams"""
+    try:
+        broker.publish(current_user_id.get(), "voice", {"text": text})
+    except Exception as e:
+        log_error(f"Failed to publish voice event: {str(e)}")
+
+# Global instance
+broker = EventBroker(queue_size=int(os.getenv("EVENT_QUEUE_SIZE", "100")))
+voice.register_speech_callback(_forward_speech)
@@ -0,0 +1,131 @@
+"""TTL expiry for pending confirmations, pending orders and other short-lived state"""
+import os
+import time
+from collections import deque
+from threading import Thread, Lock, Event
+from typing import Callable, Dict, Hashable, List, Optional
+
+from .logger import log_info, log_error
+
+class ExpiryQueue:
+    """FIFO of keys that expire a fixed TTL after they were scheduled.
+
+    Because every key in a queue shares the same TTL, deadlines are
+    appended in increasing order and the queue never needs re-sorting:
+    schedule, cancel and expire are all O(1) amortized. Cancelling or
+    rescheduling a key just bumps its generation; the stale deque entry
+    is skipped when it reaches the head.
+    """
+    def __init__(self, name: str, ttl: float, on_expire: Callable[[Hashable], None]):
+        self.name = name
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self._deadlines = deque()  # (expires_at, key, generation)
+        self._live: Dict[Hashable, int] = {}  # key -> current generation
+        self._generation = 0
+        self._lock = Lock()
+        self.expired_total = 0
+
+    def schedule(self, key: Hashable, now: float = None):
+        """(Re)start the TTL for a key"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._generation += 1
+            self._live[key] = self._generation
+            self._deadlines.append((now + self.ttl, key, self._generation))
+
+    def cancel(self, key: Hashable):
+        """Forget a key that was resolved before its deadline"""
+        with self._lock:
+            self._live.pop(key, None)
+
+    def pop_due(self, now: float = None) -> List[Hashable]:
+        """Remove and return all keys whose deadline has passed"""
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, key, generation = self._deadlines.popleft()
+                if self._live.get(key) == generation:
+                    del self._live[key]
+                    due.append(key)
+            # Drop stale heads left behind by cancellations so memory stays bounded
+            while self._deadlines and self._live.get(self._deadlines[0][1]) != self._deadlines[0][2]:
+                self._deadlines.popleft()
+        return due
+
+    def expire_due(self, now: float = None) -> int:
+        """Run on_expire for every due key; returns how many expired"""
+        due = self.pop_due(now)
+        for key in due:
+            try:
+                self.on_expire(key)
+            except Exception as e:
+                log_error(f"Expiry callback failed for {self.name}:{key}", e)
+        self.expired_total += len(due)
+        return len(due)
+
+    def clear(self):
+        with self._lock:
+            self._deadlines.clear()
+            self._live.clear()
+
+    def __len__(self):
+        return len(self._live)
+
+class ExpiryScheduler:
+    """Sweeps registered ExpiryQueues from a background thread"""
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._queues: Dict[str, ExpiryQueue] = {}
+        self._gauges: Dict[str, Callable[[], int]] = {}
+        self._stop = Event()
+        self._worker: Optional[Thread] = None
+
+    def register(self, queue):
+        """Sweep ``queue``: an ExpiryQueue or any object with the same
+        name/ttl/expired_total/expire_due/clear/__len__ interface"""
+        self._queues[queue.name] = queue
+        return queue
+
+    def register_gauge(self, name: str, fn: Callable[[], int]):
+        """Track the size of a backing collection alongside the queues"""
+        self._gauges[name] = fn
+
+    def sweep(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        return sum(queue.expire_due(now) for queue in self._queues.values())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                expired = self.sweep()
+                if expired:
+                    log_info(f"Expired {expired} pending entries")
+            except Exception as e:
+                log_error("Expiry sweep failed", e)
+
+    def start(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def clear(self):
+        for queue in self._queues.values():
+            queue.clear()
+
+    def gauges(self) -> dict:
+        stats = {}
+        for name, queue in self._queues.items():
+            stats[name] = {"scheduled": len(queue), "expired_total": queue.expired_total, "ttl": queue.ttl}
+        for name, fn in self._gauges.items():
+            stats.setdefault(name, {})["size"] = fn()
+        return stats
+
+# Global instance, started/stopped by the app lifecycle in main.py
+expiry_scheduler = ExpiryScheduler(interval=float(os.getenv("EXPIRY_SWEEP_INTERVAL", "1")))
@@ -0,0 +1,111 @@
+import io
+import csv
+import json
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .db import db
+from .models import Activity, Transaction
+from .logger import log_info
+
+router = APIRouter()
+
+ROWS_PER_CHUNK = 500
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+TRANSACTION_FIELDS = ["id", "time", "direction", "counterparty", "amount", "order_id"]
+ACTIVITY_FIELDS = ["id", "time", "type", "details"]
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat() if ts else ""
+
+def _user_name(user_id: str) -> str:
+    return db.users.get(user_id, {}).get("name", user_id)
+
+def _transaction_row(user_id: str, tx: Transaction) -> dict:
+    sent = tx.from_id == user_id
+    return {
+        "id": tx.id,
+        "time": _iso(tx.ts),
+        "direction": "sent" if sent else "received",
+        "counterparty": _user_name(tx.to_id if sent else tx.from_id),
+        "amount": tx.amount,
+        "order_id": tx.meta.get("order_id") or ""
+    }
+
+def _activity_row(activity: Activity) -> dict:
+    return {
+        "id": activity.id,
+        "time": _iso(activity.timestamp),
+        "type": activity.type,
+        "details": activity.details
+    }
+
+def _stream_rows(history: list, to_row, fmt: str, fields: list):
+    """Serialize a history list in chunks of ROWS_PER_CHUNK rows.
+
+    Only rows present when the export starts are written; the list is
+    read by index, so it is never copied and appends during the export
+    are ignored.
+    """
+    end = len(history)
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields) if fmt == "csv" else None
+    if writer:
+        writer.writeheader()
+
+    for start in range(0, end, ROWS_PER_CHUNK):
+        for i in range(start, min(start + ROWS_PER_CHUNK, end)):
+            row = to_row(history[i])
+            if writer:
+                if "details" in row:
+                    row["details"] = json.dumps(row["details"], default=str)
+                writer.writerow(row)
+            else:
+                buf.write(json.dumps(row, default=str) + "\n")
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    if end == 0 and writer:
+        yield buf.getvalue()
+
+def _export_response(user_id: str, kind: str, fmt: str, rows):
+    log_info(f"Exporting {kind} for user {user_id} as {fmt}")
+    return StreamingResponse(
+        rows,
+        media_type=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{kind}-{user_id}.{fmt}"'}
+    )
+
+def _check_access(request: Request, user_id: str, fmt: str):
+    if user_id != getattr(request.state, "user_id", None):
+        return JSONResponse(status_code=403, content={"detail": "Access denied"})
+    if fmt not in FORMATS:
+        return JSONResponse(status_code=400, content={"detail": "format must be csv or ndjson"})
+    return None
+
+@router.get("/export/{user_id}/transactions")
+async def export_transactions(request: Request, user_id: str, format: str = "csv"):
+    """Stream a user's full transaction history, oldest first"""
+    error = _check_access(request, user_id, format)
+    if error:
+        return error
+    rows = _stream_rows(
+        db.get_user_transactions(user_id),
+        lambda tx: _transaction_row(user_id, tx),
+        format,
+        TRANSACTION_FIELDS
+    )
+    return _export_response(user_id, "transactions", format, rows)
+
+@router.get("/export/{user_id}/activities")
+async def export_activities(request: Request, user_id: str, format: str = "csv"):
+    """Stream a user's full activity history, oldest first"""
+    error = _check_access(request, user_id, format)
+    if error:
+        return error
+    rows = _stream_rows(db.activity_log.get(user_id, []), _activity_row, format, ACTIVITY_FIELDS)
+    return _export_response(user_id, "activities", format, rows)
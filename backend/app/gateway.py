@@ -1,32 +1,167 @@
+import os
 import json
+import hashlib
+from contextlib import contextmanager, ExitStack
+from threading import Lock
+from typing import Annotated, Callable, List, Optional
 from pydantic import BaseModel
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, Request
+from fastapi.responses import JSONResponse
 
-from .rsa_utils import load_private_key, decrypt_with_private
+from .decrypt_pool import decrypt_pool
+from .rsa_utils import key_manager
+from .idempotency import payment_replay_cache, IdempotencyConflict
+from .events import current_user_id
 from .bank import transfer
+from .ratelimit import rate_limiter, limited_response
+from .logger import log_error
 from .db import db
 
 class PaymentRequest(BaseModel):
     payload: str
+    idempotency_key: Optional[str] = None
+
+class PaymentBatchRequest(BaseModel):
+    payments: List[PaymentRequest]
+
+GATEWAY_BATCH_MAX = int(os.getenv("GATEWAY_BATCH_MAX", "100"))
 
 router = APIRouter()
 
-priv = load_private_key()
+# Striped locks so duplicates of one payment apply once without serializing unrelated payments
+_payment_stripes = [Lock() for _ in range(64)]
 
-@router.post("/gateway/pay")
-def gateway_pay(data: PaymentRequest):
-    try:
-        pt = decrypt_with_private(data.payload, priv)
-        payment_data = json.loads(pt.decode())
-    except Exception as e:
-        return {"ok": False, "reason": f"decrypt failed: {e}"}
+@contextmanager
+def _payment_locks(keys: List[Optional[str]]):
+    """Hold the stripe locks of all given keys, taken in stripe order so they can't deadlock"""
+    stripes = sorted({hash(key) % len(_payment_stripes) for key in keys if key})
+    with ExitStack() as stack:
+        for i in stripes:
+            stack.enter_context(_payment_stripes[i])
+        yield
 
+def apply_payment(payment_data: dict):
+    """Apply a decrypted payment to the ledger"""
     # expected: {from_id,to_id,amount,order_id,session_token}
     from_id = payment_data.get("from_id")
     to_id = payment_data.get("to_id")
     amount = float(payment_data.get("amount", 0))
     meta = {"order_id": payment_data.get("order_id")}
 
-    res = transfer(from_id, to_id, amount, meta=meta)
+    return transfer(from_id, to_id, amount, meta=meta)
+
+def _replay(result: dict) -> dict:
+    return {**result, "replayed": True}
+
+def _payload_key(payload: str) -> str:
+    return f"payload:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+def _fingerprint(payment_data: dict) -> str:
+    """What makes two payments the same; RSA-OAEP ciphertexts of one payment all differ"""
+    fields = {"from_id": payment_data.get("from_id"), "to_id": payment_data.get("to_id"),
+              "amount": float(payment_data.get("amount", 0)), "order_id": payment_data.get("order_id")}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+def _cached(key_key: Optional[str], fingerprint: str, other_keys: list) -> Optional[dict]:
+    """Replay-cache lookup; the explicit key must match the payment it was first used with"""
+    if key_key:
+        cached = payment_replay_cache.get([key_key], fingerprint)
+        if cached is not None:
+            return cached
+    return payment_replay_cache.get(other_keys)
+
+def _key_conflict() -> JSONResponse:
+    return JSONResponse(status_code=409, content={"detail": "Idempotency key was already used for a different payment"})
+
+@router.get("/gateway/public-key")
+def gateway_public_key():
+    """Current encryption key; prefix payloads with its kid as '<kid>.<base64>'"""
+    kid, pem = key_manager.public_pem()
+    return {"kid": kid, "public_key": pem}
+
+def _pay(payload: str, explicit_key: Optional[str], decrypt: Callable[[str], dict]) -> dict:
+    """Answer a payment from the replay cache, or decrypt and apply it once.
+
+    Raises IdempotencyConflict if the explicit key was used for another payment.
+    """
+    # Explicit keys belong to the authenticated user and may only be reused for the same
+    # payment; compared on the decrypted fields, so re-encrypted retries still replay
+    key_key = f"key:{current_user_id.get()}:{explicit_key}" if explicit_key else None
+    payload_key = _payload_key(payload)
+
+    # Fast path before any RSA work: a retry of the exact same ciphertext, unless its
+    # key holds some other result, which needs the decrypted fields to judge
+    cached = payment_replay_cache.get([payload_key])
+    if cached is not None and (key_key is None or payment_replay_cache.get([key_key]) in (None, cached)):
+        return _replay(cached)
+
+    try:
+        payment_data = decrypt(payload)
+    except Exception as e:
+        return {"ok": False, "reason": f"decrypt failed: {e}"}
+
+    fingerprint = _fingerprint(payment_data)
+    order_id = payment_data.get("order_id")
+    order_key = f"order:{payment_data.get('from_id')}:{order_id}" if order_id else None
+
+    # Re-check and apply holding the lock of every key the payment has, so any
+    # two requests for the same payment apply once whichever keys they carry
+    with _payment_locks([key_key, payload_key, order_key]):
+        cached = _cached(key_key, fingerprint, [payload_key, order_key])
+        if cached is not None:
+            return _replay(cached)
+
+        res = apply_payment(payment_data)
+        # Only successful payments are remembered; a failed one changed nothing
+        if res.get("ok"):
+            res = {**res, "tx": res["tx"].to_dict()}
+            payment_replay_cache.put([key_key, payload_key, order_key], res, fingerprint)
     return res
+
+@router.post("/gateway/pay")
+def gateway_pay(
+    data: PaymentRequest,
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+):
+    # Retries are answered from the replay cache before any RSA work; the
+    # decrypt runs on the pool and the ledger update stays in this process
+    try:
+        return _pay(data.payload, data.idempotency_key or idempotency_key, decrypt_pool.decrypt)
+    except IdempotencyConflict:
+        return _key_conflict()
+
+@router.post("/gateway/pay/batch")
+def gateway_pay_batch(request: Request, data: PaymentBatchRequest):
+    """Decrypt a batch of payments in parallel on the pool, then apply them in order"""
+    if len(data.payments) > GATEWAY_BATCH_MAX:
+        return JSONResponse(status_code=422, content={"detail": f"At most {GATEWAY_BATCH_MAX} payments per batch"})
+    # Each payment costs a token, so a batch can't outrun the single-payment limit
+    user_id = getattr(request.state, "user_id", None)
+    ip = request.client.host if request.client else None
+    limited = rate_limiter.check(request.url.path, user_id, ip, items=len(data.payments))
+    if limited:
+        limit, retry_after = limited
+        log_error(f"Rate limit '{limit.name}' hit by {user_id or ip} ({len(data.payments)} payments)")
+        return limited_response(limit, retry_after)
+
+    # Only payments whose exact ciphertext isn't in the replay cache are decrypted
+    pending = [i for i, p in enumerate(data.payments) if payment_replay_cache.get([_payload_key(p.payload)]) is None]
+    decrypted = dict(zip(pending, decrypt_pool.decrypt_many(data.payments[i].payload for i in pending)))
+
+    def decrypt_from_batch(i):
+        def decrypt(payload):
+            if i not in decrypted:
+                return decrypt_pool.decrypt(payload)  # Evicted from the cache since the check
+            if isinstance(decrypted[i], Exception):
+                raise decrypted[i]
+            return decrypted[i]
+        return decrypt
+
+    results = []
+    for i, p in enumerate(data.payments):
+        try:
+            results.append(_pay(p.payload, p.idempotency_key, decrypt_from_batch(i)))
+        except IdempotencyConflict:
+            results.append({"ok": False, "reason": "idempotency key was already used for a different payment"})
+    return {"results": results}
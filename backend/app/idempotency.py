@@ -0,0 +1,79 @@
+"""Bounded, time-windowed replay cache for idempotent payments"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable, Optional
+
+class IdempotencyConflict(ValueError):
+    """An idempotency key was reused for a different request"""
+
+class ReplayCache:
+    """Maps idempotency keys to the result of the first successful call.
+
+    Entries are kept in insertion order, which is also expiry order since
+    every entry gets the same TTL, so both lookups and evictions are O(1).
+    Each entry also keeps a fingerprint of the request that produced it.
+    """
+    def __init__(self, ttl: float = 86400, max_entries: int = 100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, fingerprint, result)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict_expired(self, now: float):
+        while self._entries:
+            key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, keys: Iterable[Optional[str]], fingerprint: str = None) -> Optional[dict]:
+        """Return the cached result for the first key that is present.
+
+        With a fingerprint, raises IdempotencyConflict if that entry was
+        stored for a different request.
+        """
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            for key in keys:
+                if key and key in self._entries:
+                    _, stored, result = self._entries[key]
+                    if fingerprint is not None and stored is not None and stored != fingerprint:
+                        raise IdempotencyConflict(key)
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def put(self, keys: Iterable[Optional[str]], result: dict, fingerprint: str = None):
+        """Store a result under every given key"""
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            for key in keys:
+                if not key:
+                    continue
+                self._entries[key] = (now + self.ttl, fingerprint, result)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# Global instance for /gateway/pay
+payment_replay_cache = ReplayCache(
+    ttl=float(os.getenv("GATEWAY_IDEMPOTENCY_TTL", "86400")),
+    max_entries=int(os.getenv("GATEWAY_IDEMPOTENCY_MAX_ENTRIES", "100000")),
+)
@@ -0,0 +1,282 @@
+"""Tiered intent resolution: regex fast path, cached and batched model fallback"""
+import os
+import re
+import json
+import time
+import queue
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from threading import Thread, Lock
+from typing import Callable, Dict, List, Optional
+
+from .logger import log_info, log_error
+
+try:
+    from groq import Groq
+except ImportError:  # Optional: only needed for INTENT_BACKEND=groq
+    Groq = None
+
+INTENT_TYPES = ("confirm", "buy", "transfer", "balance", "spending")
+# Intents a model backend may return. Confirming a pending payment is left to the
+# exact regex fast path, so "absolutely not" can never be read as a yes
+MODEL_INTENT_TYPES = ("buy", "transfer", "balance", "spending")
+
+def normalize(message: str) -> str:
+    """Cache key for an utterance: case, punctuation and spacing don't change the intent"""
+    msg = re.sub(r"[^\w\s$+.]", " ", message.lower())
+    return re.sub(r"\s+", " ", msg).strip(" .")
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def validate_intent(intent) -> Optional[dict]:
+    """Coerce a backend answer into the shape parse_command returns, or None"""
+    if not isinstance(intent, dict) or intent.get("type") not in MODEL_INTENT_TYPES:
+        return None
+    kind = intent["type"]
+    if kind == "balance":
+        return {"type": kind}
+    if kind == "buy":
+        item = str(intent.get("item") or "").strip()
+        if not item:
+            return None
+        return {"type": "buy", "item": item, "max_price": _float(intent.get("max_price")),
+                "min_rating": _float(intent.get("min_rating"))}
+    if kind == "transfer":
+        amount = _float(intent.get("amount"))
+        phone = intent.get("to_phone")
+        name = intent.get("to_name")
+        if not amount or amount <= 0 or not (phone or name):
+            return None
+        if phone and not re.fullmatch(r"\+\d{11}", str(phone)):
+            return None
+        return {"type": "transfer", "amount": amount, "to_phone": phone, "to_name": name}
+    period = intent.get("period") if intent.get("period") in ("day", "month", "all") else "all"
+    return {"type": "spending", "category": intent.get("category"), "period": period}
+
+class StubIntentBackend:
+    """Deterministic local backend for tests and benchmarks only (INTENT_BACKEND=stub).
+
+    Understands a fixed vocabulary of paraphrases the regex parser misses.
+    ``latency`` simulates the round trip of a remote model per batch.
+    """
+    _BALANCE = re.compile(r"\b(?:funds|how rich|left in|what do i have|savings)\b")
+    _BUY = ("grab", "acquire", "shop for", "pick up", "i'd like", "id like", "hook me up with")
+    _TRANSFER = re.compile(r"\b(?:remit|move|venmo|reimburse|shoot)\b")
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def classify_batch(self, messages: List[str]) -> List[Optional[dict]]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._classify(m) for m in messages]
+
+    def _classify(self, msg: str) -> Optional[dict]:
+        amount = re.search(r"\$?(\d+(?:\.\d{1,2})?)", msg)
+        if self._TRANSFER.search(msg) and amount:
+            phone = re.search(r"\+\d{11}", msg)
+            name = re.search(r"\bto\s+(\w+)", msg)
+            return {"type": "transfer", "amount": amount.group(1),
+                    "to_phone": phone.group(0) if phone else None,
+                    "to_name": None if phone or not name else name.group(1)}
+        for phrase in self._BUY:
+            match = re.search(rf"\b{re.escape(phrase)}\b", msg)
+            if match:
+                item = msg[match.end():]
+                item = re.sub(r"\b(?:under|below|for)\s+\$?\d+(?:\.\d{1,2})?", "", item)
+                return {"type": "buy", "item": item.strip(" a"), "max_price": amount.group(1) if amount else None}
+        if self._BALANCE.search(msg):
+            return {"type": "balance"}
+        return None
+
+class GroqIntentBackend:
+    """Classifies a batch of utterances with one Groq chat completion"""
+    PROMPT = (
+        "You classify messages sent to a shopping and payments assistant. "
+        "For each numbered message return an intent object with a 'type' of "
+        "buy (item, max_price, min_rating), transfer (amount, to_phone "
+        "or to_name), balance, spending (category, period: day|month|all), or "
+        "null if none applies. Answer with JSON: {\"intents\": [...]} in input order."
+    )
+
+    def __init__(self, api_key: str, model: str):
+        if Groq is None:
+            raise RuntimeError("INTENT_BACKEND=groq requires the groq package")
+        self.client = Groq(api_key=api_key)
+        self.model = model
+        self.calls = 0
+
+    def classify_batch(self, messages: List[str]) -> List[Optional[dict]]:
+        self.calls += 1
+        numbered = "\n".join(f"{i + 1}. {m}" for i, m in enumerate(messages))
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "system", "content": self.PROMPT}, {"role": "user", "content": numbered}],
+            response_format={"type": "json_object"},
+            temperature=0,
+        )
+        intents = json.loads(completion.choices[0].message.content).get("intents", [])
+        return (list(intents) + [None] * len(messages))[:len(messages)]
+
+class IntentResolver:
+    """Resolves chat messages to intents, cheapest tier first.
+
+    1. The regex parser (``fast_path``) answers most messages in-process.
+    2. An LRU of normalized utterance -> intent answers repeated phrasings.
+    3. The model backend answers the rest, but never with "confirm": only
+       the fast path can confirm a pending payment. Concurrent misses are queued
+       and sent as one batch per ``batch_window`` seconds (up to
+       ``max_batch`` messages); identical in-flight utterances share one
+       slot in the batch. Up to ``concurrency`` batches are in flight.
+    """
+    def __init__(self, fast_path: Callable[[str], Optional[dict]], backend=None,
+                 cache_size: int = 10000, batch_window: float = 0.005,
+                 max_batch: int = 16, timeout: float = 2.0, concurrency: int = 4):
+        self.fast_path = fast_path
+        self.backend = backend
+        self.cache_size = cache_size
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._cache: "OrderedDict[str, Optional[dict]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = Lock()
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._worker: Optional[Thread] = None
+        self._calls = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="intent-backend")
+        self.fast_hits = 0
+        self.cache_hits = 0
+        self.backend_messages = 0
+        self.batches = 0
+        self.unresolved = 0
+
+    def resolve(self, message: str) -> Optional[dict]:
+        intent = self.fast_path(message)
+        if intent is not None:
+            self.fast_hits += 1
+            return intent
+        if self.backend is None:
+            self.unresolved += 1
+            return None
+
+        key = normalize(message)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                intent = self._cache[key]
+                if intent is None:
+                    self.unresolved += 1
+                return dict(intent) if intent else None
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future()
+                self._queue.put(key)
+                self._ensure_worker()
+
+        try:
+            intent = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            log_error(f"Intent backend timed out for '{key}'")
+            intent = None
+        except Exception as e:
+            log_error(f"Intent backend failed for '{key}'", e)
+            intent = None
+        if intent is None:
+            self.unresolved += 1
+        return dict(intent) if intent else None
+
+    def _ensure_worker(self):
+        # Caller holds the lock
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = Thread(target=self._run, name="intent-batcher", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._calls.submit(self._classify, batch)
+
+    def _classify(self, keys: List[str]):
+        try:
+            results = [validate_intent(i) for i in self.backend.classify_batch(keys)]
+            error = None
+        except Exception as e:
+            results, error = [None] * len(keys), e
+
+        with self._lock:
+            self.batches += 1
+            self.backend_messages += len(keys)
+            for key, intent in zip(keys, results):
+                if error is None:
+                    self._cache[key] = intent
+                    self._cache.move_to_end(key)
+                future = self._inflight.pop(key)
+                if error is None:
+                    future.set_result(intent)
+                else:
+                    future.set_exception(error)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__ if self.backend else None,
+                "fast_hits": self.fast_hits,
+                "cache_hits": self.cache_hits,
+                "backend_messages": self.backend_messages,
+                "batches": self.batches,
+                "unresolved": self.unresolved,
+                "cached": len(self._cache)
+            }
+
+def backend_from_env():
+    """Model backend selected by INTENT_BACKEND (groq, none, or stub for benchmarks and tests).
+
+    Unset means groq when GROQ_API_KEY is configured and none otherwise.
+    """
+    name = os.getenv("INTENT_BACKEND") or ("groq" if os.getenv("GROQ_API_KEY") else "none")
+    if name == "none":
+        return None
+    if name == "groq":
+        try:
+            return GroqIntentBackend(os.getenv("GROQ_API_KEY"), os.getenv("INTENT_MODEL", "llama-3.1-8b-instant"))
+        except Exception as e:
+            log_error("Groq intent backend unavailable, using the regex parser only", e)
+            return None
+    if name != "stub":
+        log_error(f"Unknown INTENT_BACKEND={name!r}, using the regex parser only")
+        return None
+    log_info("Using the local stub intent backend (benchmarks and tests only)")
+    return StubIntentBackend()
+
+def create_resolver(fast_path: Callable[[str], Optional[dict]]) -> IntentResolver:
+    return IntentResolver(
+        fast_path,
+        backend_from_env(),
+        cache_size=int(os.getenv("INTENT_CACHE_SIZE", "10000")),
+        batch_window=float(os.getenv("INTENT_BATCH_WINDOW_MS", "5")) / 1000,
+        max_batch=int(os.getenv("INTENT_MAX_BATCH", "16")),
+        timeout=float(os.getenv("INTENT_BACKEND_TIMEOUT", "2")),
+        concurrency=int(os.getenv("INTENT_BACKEND_CONCURRENCY", "4")),
+    )
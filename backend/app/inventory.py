@@ -0,0 +1,109 @@
+"""Stock reservations: reserve on pending order, commit on confirm, release on cancel"""
+from threading import Lock
+from typing import Dict, List, Tuple
+
+class OutOfStockError(ValueError):
+    pass
+
+class Inventory:
+    """Tracks units held by pending orders against each product's ``stock``.
+
+    ``product["stock"]`` stays the on-hand count (so it shows up in the
+    catalog and in snapshots) and only drops when an order is confirmed.
+    Available stock is on-hand minus reserved. Every product has its own
+    lock; an order spanning several products takes their locks in id
+    order, so concurrent reservations never deadlock and never oversell.
+    Products without a ``stock`` field are not limited.
+    """
+    def __init__(self):
+        self._locks: Dict[str, Lock] = {}
+        self._reserved: Dict[str, int] = {}  # product id -> units held by pending orders
+        self._orders: Dict[str, List[Tuple[dict, int]]] = {}  # order id -> (product, units)
+        self._lock = Lock()
+        self.reserved_total = 0
+        self.committed_total = 0
+        self.released_total = 0
+        self.rejected_total = 0
+
+    def _product_lock(self, product_id: str) -> Lock:
+        lock = self._locks.get(product_id)
+        if lock is None:
+            with self._lock:
+                lock = self._locks.setdefault(product_id, Lock())
+        return lock
+
+    def available(self, product: dict) -> float:
+        if "stock" not in product:
+            return float("inf")
+        return product["stock"] - self._reserved.get(product["id"], 0)
+
+    def reserve(self, order_id: str, products: List[dict]):
+        """Hold one unit of each listed product for an order, all or nothing"""
+        units: Dict[str, int] = {}
+        by_id: Dict[str, dict] = {}
+        for product in products:
+            if "stock" in product:
+                units[product["id"]] = units.get(product["id"], 0) + 1
+                by_id[product["id"]] = product
+
+        locks = [self._product_lock(pid) for pid in sorted(units)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for pid, count in units.items():
+                if self.available(by_id[pid]) < count:
+                    with self._lock:
+                        self.rejected_total += 1
+                    raise OutOfStockError(f"{by_id[pid]['title']} is out of stock")
+            for pid, count in units.items():
+                self._reserved[pid] = self._reserved.get(pid, 0) + count
+            with self._lock:
+                self._orders[order_id] = [(by_id[pid], count) for pid, count in units.items()]
+                self.reserved_total += 1
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _settle(self, order_id: str, commit: bool) -> bool:
+        with self._lock:
+            held = self._orders.pop(order_id, None)
+            if held is None:
+                return False  # Already settled, or nothing was limited
+            if commit:
+                self.committed_total += 1
+            else:
+                self.released_total += 1
+        for product, count in held:
+            with self._product_lock(product["id"]):
+                self._reserved[product["id"]] -= count
+                if commit:
+                    product["stock"] -= count
+        return True
+
+    def commit(self, order_id: str) -> bool:
+        """The order was paid: its reserved units leave the stock"""
+        return self._settle(order_id, commit=True)
+
+    def release(self, order_id: str) -> bool:
+        """The order was cancelled or expired: its units become available again"""
+        return self._settle(order_id, commit=False)
+
+    def reset(self):
+        with self._lock:
+            self._reserved.clear()
+            self._orders.clear()
+            self.reserved_total = self.committed_total = self.released_total = self.rejected_total = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_reservations": len(self._orders),
+                "reserved_units": sum(self._reserved.values()),
+                "reserved_total": self.reserved_total,
+                "committed_total": self.committed_total,
+                "released_total": self.released_total,
+                "rejected_total": self.rejected_total
+            }
+
+# Global instance
+inventory = Inventory()
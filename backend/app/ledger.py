@@ -0,0 +1,141 @@
+"""Bank-sharded ledger: per-bank writers with two-phase commit across banks"""
+from threading import RLock, Lock
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+from .logger import log_error
+from .balance_history import balance_history
+
+class LedgerShard:
+    """Owns balance mutations for the accounts of one bank.
+
+    Every mutation happens under the shard's lock, so a shard is a single
+    writer. The coordinator only talks to a shard through
+    transfer_local/prepare/commit/abort keyed by txid. All shards live
+    in this process.
+    """
+    def __init__(self, bank_id: str):
+        self.bank_id = bank_id
+        self._lock = RLock()
+        self._prepared: Dict[str, Tuple[dict, float, bool]] = {}  # txid -> (account, amount, is debit)
+        self.local_commits = 0
+        self.prepared_total = 0
+        self.aborted_total = 0
+
+    def transfer_local(self, sender: dict, recipient: dict, amount: float) -> Optional[str]:
+        """Move money between two accounts of this bank; returns a failure reason or None"""
+        with self._lock:
+            if sender["balance"] < amount:
+                return "insufficient funds"
+            balance_history.record(sender, -amount)
+            balance_history.record(recipient, amount)
+            sender["balance"] -= amount
+            recipient["balance"] += amount
+            self.local_commits += 1
+            return None
+
+    def prepare_debit(self, txid: str, account: dict, amount: float) -> Optional[str]:
+        """Phase one on the paying bank: reserve the funds by debiting them now"""
+        with self._lock:
+            if account["balance"] < amount:
+                return "insufficient funds"
+            # The event is only logged at commit, but the log must start from the pre-debit balance
+            balance_history.open(account)
+            account["balance"] -= amount
+            self._prepared[txid] = (account, amount, True)
+            self.prepared_total += 1
+            return None
+
+    def prepare_credit(self, txid: str, account: dict, amount: float) -> Optional[str]:
+        """Phase one on the receiving bank: record the credit without applying it"""
+        with self._lock:
+            if account.get("bank_id") != self.bank_id:
+                return "account does not belong to bank"
+            self._prepared[txid] = (account, amount, False)
+            self.prepared_total += 1
+            return None
+
+    def commit(self, txid: str):
+        with self._lock:
+            account, amount, debit = self._prepared.pop(txid)
+            balance_history.record(account, -amount if debit else amount)
+            if not debit:
+                account["balance"] += amount  # Debits were applied at prepare time
+
+    def abort(self, txid: str):
+        with self._lock:
+            entry = self._prepared.pop(txid, None)
+            if entry is None:
+                return
+            account, amount, debit = entry
+            if debit:
+                account["balance"] += amount  # Give the reserved funds back
+            self.aborted_total += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "local_commits": self.local_commits,
+                "prepared_total": self.prepared_total,
+                "aborted_total": self.aborted_total,
+                "in_doubt": len(self._prepared)
+            }
+
+class ShardedLedger:
+    """Routes transfers to the shards of the banks involved"""
+    def __init__(self):
+        self._shards: Dict[str, LedgerShard] = {}
+        self._lock = Lock()
+        self.cross_shard_commits = 0
+
+    def shard(self, bank_id: str) -> LedgerShard:
+        shard = self._shards.get(bank_id)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.setdefault(bank_id, LedgerShard(bank_id))
+        return shard
+
+    def transfer(self, sender: dict, recipient: dict, amount: float) -> Optional[str]:
+        """Apply a positive transfer between two accounts; returns a failure reason or None.
+
+        Same-bank transfers commit on one shard. Cross-bank transfers run
+        a two-phase commit so neither shard's lock is held while the
+        other one works, and a failed prepare leaves both balances intact.
+        The amount is validated by bank.transfer, the only caller.
+        """
+        source = self.shard(sender["bank_id"])
+        target = self.shard(recipient["bank_id"])
+        if source is target:
+            return source.transfer_local(sender, recipient, amount)
+
+        txid = str(uuid4())
+        reason = source.prepare_debit(txid, sender, amount)
+        if reason:
+            return reason
+        reason = target.prepare_credit(txid, recipient, amount)
+        if reason:
+            source.abort(txid)
+            log_error(f"Cross-bank transfer {txid} aborted: {reason}")
+            return reason
+
+        target.commit(txid)
+        source.commit(txid)
+        with self._lock:
+            self.cross_shard_commits += 1
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._shards.clear()
+            self.cross_shard_commits = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            shards = dict(self._shards)
+        return {
+            "cross_shard_commits": self.cross_shard_commits,
+            "shards": {bank_id: shard.stats() for bank_id, shard in shards.items()}
+        }
+
+# Global instance
+ledger = ShardedLedger()
@@ -0,0 +1,297 @@
+"""Append-only, memory-mapped file of every committed transfer
+
+File layout::
+
+    header (64 bytes): b"AIPLEDG1" | u32 version | u32 record size | u64 record count
+    records:           RECORD.size bytes each, in commit order
+
+User ids are interned as ints; the sidecar ``<path>.ids`` lists them one
+per line, so line N is user N. The transaction id is kept as its 16 raw
+uuid bytes and a record's position is its int id. The writer fills in a
+record before it publishes the new count in the header, so readers in
+any process can map the file and never see a partial record.
+
+Only one process may write a file: ``open()`` takes an exclusive
+``flock`` on it and fails if another writer holds it. Appends land in
+the page cache, so a crash of the app loses nothing; the writer syncs
+the records and the ids sidecar to disk every
+``LEDGER_FILE_FLUSH_RECORDS`` appends or ``LEDGER_FILE_FLUSH_SECONDS``
+seconds (checked on append) and on close, so an OS crash or power loss
+can lose at most the appends since the last sync.
+
+Usage: python -m app.ledger_file info [path]
+       python -m app.ledger_file totals [path]
+"""
+import os
+import sys
+import mmap
+import time
+import struct
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from .logger import log_info, log_error
+
+try:
+    import numpy as np
+except ImportError:  # Optional: only needed for the array views
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; the writer then refuses to open
+    fcntl = None
+
+MAGIC = b"AIPLEDG1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+HEADER_SIZE = 64
+COUNT_OFFSET = 16
+COUNT = struct.Struct("<Q")
+# id (uuid bytes), ts, amount, from user, to user, type code; padded to 48 bytes
+RECORD = struct.Struct("<16sddIIH6x")
+# Type code -> name; append only, codes are stored in the file
+TYPES = ("transfer",)
+TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+INITIAL_CAPACITY = 65536  # records; the file doubles when full
+
+LEDGER_FILE_PATH = os.getenv("LEDGER_FILE_PATH")
+LEDGER_FILE_FLUSH_RECORDS = int(os.getenv("LEDGER_FILE_FLUSH_RECORDS", "1000"))
+LEDGER_FILE_FLUSH_SECONDS = float(os.getenv("LEDGER_FILE_FLUSH_SECONDS", "1"))
+
+RECORD_DTYPE = np.dtype({
+    "names": ["id", "ts", "amount", "from", "to", "type"],
+    "formats": ["V16", "<f8", "<f8", "<u4", "<u4", "<u2"],
+    "offsets": [0, 16, 24, 32, 36, 40],
+    "itemsize": RECORD.size,
+}) if np is not None else None
+
+def _check_header(mm, path: str) -> int:
+    magic, version, record_size, count = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"Not a version {VERSION} ledger file: {path}")
+    return count
+
+class LedgerFile:
+    """Single writer for a ledger file; appends take a lock and cost a few microseconds.
+
+    ``flush_records`` and ``flush_seconds`` set how often appends are
+    synced to disk (0 disables that trigger; both 0 syncs only on close).
+    """
+    def __init__(self, path: Optional[str], flush_records: int = LEDGER_FILE_FLUSH_RECORDS,
+                 flush_seconds: float = LEDGER_FILE_FLUSH_SECONDS):
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self._lock = Lock()
+        self._file = None
+        self._mm: Optional[mmap.mmap] = None
+        self._ids_file = None
+        self._ids: Dict[str, int] = {}  # user id -> interned int
+        self.count = 0
+        self.capacity = 0
+        self._synced_count = 0
+        self._synced_at = 0.0
+        self.syncs = 0
+
+    @property
+    def running(self) -> bool:
+        return self._mm is not None
+
+    def open(self):
+        if self._mm is not None or not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if fcntl is None:
+            raise RuntimeError(f"Cannot lock {self.path}: the ledger file needs fcntl (POSIX)")
+        # Created without truncating, so a second writer can't clobber the file before the lock check
+        self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            raise RuntimeError(f"{self.path} is already open for writing by another process") from None
+        exists = os.path.getsize(self.path) >= HEADER_SIZE
+        if not exists:
+            self._file.truncate(HEADER_SIZE + INITIAL_CAPACITY * RECORD.size)
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+            self._file.flush()
+        self._map()
+        self.count = _check_header(self._mm, self.path)
+
+        ids_path = f"{self.path}.ids"
+        if os.path.exists(ids_path):
+            with open(ids_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        self._ids[line[:-1]] = len(self._ids)
+        self._ids_file = open(ids_path, "a", encoding="utf-8")
+        self._synced_count, self._synced_at = self.count, time.monotonic()
+        log_info(f"Appending transactions to {self.path} ({self.count} records)")
+
+    def _map(self):
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        self.capacity = (len(self._mm) - HEADER_SIZE) // RECORD.size
+
+    def _grow(self):
+        old = self._mm
+        self._file.truncate(HEADER_SIZE + self.capacity * 2 * RECORD.size)
+        self._map()
+        old.close()
+
+    def _intern(self, user_id: str) -> int:
+        n = self._ids.get(user_id)
+        if n is None:
+            # Written before any record refers to it
+            self._ids_file.write(user_id + "\n")
+            self._ids_file.flush()
+            n = self._ids[user_id] = len(self._ids)
+        return n
+
+    def append(self, tx) -> Optional[int]:
+        """Append a committed transaction; returns its record number, or None when not open"""
+        if self._mm is None:
+            return None
+        with self._lock:
+            if self._mm is None:
+                return None
+            try:
+                if self.count == self.capacity:
+                    self._grow()
+                RECORD.pack_into(self._mm, HEADER_SIZE + self.count * RECORD.size,
+                                 UUID(tx.id).bytes, tx.ts, tx.amount,
+                                 self._intern(tx.from_id), self._intern(tx.to_id), TYPE_CODES[tx.type])
+                self.count += 1
+                COUNT.pack_into(self._mm, COUNT_OFFSET, self.count)
+                if self._sync_due():
+                    self._sync()
+                return self.count - 1
+            except Exception as e:
+                # The transfer is already committed in memory; don't fail it over the audit copy
+                log_error(f"Failed to append transaction {tx.id} to {self.path}", e)
+                return None
+
+    def _sync_due(self) -> bool:
+        if self.flush_records and self.count - self._synced_count >= self.flush_records:
+            return True
+        return bool(self.flush_seconds) and time.monotonic() - self._synced_at >= self.flush_seconds
+
+    def _sync(self):
+        # Caller holds the lock. Ids first, so synced records never name a user the sidecar lacks
+        os.fsync(self._ids_file.fileno())
+        self._mm.flush()
+        self._synced_count, self._synced_at = self.count, time.monotonic()
+        self.syncs += 1
+
+    def close(self):
+        with self._lock:
+            if self._mm is None:
+                return
+            self._sync()
+            self._mm.close()
+            self._mm = None
+            self._file.close()  # Also releases the flock
+            self._ids_file.close()
+
+    def stats(self) -> dict:
+        return {"path": self.path if self.running else None, "records": self.count, "users": len(self._ids),
+                "unsynced": self.count - self._synced_count, "syncs": self.syncs}
+
+class LedgerFileReader:
+    """Read-only mapping of a ledger file, usable from any process.
+
+    ``array()`` is a NumPy structured array over the mapping itself, so
+    scans and aggregations never copy the records into Python objects.
+    Call ``refresh()`` to see records appended since the reader opened.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._ids_file = None
+        self._mm: Optional[mmap.mmap] = None
+        self._size = 0
+        self._ids_pending = b""
+        self.user_ids: List[str] = []
+        self.count = 0
+        self.refresh()
+
+    def refresh(self) -> int:
+        """Pick up newly appended records; returns the record count"""
+        size = os.fstat(self._file.fileno()).st_size
+        if size != self._size:
+            # The old mapping stays valid for any array still using it
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._size = size
+        # The writer may have grown the file and appended past this mapping since the size was read
+        self.count = min(_check_header(self._mm, self.path), (len(self._mm) - HEADER_SIZE) // RECORD.size)
+        if self._ids_file is None and os.path.exists(f"{self.path}.ids"):
+            self._ids_file = open(f"{self.path}.ids", "rb")
+        if self._ids_file is not None:
+            data = self._ids_pending + self._ids_file.read()
+            *lines, self._ids_pending = data.split(b"\n")
+            self.user_ids.extend(line.decode() for line in lines)
+        return self.count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def array(self):
+        """All records as a zero-copy NumPy structured array (fields as in RECORD_DTYPE)"""
+        if np is None:
+            raise RuntimeError("LedgerFileReader.array() requires numpy")
+        return np.frombuffer(self._mm, dtype=RECORD_DTYPE, count=self.count, offset=HEADER_SIZE)
+
+    def records(self) -> Iterator[Tuple[bytes, float, float, int, int, int]]:
+        """Records as (id bytes, ts, amount, from, to, type) tuples; works without numpy"""
+        with memoryview(self._mm) as view:
+            yield from RECORD.iter_unpack(view[HEADER_SIZE:HEADER_SIZE + self.count * RECORD.size])
+
+    def transaction(self, n: int) -> dict:
+        """Record n in the shape of Transaction.to_dict(), minus meta"""
+        tx_id, ts, amount, from_n, to_n, type_code = RECORD.unpack_from(self._mm, HEADER_SIZE + n * RECORD.size)
+        return {"id": str(UUID(bytes=tx_id)), "from": self.user_ids[from_n], "to": self.user_ids[to_n],
+                "amount": amount, "ts": ts, "type": TYPES[type_code]}
+
+    def totals(self) -> Dict[str, dict]:
+        """Amount sent and received and transfer count per user id"""
+        n_users = len(self.user_ids)
+        if np is not None:
+            records = self.array()
+            sent = np.bincount(records["from"], weights=records["amount"], minlength=n_users)
+            received = np.bincount(records["to"], weights=records["amount"], minlength=n_users)
+            count = np.bincount(records["from"], minlength=n_users) + np.bincount(records["to"], minlength=n_users)
+            sent, received, count = sent.tolist(), received.tolist(), count.tolist()
+        else:
+            sent, received, count = [0.0] * n_users, [0.0] * n_users, [0] * n_users
+            for _, _, amount, from_n, to_n, _ in self.records():
+                sent[from_n] += amount
+                received[to_n] += amount
+                count[from_n] += 1
+                count[to_n] += 1
+        return {
+            user_id: {"sent": sent[n], "received": received[n], "count": count[n]}
+            for n, user_id in enumerate(self.user_ids) if count[n]
+        }
+
+# Global writer; appends only when LEDGER_FILE_PATH is set
+ledger_file = LedgerFile(LEDGER_FILE_PATH)
+
+def main(argv):
+    command = argv[0] if argv else "info"
+    path = argv[1] if len(argv) > 1 else LEDGER_FILE_PATH
+    if command not in ("info", "totals") or not path:
+        print(__doc__)
+        return 1
+    reader = LedgerFileReader(path)
+    if command == "info":
+        print(f"{path}: {len(reader)} records, {len(reader.user_ids)} users, "
+              f"{os.path.getsize(path) / 1e6:.1f}MB mapped, numpy {'available' if np is not None else 'not installed'}")
+    else:
+        for user_id, t in sorted(reader.totals().items(), key=lambda kv: -kv[1]["sent"]):
+            print(f"{user_id}  sent {t['sent']:12.2f}  received {t['received']:12.2f}  transfers {t['count']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,21 +1,76 @@
+import os
 import re
 import time
 from uuid import uuid4
+from pathlib import Path
 from typing import List
 from pydantic import BaseModel
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
 
 from .db import db
-from . import rsa_utils
-from .agent import router as agent_router
+from .rsa_utils import key_manager
+from .agent import router as agent_router, intent_resolver
 from .logger import log_info, log_error, log_request, log_response
 from .gateway import router as gateway_router
+from .bulk import router as bulk_router
+from .export import router as export_router
 from .logger import log_request, log_response, log_info
 from .speech import voice
+from .decrypt_pool import decrypt_pool
+from .expiry import expiry_scheduler
+from .events import broker, current_user_id, format_sse
+from .ledger import ledger
+from .balance_history import balance_history
+from .analytics import rollups, PERIODS
+from .snapshot import SNAPSHOT_PATH, load_snapshot, save_snapshot
+from .ratelimit import rate_limiter, limited_response
+from .idempotency import payment_replay_cache
+from .versions import versions, etag_matches
+from .static_assets import AssetTable
+from .inventory import inventory
+from .admission import admission
+from .tracing import trace_recorder
+from .ledger_file import ledger_file
+from .velocity import velocity, bulk_velocity
+
+SNAPSHOT_SAVE_ON_SHUTDOWN = os.getenv("SNAPSHOT_SAVE_ON_SHUTDOWN", "0") == "1"
+
+# Built frontend (for production), loaded into memory at startup if present
+frontend_dist = Path(__file__).parent.parent.parent / "frontend" / "dist"
+static_assets = AssetTable(frontend_dist)
+# First path segments owned by the API; filled in at startup from the registered routes
+api_prefixes = ("docs", "redoc", "openapi.json")
+
+class StaticFrontendMiddleware:
+    """Serves the built frontend from memory ahead of the API middleware stack.
+
+    Known files are served as-is; any other non-API path gets index.html
+    so client-side routes work. Missing hashed assets fall through to a 404.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD") and static_assets.assets:
+            path = scope["path"].lstrip("/")
+            if path.split("/", 1)[0] not in api_prefixes:
+                asset = static_assets.get(path)
+                if asset is None and not path.startswith("assets/"):
+                    asset = static_assets.get("index.html")
+                if asset is not None:
+                    headers = Headers(scope=scope)
+                    response = static_assets.response(
+                        asset, headers.get("accept-encoding", ""), headers.get("if-none-match")
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
 
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
@@ -24,6 +79,21 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         log_response(response.status_code)
         return response
 
+class TraceMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        if not trace_recorder.running:
+            return await call_next(request)
+        # Streaming uploads are recorded without their body so they keep streaming
+        body = b"" if request.url.path.startswith("/transfers/bulk") else await request.body()
+        start = time.monotonic()
+        response = await call_next(request)
+        trace_recorder.record(
+            request.method, request.url.path, request.url.query,
+            getattr(request.state, "user_id", None), body,
+            response.status_code, start, time.monotonic() - start
+        )
+        return response
+
 class AuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         # Always allow CORS preflight requests
@@ -36,6 +106,9 @@ class AuthMiddleware(BaseHTTPMiddleware):
 
         try:
             auth_header = request.headers.get("Authorization")
+            # EventSource cannot send headers, so event streams may pass the token as a query param
+            if not auth_header and request.url.path.startswith("/events/") and request.query_params.get("token"):
+                auth_header = "Bearer " + request.query_params["token"]
             if not auth_header or not auth_header.startswith("Bearer "):
                 log_error(f"Missing/invalid auth header for {request.method} {request.url.path}")
                 return JSONResponse(
@@ -56,6 +129,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
             # Add user_id to request state
             user_id = db.sessions[token]
             request.state.user_id = user_id
+            current_user_id.set(user_id)
             
             # Log successful auth
             log_info(f"Auth success: {token[:8]}... -> User {user_id}")
@@ -70,6 +144,60 @@ class AuthMiddleware(BaseHTTPMiddleware):
                 headers={"Access-Control-Allow-Origin": "*"}
             )
 
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        # Runs after auth, so signed-in requests are limited per user as well as per IP
+        user_id = getattr(request.state, "user_id", None)
+        ip = request.client.host if request.client else None
+        limited = rate_limiter.check(request.url.path, user_id, ip)
+        if limited:
+            limit, retry_after = limited
+            log_error(f"Rate limit '{limit.name}' hit by {user_id or ip}")
+            return limited_response(limit, retry_after)
+        return await call_next(request)
+
+class AdmissionMiddleware:
+    """Admits, queues or sheds requests per route class (see admission.py).
+
+    A plain ASGI middleware so the slot is held until the response body
+    has been sent, streaming bodies included, not just until the
+    endpoint returns.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = admission.classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        if not await admission.acquire(route_class):
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Server busy - please try again shortly"},
+                headers={"Retry-After": "1", "Access-Control-Allow-Origin": "*"}
+            )
+            await response(scope, receive, send)
+            return
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release(time.monotonic() - start)
+
+def _conditional(request: Request, response: Response, user_id: str, resource: str):
+    """Tag the response with the resource's ETag; returns a 304 if the client's copy is current.
+
+    The ETag is taken before the data is read, so a concurrent write can
+    only make the tag older than the body, never newer.
+    """
+    etag = versions.etag(user_id, resource)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 class LoginData(BaseModel):
     phone: str
 
@@ -77,11 +205,16 @@ app = FastAPI()
 
 # Add middlewares
 app.add_middleware(LoggingMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(TraceMiddleware)
 app.add_middleware(AuthMiddleware)
 
 # Include routers
 app.include_router(agent_router)
 app.include_router(gateway_router)
+app.include_router(bulk_router)
+app.include_router(export_router)
 
 # Add CORS middleware
 app.add_middleware(
@@ -90,25 +223,69 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],  # Allow all headers for development
-    expose_headers=["Content-Type"]
+    expose_headers=["Content-Type", "ETag", "Retry-After"]
 )
 
+# Outermost, so static files skip auth, rate limiting and logging
+app.add_middleware(StaticFrontendMiddleware)
+
 @app.on_event("startup")
 def startup_event():
-    rsa_utils.ensure_keys()
+    # Loads (or generates) the gateway keys in the background
+    key_manager.start()
     # Clear existing data and reseed
     db.products.clear()
     db.users.clear()
+    db.users_by_phone.clear()
     db.sessions.clear()
     db.bank_accounts.clear()
     db.transactions.clear()
+    db.user_transactions.clear()
     db.activities.clear()
     db.orders.clear()
     db.pending_orders.clear()
+    db.user_orders.clear()
+    ledger.reset()
+    balance_history.reset()
+    rollups.reset()
+    expiry_scheduler.clear()
+    rate_limiter.reset()
+    velocity.reset()
+    bulk_velocity.reset()
+    versions.reset()
+    inventory.reset()
+    admission.reset()
+    payment_replay_cache.clear()
     
-    # Load fresh seed data
-    from . import seed_data
-    seed_data.seed()
+    if os.path.exists(SNAPSHOT_PATH):
+        # Collections are decoded from the snapshot on first use
+        load_snapshot(db, SNAPSHOT_PATH)
+    else:
+        # Load fresh seed data
+        from . import seed_data
+        seed_data.seed()
+
+    global api_prefixes
+    api_prefixes = tuple(sorted(
+        {route.path.strip("/").split("/")[0] for route in app.routes if isinstance(route, APIRoute)}
+        | {"docs", "redoc", "openapi.json"}
+    ))
+    if frontend_dist.exists():
+        static_assets.load()
+
+    decrypt_pool.start()
+    expiry_scheduler.start()
+    trace_recorder.start()
+    ledger_file.open()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    decrypt_pool.stop()
+    expiry_scheduler.stop()
+    trace_recorder.stop()
+    ledger_file.close()
+    if SNAPSHOT_SAVE_ON_SHUTDOWN:
+        save_snapshot(db, SNAPSHOT_PATH)
 
 @app.post("/login")
 async def login(data: LoginData):
@@ -130,7 +307,7 @@ async def login(data: LoginData):
                 content={"detail": "Invalid phone format. Must be +XXXXXXXXXXX (11 digits)"}
             )
 
-        user = next((u for u in db.users.values() if u["phone"] == data.phone), None)
+        user = db.get_user_by_phone(data.phone)
         if not user:
             return JSONResponse(
                 status_code=404,
@@ -237,10 +414,15 @@ async def get_user(request: Request, user_id: str):
         return JSONResponse(status_code=500, content={"detail": "Failed to get user info"})
 
 @app.get("/balances/{user_id}")
-async def get_balance(request: Request, user_id: str):
+async def get_balance(request: Request, response: Response, user_id: str, at: float = None):
+    """Current balance, or the balance as of unix time ``at``"""
     try:
         if user_id != request.state.user_id:
             return JSONResponse(status_code=403, content={"detail": "Access denied"})
+        if at is None:
+            not_modified = _conditional(request, response, user_id, "balance")
+            if not_modified:
+                return not_modified
         
         user = db.users.get(user_id)
         if not user:
@@ -249,6 +431,11 @@ async def get_balance(request: Request, user_id: str):
         account = db.bank_accounts.get(user["account_id"])
         if not account:
             return JSONResponse(status_code=404, content={"detail": "Account not found"})
+
+        if at is not None:
+            balance = balance_history.balance_at(account["id"], at)
+            # No history means the balance never changed
+            return {"balance": account["balance"] if balance is None else balance, "at": at}
             
         return {"balance": account["balance"]}
     except Exception as e:
@@ -256,36 +443,42 @@ async def get_balance(request: Request, user_id: str):
         return JSONResponse(status_code=500, content={"detail": "Failed to get balance"})
 
 @app.get("/transactions/{user_id}")
-async def get_user_transactions(request: Request, user_id: str):
+async def get_user_transactions(request: Request, response: Response, user_id: str):
     """Get all transactions (sent and received) for a user"""
     try:
         if user_id != request.state.user_id:
             return JSONResponse(status_code=403, content={"detail": "Access denied"})
+        not_modified = _conditional(request, response, user_id, "transactions")
+        if not_modified:
+            return not_modified
         
-        txs = [tx for tx in db.transactions if tx["from"] == user_id or tx["to"] == user_id]
         # Enrich with user names
-        for tx in txs:
-            tx["from_user"] = db.users[tx["from"]]["name"]
-            tx["to_user"] = db.users[tx["to"]]["name"]
-        return sorted(txs, key=lambda x: x["ts"], reverse=True)
+        return [
+            {**tx.to_dict(), "from_user": db.users[tx.from_id]["name"], "to_user": db.users[tx.to_id]["name"]}
+            for tx in reversed(db.get_user_transactions(user_id))
+        ]
     except Exception as e:
         log_info(f"Error getting transactions: {str(e)}")
         return JSONResponse(status_code=500, content={"detail": "Failed to get transactions"})
 
 @app.get("/activities/{user_id}")
-async def get_user_activities(request: Request, user_id: str, activity_type: str = None):
+async def get_user_activities(request: Request, response: Response, user_id: str, activity_type: str = None):
     """Get user activities, optionally filtered by type"""
     try:
         # Verify user access
         if user_id != request.state.user_id:
             log_error(f"Access denied: {request.state.user_id} tried to access activities of {user_id}")
             return JSONResponse(status_code=403, content={"detail": "Access denied"})
+        not_modified = _conditional(request, response, user_id, "activities")
+        if not_modified:
+            return not_modified
             
         # Get user activities
         activities = db.get_user_activities(user_id, activity_type)
         log_info(f"Retrieved {len(activities)} activities for user {user_id}")
         
         # Add user info to activities
+        activities = [activity.to_dict() for activity in activities]
         for activity in activities:
             if "from_user" in activity and activity["from_user"] in db.users:
                 activity["from_user_name"] = db.users[activity["from_user"]]["name"]
@@ -301,6 +494,81 @@ async def get_user_activities(request: Request, user_id: str, activity_type: str
             content={"detail": "Failed to retrieve activities"}
         )
 
+@app.get("/orders/{user_id}")
+async def get_user_orders(request: Request, user_id: str, status: str = None, limit: int = 20, offset: int = 0):
+    """Get a user's order history, newest first"""
+    try:
+        if user_id != request.state.user_id:
+            return JSONResponse(status_code=403, content={"detail": "Access denied"})
+        if limit < 1 or limit > 100 or offset < 0:
+            return JSONResponse(status_code=400, content={"detail": "limit must be 1-100 and offset >= 0"})
+
+        orders = db.get_user_orders(user_id, status=status, limit=limit, offset=offset)
+        return {"orders": [order.to_dict() for order in orders], "limit": limit, "offset": offset}
+    except Exception as e:
+        log_error(f"Error getting orders for {user_id}: {str(e)}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get orders"})
+
+@app.get("/analytics/{user_id}")
+async def get_spending_summary(request: Request, user_id: str, period: str = "month", key: str = None, category: str = None):
+    """Spent/received totals for a day (key=YYYY-MM-DD), month (key=YYYY-MM) or all time"""
+    try:
+        if user_id != request.state.user_id:
+            return JSONResponse(status_code=403, content={"detail": "Access denied"})
+        if period not in PERIODS:
+            return JSONResponse(status_code=400, content={"detail": f"period must be one of {', '.join(PERIODS)}"})
+        if key and not re.match(r'^\d{4}-\d{2}-\d{2}$' if period == "day" else r'^\d{4}-\d{2}$', key):
+            return JSONResponse(status_code=400, content={"detail": "key must be YYYY-MM-DD for days or YYYY-MM for months"})
+
+        return rollups.summary(user_id, period, None if period == "all" else key, category)
+    except Exception as e:
+        log_error(f"Error getting analytics for {user_id}: {str(e)}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get analytics"})
+
+@app.get("/events/{user_id}")
+async def stream_events(request: Request, user_id: str):
+    """Server-sent event stream of a user's activities, transactions, balances and voice output"""
+    if user_id != request.state.user_id:
+        return JSONResponse(status_code=403, content={"detail": "Access denied"})
+
+    sub = broker.subscribe(user_id)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                events = await sub.get(timeout=15)
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                yield "".join(format_sse(event) for event in events)
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    """Internal gauges for queues and caches"""
+    return {
+        "expiry": expiry_scheduler.gauges(),
+        "speech_queue": voice.message_queue.stats(),
+        "events": broker.stats(),
+        "ledger": ledger.stats(),
+        "intents": intent_resolver.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "inventory": inventory.stats(),
+        "admission": admission.stats(),
+        "trace": trace_recorder.stats(),
+        "ledger_file": ledger_file.stats(),
+        "velocity": velocity.stats(),
+        "bulk_velocity": bulk_velocity.stats()
+    }
+
 class VoiceCommand(BaseModel):
     command_type: str
     message: str = ""
@@ -342,26 +610,3 @@ async def voice_listen(request: Request):
             status_code=500,
             content={"detail": "Failed to process voice input"}
         )
-
-# Mount frontend static files (for production)
-frontend_dist = Path(__file__).parent.parent.parent / "frontend" / "dist"
-if frontend_dist.exists():
-    app.mount("/assets", StaticFiles(directory=str(frontend_dist / "assets")), name="assets")
-    
-    @app.get("/", response_class=FileResponse)
-    async def serve_frontend():
-        return FileResponse(str(frontend_dist / "index.html"))
-    
-    @app.get("/{full_path:path}", response_class=FileResponse)
-    async def serve_spa(full_path: str):
-        # Don't intercept API routes
-        if full_path.startswith(("docs", "openapi.json", "login", "products", "agent", "gateway", "balances", "transactions", "activities", "banks", "voice")):
-            raise HTTPException(status_code=404, detail="Not found")
-        
-        # Try to serve the file
-        file_path = frontend_dist / full_path
-        if file_path.is_file():
-            return FileResponse(str(file_path))
-        
-        # For all other routes, serve index.html (SPA routing)
-        return FileResponse(str(frontend_dist / "index.html"))
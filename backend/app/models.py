@@ -1,5 +1,13 @@
+"""Record types for the ledger collections
+
+Transactions, activities and orders are stored as ``__slots__`` records
+instead of dicts: a record has no per-instance ``__dict__``, so it costs a
+fixed header plus one pointer per field. Records support read-only
+mapping access (``tx["amount"]``, ``activity.get("to_user")``) under the
+keys the API uses; responses and event streams call ``to_dict()``.
+"""
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Dict, Iterator, Optional, Tuple
 
 @dataclass
 class User:
@@ -16,10 +24,149 @@ class Product:
     description: Optional[str]
     price: float
 
-@dataclass
-class Order:
-    id: str
-    buyer_id: str
-    product_id: str
-    amount: float
-    status: str
+class _Unset:
+    """Marks a slot that was never assigned; pickled by reference"""
+    __slots__ = ()
+
+    def __reduce__(self):
+        return "UNSET"
+
+    def __repr__(self):
+        return "UNSET"
+
+UNSET = _Unset()
+
+class Record:
+    """Base for slotted records.
+
+    ``FIELDS`` lists (key, attribute) pairs in output order. Optional
+    fields are simply left unassigned, which costs nothing and keeps them
+    out of ``to_dict()``, just as they were absent from the old dicts.
+    """
+    __slots__ = ()
+    FIELDS: Tuple[Tuple[str, str], ...] = ()
+    _ATTRS: Dict[str, str] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._ATTRS = dict(cls.FIELDS)
+
+    def __getitem__(self, key: str):
+        attr = self._ATTRS.get(key)
+        if attr is not None:
+            value = getattr(self, attr, UNSET)
+            if value is not UNSET:
+                return value
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, UNSET) is not UNSET
+
+    def items(self) -> Iterator[Tuple[str, object]]:
+        for key, attr in self.FIELDS:
+            value = getattr(self, attr, UNSET)
+            if value is not UNSET:
+                yield key, value
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    # Pickle slot values as a flat tuple rather than a name -> value dict
+    def __getstate__(self):
+        return tuple(getattr(self, attr, UNSET) for attr in self.__slots__)
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            if value is not UNSET:
+                setattr(self, attr, value)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class Transaction(Record):
+    """A transfer between two users; ``meta`` keeps only non-empty values"""
+    __slots__ = ("id", "from_id", "to_id", "amount", "ts", "_meta", "type")
+    FIELDS = (("id", "id"), ("from", "from_id"), ("to", "to_id"), ("amount", "amount"),
+              ("ts", "ts"), ("meta", "meta"), ("type", "type"))
+
+    def __init__(self, id: str, from_id: str, to_id: str, amount: float, ts: float,
+                 meta: Optional[dict] = None, type: str = "transfer"):
+        self.id = id
+        self.from_id = from_id
+        self.to_id = to_id
+        self.amount = amount
+        self.ts = ts
+        # Most transfers carry no metadata; don't keep an empty dict for each
+        self._meta = {k: v for k, v in meta.items() if v is not None} or None if meta else None
+        self.type = type
+
+    @property
+    def meta(self) -> dict:
+        return self._meta or {}
+
+# Activities of one kind share a single tuple of detail keys
+_DETAIL_KEYS: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+class Activity(Record):
+    """A user activity; type-specific details are stored as shared keys plus a values tuple"""
+    __slots__ = ("id", "user_id", "type", "timestamp", "_keys", "_values")
+    FIELDS = (("id", "id"), ("user_id", "user_id"), ("type", "type"), ("timestamp", "timestamp"))
+
+    def __init__(self, id: str, user_id: str, type: str, timestamp: float, details: Optional[dict] = None):
+        self.id = id
+        self.user_id = user_id
+        self.type = type
+        self.timestamp = timestamp
+        details = dict(details or ())
+        # A detail named like a base field overrides it, as dict.update() did
+        for key, attr in self.FIELDS:
+            if key in details:
+                setattr(self, attr, details.pop(key))
+        keys = tuple(details)
+        self._keys = _DETAIL_KEYS.setdefault(keys, keys)
+        self._values = tuple(details.values())
+
+    @property
+    def details(self) -> dict:
+        return dict(zip(self._keys, self._values))
+
+    def __getitem__(self, key: str):
+        if key in self._ATTRS:
+            return super().__getitem__(key)
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key) from None
+
+    def items(self):
+        yield from super().items()
+        yield from zip(self._keys, self._values)
+
+class Order(Record):
+    """A shop order; completion and cancellation fields are set when it settles"""
+    __slots__ = ("id", "user_id", "products", "total", "status", "created_at",
+                 "completed_at", "payment_id", "cancelled_at", "cancel_reason")
+    FIELDS = tuple((name, name) for name in __slots__)
+
+    def __init__(self, id: str, user_id: str, products: list, total: float, status: str, created_at: float):
+        self.id = id
+        self.user_id = user_id
+        self.products = products
+        self.total = total
+        self.status = status
+        self.created_at = created_at
+
+def json_default(obj):
+    """``default`` for json.dumps: records as dicts, anything else as a string"""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    return str(obj)
@@ -0,0 +1,196 @@
+"""Per-user and per-IP token-bucket rate limits for expensive routes"""
+import os
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+from .logger import log_error
+
+class TokenBucket:
+    """Token buckets for many keys sharing one rate and burst.
+
+    Buckets are refilled lazily when a key is checked, so a check is O(1)
+    and idle keys cost nothing. Buckets are kept in LRU order and the
+    least recently used are dropped past ``max_keys``; a bucket idle long
+    enough to be evicted would have refilled completely anyway.
+    """
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = Lock()
+
+    def _refill(self, key: str, now: float) -> list:
+        # Caller holds the lock
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def peek(self, key: str, now: float = None, cost: float = 1) -> Tuple[bool, float]:
+        """Whether key has ``cost`` tokens to spend, without spending them: (allowed, seconds until it will)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens = self._refill(key, now)[0]
+            return (True, 0.0) if tokens >= cost else (False, (cost - tokens) / self.rate)
+
+    def take(self, key: str, now: float = None, cost: float = 1) -> Tuple[bool, float, int]:
+        """Spend ``cost`` tokens for key: (allowed, seconds until it could, tokens left)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._refill(key, now)
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0, int(bucket[0])
+            return False, (cost - bucket[0]) / self.rate, 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+class RouteLimit:
+    """Limit for one route prefix, with separate buckets per user and per client IP.
+
+    A request spends a token from both its buckets or from neither, so
+    requests rejected by one limit don't use up the other.
+    """
+    def __init__(self, name: str, prefix: str, rate: float, burst: float, ip_factor: float = 4.0,
+                 per_item: bool = False):
+        self.name = name
+        self.prefix = prefix
+        self.per_item = per_item  # Charged one token per item by the route itself, not per request
+        self.rate = rate
+        self.burst = burst
+        self.users = TokenBucket(rate, burst)
+        # Several users can share an address (NAT, proxies), so the IP limit is looser
+        self.ips = TokenBucket(rate * ip_factor, burst * ip_factor)
+        self._lock = Lock()  # Makes check-both-then-take-both atomic
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, user_id: Optional[str], ip: Optional[str], cost: float = 1) -> Tuple[bool, float, int]:
+        ok, retry_after, remaining = True, 0.0, int(self.burst)
+        now = time.monotonic()
+        with self._lock:
+            buckets = [(bucket, key) for bucket, key in ((self.ips, ip), (self.users, user_id)) if key]
+            for bucket, key in buckets:
+                allowed, wait = bucket.peek(key, now, cost)
+                if not allowed:
+                    ok, retry_after = False, max(retry_after, wait)
+            if ok:
+                for bucket, key in buckets:
+                    _, _, left = bucket.take(key, now, cost)
+                    if bucket is self.users:
+                        remaining = left
+                self.allowed += 1
+            else:
+                self.limited += 1
+        return ok, retry_after, remaining
+
+class RateLimiter:
+    """Matches requests to route limits; unmatched routes are not limited"""
+    def __init__(self, limits: List[RouteLimit], enabled: bool = True):
+        self.limits = limits
+        self.enabled = enabled
+
+    def match(self, path: str) -> Optional[RouteLimit]:
+        for limit in self.limits:
+            if path.startswith(limit.prefix):
+                return limit
+        return None
+
+    def check(self, path: str, user_id: Optional[str], ip: Optional[str],
+              items: int = None) -> Optional[Tuple[RouteLimit, float]]:
+        """None if the request may proceed, else (limit, seconds to wait).
+
+        Per-item limits (batches) are skipped unless the route passes the
+        number of ``items`` it is about to process, one token each.
+        """
+        if not self.enabled:
+            return None
+        limit = self.match(path)
+        if limit is None or (limit.per_item and items is None):
+            return None
+        ok, retry_after, _ = limit.check(user_id, ip, max(1, items) if limit.per_item else 1)
+        return None if ok else (limit, retry_after)
+
+    def reset(self):
+        for limit in self.limits:
+            limit.users.clear()
+            limit.ips.clear()
+            limit.allowed = limit.limited = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "routes": {
+                limit.name: {
+                    "prefix": limit.prefix,
+                    "rate": limit.rate,
+                    "burst": limit.burst,
+                    "allowed": limit.allowed,
+                    "limited": limit.limited,
+                    "users": len(limit.users),
+                    "ips": len(limit.ips)
+                }
+                for limit in self.limits
+            }
+        }
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+def limited_response(limit: RouteLimit, retry_after: float) -> JSONResponse:
+    """The 429 for a request over ``limit``"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests - please slow down", "retry_after": round(retry_after, 2)},
+        headers={
+            "Retry-After": retry_after_header(retry_after),
+            "X-RateLimit-Limit": f"{limit.rate:g}/s; burst={limit.burst:g}",
+            "Access-Control-Allow-Origin": "*"
+        }
+    )
+
+# name -> (path prefix, default "rate,burst" in requests per second); first matching prefix wins
+DEFAULT_LIMITS = {
+    "gateway_batch": ("/gateway/pay/batch", "5,100"),
+    "gateway": ("/gateway/pay", "5,20"),
+    "chat": ("/agent/chat", "2,10"),
+    "bulk": ("/transfers/bulk", "0.2,2"),
+    "login": ("/login", "1,5"),
+}
+# Charged one token per payment by the route, at the single-payment rate, with room for one full batch
+PER_ITEM_LIMITS = {"gateway_batch"}
+
+def limiter_from_env() -> RateLimiter:
+    """Build limits from RATE_LIMIT_<NAME>=rate,burst (0 disables a route)"""
+    ip_factor = float(os.getenv("RATE_LIMIT_IP_FACTOR", "4"))
+    limits = []
+    for name, (prefix, default) in DEFAULT_LIMITS.items():
+        value = os.getenv(f"RATE_LIMIT_{name.upper()}", default)
+        try:
+            rate, burst = (float(v) for v in value.split(","))
+        except ValueError:
+            log_error(f"Invalid RATE_LIMIT_{name.upper()}={value!r}, using {default}")
+            rate, burst = (float(v) for v in default.split(","))
+        if rate > 0:
+            limits.append(RouteLimit(name, prefix, rate, burst, ip_factor, per_item=name in PER_ITEM_LIMITS))
+    return RateLimiter(limits, enabled=os.getenv("RATE_LIMIT_ENABLED", "1") == "1")
+
+# Global instance, applied by RateLimitMiddleware in main.py
+rate_limiter = limiter_from_env()
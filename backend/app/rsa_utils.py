@@ -1,47 +1,157 @@
 import os
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import serialization, hashes
 from base64 import b64encode, b64decode
 
 KEY_DIR = os.path.join(os.path.dirname(__file__), "keys")
-GATEWAY_PRIV = os.path.join(KEY_DIR, "gateway_priv.pem")
-GATEWAY_PUB = os.path.join(KEY_DIR, "gateway_pub.pem")
-
-def ensure_keys():
-    os.makedirs(KEY_DIR, exist_ok=True)
-    if not (os.path.exists(GATEWAY_PRIV) and os.path.exists(GATEWAY_PUB)):
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        pem_priv = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption(),
-        )
-        with open(GATEWAY_PRIV, "wb") as f:
-            f.write(pem_priv)
 
-        public_key = private_key.public_key()
-        pem_pub = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo,
-        )
-        with open(GATEWAY_PUB, "wb") as f:
-            f.write(pem_pub)
+# Padding objects are immutable, so one instance serves every call
+OAEP_PADDING = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+def _generate_key_pair(priv_path: str, pub_path: str):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem_priv = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    with open(priv_path, "wb") as f:
+        f.write(pem_priv)
 
-def load_private_key(path=GATEWAY_PRIV):
+    public_key = private_key.public_key()
+    pem_pub = public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    with open(pub_path, "wb") as f:
+        f.write(pem_pub)
+
+def load_private_key(path: str):
     with open(path, "rb") as f:
         return serialization.load_pem_private_key(f.read(), password=None)
 
-def load_public_key(path=GATEWAY_PUB):
-    with open(path, "rb") as f:
-        return serialization.load_pem_public_key(f.read())
+def key_id(public_key) -> str:
+    """Short stable id for a key: the start of the SHA-256 of its DER encoding"""
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return hashlib.sha256(der).hexdigest()[:16]
+
+class KeyManager:
+    """Loads the gateway keys once and keeps them, plus retired keys, by key id.
+
+    Ciphertexts produced by ``encrypt`` are ``"<kid>.<base64>"`` so the
+    matching private key is found without trial decryption; bare base64
+    payloads from older clients are decrypted with the current key.
+    """
+    def __init__(self, key_dir: str = KEY_DIR):
+        self.key_dir = key_dir
+        self.priv_path = os.path.join(key_dir, "gateway_priv.pem")
+        self.pub_path = os.path.join(key_dir, "gateway_pub.pem")
+        self.retired_dir = os.path.join(key_dir, "retired")
+        self.current_kid: Optional[str] = None
+        self._private: Dict[str, object] = {}
+        self._public: Dict[str, object] = {}
+        self._signature = None  # Key directory mtimes at the last load
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self):
+        """Load keys in the background, generating them first if missing"""
+        if self._ready.is_set():
+            return
+        threading.Thread(target=self._load_or_generate, daemon=True).start()
+
+    def _load_or_generate(self):
+        with self._lock:
+            if self._ready.is_set():
+                return
+            os.makedirs(self.key_dir, exist_ok=True)
+            if not (os.path.exists(self.priv_path) and os.path.exists(self.pub_path)):
+                _generate_key_pair(self.priv_path, self.pub_path)
+            self._load()
+            self._ready.set()
+
+    def _dir_signature(self) -> tuple:
+        """Changes whenever a key file is added, removed or replaced, e.g. by rotate()"""
+        def mtime(path):
+            try:
+                return os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                return None
+        return mtime(self.key_dir), mtime(self.retired_dir)
+
+    def _load(self):
+        self._signature = self._dir_signature()
+        priv = load_private_key(self.priv_path)
+        kid = key_id(priv.public_key())
+        private, public = {kid: priv}, {kid: priv.public_key()}
+        if os.path.isdir(self.retired_dir):
+            for name in os.listdir(self.retired_dir):
+                if name.endswith("_priv.pem"):
+                    old = load_private_key(os.path.join(self.retired_dir, name))
+                    old_kid = key_id(old.public_key())
+                    private[old_kid], public[old_kid] = old, old.public_key()
+        self._private, self._public, self.current_kid = private, public, kid
+
+    def wait(self):
+        """Block until the keys are loaded, loading them inline if start() was never called"""
+        if not self._ready.is_set():
+            self._load_or_generate()
+
+    def reload(self):
+        """Pick up keys rotated by another process"""
+        with self._lock:
+            self._load()
+            self._ready.set()
+
+    def public_key(self, kid: str = None):
+        self.wait()
+        return self._public[kid or self.current_kid]
+
+    def public_pem(self) -> Tuple[str, str]:
+        """(kid, PEM) of the current public key, for clients"""
+        pub = self.public_key()
+        pem = pub.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        return self.current_kid, pem.decode()
+
+    def encrypt(self, data: bytes) -> str:
+        self.wait()
+        kid = self.current_kid
+        return f"{kid}.{b64encode(self._public[kid].encrypt(data, OAEP_PADDING)).decode()}"
 
-def encrypt_with_public(data: bytes, pub_key) -> str:
-    ct = pub_key.encrypt(data, padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()),algorithm=hashes.SHA256(),label=None))
-    return b64encode(ct).decode()
+    def decrypt(self, token: str) -> bytes:
+        self.wait()
+        kid, sep, b64cipher = token.partition(".")
+        if not sep:
+            kid, b64cipher = self.current_kid, token
+        if kid not in self._private:
+            # Maybe rotated by another process; only re-read the PEMs if the directory changed,
+            # so bogus key ids can't force a reload per request
+            if self._dir_signature() != self._signature:
+                self.reload()
+            if kid not in self._private:
+                raise ValueError(f"unknown key id {kid}")
+        return self._private[kid].decrypt(b64decode(b64cipher), OAEP_PADDING)
 
-def decrypt_with_private(b64cipher: str, priv_key) -> bytes:
-    ct = b64decode(b64cipher)
-    pt = priv_key.decrypt(ct, padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()),algorithm=hashes.SHA256(),label=None))
-    return pt
+    def rotate(self) -> str:
+        """Make a new key current; the old one is kept for decrypting in-flight payloads"""
+        self.wait()
+        with self._lock:
+            os.makedirs(self.retired_dir, exist_ok=True)
+            old_kid = self.current_kid
+            os.replace(self.priv_path, os.path.join(self.retired_dir, f"{old_kid}_priv.pem"))
+            os.replace(self.pub_path, os.path.join(self.retired_dir, f"{old_kid}_pub.pem"))
+            _generate_key_pair(self.priv_path, self.pub_path)
+            self._load()
+        return self.current_kid
 
-ensure_keys()
+# Global instance; main.py starts it at startup so key generation never blocks imports
+key_manager = KeyManager()
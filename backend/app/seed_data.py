@@ -50,7 +50,7 @@ def seed():
             "type": "Savings"
         }
         
-        db.users[uid] = user
+        db.add_user(user)
         db.bank_accounts[account_id] = account
 
     # Set up shop account
@@ -72,7 +72,7 @@ def seed():
         "type": "Business"
     }
     
-    db.users[shop_uid] = shop_user
+    db.add_user(shop_user)
     db.bank_accounts[shop_account_id] = shop_account
     db.shop_id = shop_uid  # Set the shop_id in the database
     
@@ -185,5 +185,3 @@ def seed():
             "id": pid,
             **product_data
         }
-
-seed()
@@ -0,0 +1,185 @@
+"""Binary snapshots of the database for fast startup
+
+File layout::
+
+    b"AIPSNAP1" | u32 index length | JSON index | section bytes ...
+
+The index maps each section name to its (offset, length) in the file.
+Sections are pickled independently, so loading a snapshot only maps the
+file and reads the index; each section is decoded straight out of the
+mapping the first time one of its collections is used.
+
+Usage: python -m app.snapshot save [path]   (writes the seed data)
+       python -m app.snapshot info [path]
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import pickle
+import struct
+import threading
+from typing import Dict, Tuple
+
+from .logger import log_info, log_error
+from .analytics import rollups
+from .balance_history import balance_history
+
+MAGIC = b"AIPSNAP1"
+# Bumped whenever the pickled collections change shape; 2 stores records from models.py,
+# 3 keeps separate spent and received counts in the rollups
+VERSION = 3
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(os.path.dirname(__file__), "data", "snapshot.bin"))
+
+# Section name -> database collections stored in it. Collections that
+# reference the same objects (e.g. transactions and the per-user index)
+# share a section so pickling keeps them identical.
+SECTIONS = {
+    "users": ("users", "users_by_phone", "bank_accounts"),
+    "catalog": ("banks", "brands", "products", "shop_id"),
+    "transactions": ("transactions", "user_transactions"),
+    "activities": ("activities", "activity_log"),
+    "orders": ("orders", "user_orders"),
+}
+
+# Needed by almost every request, so decoded in the background right after startup
+WARM_SECTIONS = ("users", "catalog")
+
+def _orders_state(db) -> dict:
+    # Pending orders are short-lived and tied to the expiry scheduler, so
+    # only completed and cancelled orders are carried over
+    orders = dict(db.orders)
+    return {
+        "orders": orders,
+        "user_orders": {
+            user_id: [oid for oid in order_ids if oid in orders]
+            for user_id, order_ids in db.user_orders.items()
+        },
+    }
+
+def _restore_orders(db, state: dict) -> dict:
+    # The cancelled-order expiry queue isn't saved: drop cancelled orders
+    # already past their retention and give the rest a fresh one. A full
+    # period from now, since the queue only takes deadlines in order.
+    now = time.time()
+    retention = db.cancelled_order_expiry.ttl
+    orders = state["orders"]
+    for order_id, order in list(orders.items()):
+        if order.status != "cancelled":
+            continue
+        if order.cancelled_at + retention <= now:
+            del orders[order_id]
+        else:
+            db.cancelled_order_expiry.schedule(order_id, now)
+    state["user_orders"] = {
+        user_id: [oid for oid in order_ids if oid in orders]
+        for user_id, order_ids in state["user_orders"].items()
+    }
+    return state
+
+def save_snapshot(db, path: str = SNAPSHOT_PATH) -> dict:
+    """Write the database to path atomically; returns the index.
+
+    Call while the app is idle (shutdown or an offline tool): collections
+    are pickled without stopping writers.
+    """
+    blobs = {}
+    for section, names in SECTIONS.items():
+        state = _orders_state(db) if section == "orders" else {name: getattr(db, name) for name in names}
+        blobs[section] = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    blobs["rollups"] = pickle.dumps(rollups.buckets(), protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Offsets are relative to the end of the index so the index can be sized first
+    sections, offset = {}, 0
+    for section, blob in blobs.items():
+        sections[section] = [offset, len(blob)]
+        offset += len(blob)
+    index = {"version": VERSION, "created_at": time.time(), "sections": sections}
+    index_bytes = json.dumps(index).encode()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(index_bytes)))
+        f.write(index_bytes)
+        for blob in blobs.values():
+            f.write(blob)
+    os.replace(tmp_path, path)
+    log_info(f"Snapshot written to {path} ({offset} bytes of data)")
+    return index
+
+class SnapshotReader:
+    """Memory-maps a snapshot file and decodes sections on request"""
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a snapshot file: {path}")
+        (index_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.index = json.loads(self._mm[start:start + index_len])
+        if self.index.get("version") != VERSION:
+            raise ValueError(f"Snapshot {path} is version {self.index.get('version')}, expected {VERSION}; "
+                             f"re-create it with python -m app.snapshot save")
+        self._data_start = start + index_len
+        self.sections: Dict[str, Tuple[int, int]] = {
+            name: tuple(span) for name, span in self.index["sections"].items()
+        }
+
+    def read(self, section: str):
+        offset, length = self.sections[section]
+        start = self._data_start + offset
+        with memoryview(self._mm)[start:start + length] as view:
+            return pickle.loads(view)
+
+def load_snapshot(db, path: str = SNAPSHOT_PATH) -> SnapshotReader:
+    """Point the database at a snapshot without decoding it.
+
+    Every collection is deferred until first use; the sections most
+    requests need are then decoded on a background thread so the server
+    can start accepting requests immediately.
+    """
+    reader = SnapshotReader(path)
+    for section, names in SECTIONS.items():
+        if section == "orders":
+            db.defer(names, lambda: _restore_orders(db, reader.read("orders")))
+        else:
+            db.defer(names, lambda section=section: reader.read(section))
+    rollups.defer(lambda: reader.read("rollups"))
+    # Balance logs aren't stored; they are replayed from the transactions when first needed
+    balance_history.defer(lambda: balance_history.rebuild(
+        db.transactions, lambda user_id: db.bank_accounts.get(db.users.get(user_id, {}).get("account_id"))
+    ))
+
+    def warm():
+        try:
+            for section in WARM_SECTIONS:
+                db.materialize(SECTIONS[section][0])
+        except Exception as e:
+            log_error(f"Failed to warm snapshot {path}", e)
+
+    threading.Thread(target=warm, daemon=True).start()
+    log_info(f"Snapshot {path} attached ({len(reader.sections)} sections)")
+    return reader
+
+def main(argv):
+    command = argv[0] if argv else "info"
+    path = argv[1] if len(argv) > 1 else SNAPSHOT_PATH
+    if command == "save":
+        from .db import db
+        from . import seed_data
+        seed_data.seed()
+        index = save_snapshot(db, path)
+        print(json.dumps(index, indent=2))
+    elif command == "info":
+        print(json.dumps(SnapshotReader(path).index, indent=2))
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,17 +1,35 @@
 """Speech and audio feedback system - Text only version"""
-from threading import Thread, Lock
-from queue import Queue
-import time
+import os
+from collections import deque
+from threading import Thread, Lock, Condition
 from typing import Optional, Callable, List
 
 class MessageQueue:
-    """Thread-safe message queue for handling speech and audio feedback"""
-    def __init__(self):
-        self._queue = Queue()
-        self._history: List[str] = []
-        self._max_history = 100
+    """Thread-safe bounded message queue for handling speech and audio feedback
+
+    When the queue is full, ``overflow="drop_oldest"`` discards the oldest
+    queued message and ``overflow="block"`` makes producers wait for room
+    for up to ``block_timeout`` seconds, then drops the new message, so a
+    stalled worker never hangs the request that is speaking.
+    The worker drains up to ``batch_size`` messages per wakeup.
+    """
+    def __init__(self, maxsize: int = 1000, overflow: str = "drop_oldest",
+                 max_history: int = 100, batch_size: int = 64, block_timeout: float = 0.1):
+        if overflow not in ("drop_oldest", "block"):
+            raise ValueError(f"Invalid overflow policy: {overflow}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self._queue = deque()
+        self._cond = Condition()
+        self._history = deque(maxlen=max_history)
+        self._max_history = max_history
         self._lock = Lock()
         self.is_active = True
+        self.processed = 0
+        self.dropped = 0
+        self._in_flight = 0
         
         # Start worker thread
         self._worker = Thread(target=self._process_messages, daemon=True)
@@ -19,48 +37,93 @@ class MessageQueue:
     
     def _process_messages(self):
         """Message processing worker thread"""
-        while self.is_active:
+        while True:
+            with self._cond:
+                while not self._queue and self.is_active:
+                    self._cond.wait()
+                if not self._queue and not self.is_active:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._in_flight = len(batch)
+                # Wake producers blocked on a full queue
+                self._cond.notify_all()
             try:
-                message = self._queue.get()
-                if message:
-                    with self._lock:
-                        self._history.append(message)
-                        # Trim history if too long
-                        if len(self._history) > self._max_history:
-                            self._history = self._history[-self._max_history:]
-                        # Print message to console for debugging/testing
-                        print(f"🔊 {message}")
+                with self._lock:
+                    self._history.extend(batch)
+                # Print messages to console for debugging/testing
+                print("\n".join(f"🔊 {message}" for message in batch))
             except Exception as e:
                 print(f"Error processing message: {e}")
             finally:
-                self._queue.task_done()
-            time.sleep(0.1)
+                with self._cond:
+                    self.processed += len(batch)
+                    self._in_flight = 0
+                    self._cond.notify_all()
     
-    def add_message(self, message: str):
-        """Add a message to the queue"""
-        if message and self.is_active:
-            self._queue.put(message)
+    def add_message(self, message: str, timeout: Optional[float] = None) -> bool:
+        """Add a message to the queue; returns False if it was not queued.
+
+        With ``overflow="block"``, waits at most ``timeout`` seconds
+        (default ``block_timeout``) for room.
+        """
+        if not message or not self.is_active:
+            return False
+        timeout = self.block_timeout if timeout is None else timeout
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif not self._cond.wait_for(
+                    lambda: len(self._queue) < self.maxsize or not self.is_active, timeout
+                ) or not self.is_active:
+                    self.dropped += 1
+                    return False
+            self._queue.append(message)
+            self._cond.notify_all()
+        return True
+    
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued message has been processed"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
     
     def get_history(self, limit: int = None) -> List[str]:
         """Get message history with optional limit"""
         with self._lock:
             if limit:
-                return self._history[-limit:]
-            return self._history.copy()
+                return list(self._history)[-limit:]
+            return list(self._history)
     
     def clear_history(self):
         """Clear message history"""
         with self._lock:
             self._history.clear()
     
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "maxsize": self.maxsize,
+                "overflow": self.overflow
+            }
+    
     def stop(self):
         """Stop the message queue processing"""
-        self.is_active = False
+        with self._cond:
+            self.is_active = False
+            self._cond.notify_all()
 
 class AudioFeedback:
     """Audio feedback system - Currently text only with hooks for future voice integration"""
     def __init__(self):
-        self.message_queue = MessageQueue()
+        self.message_queue = MessageQueue(
+            maxsize=int(os.getenv("SPEECH_QUEUE_MAXSIZE", "1000")),
+            overflow=os.getenv("SPEECH_QUEUE_OVERFLOW", "drop_oldest"),
+            block_timeout=float(os.getenv("SPEECH_QUEUE_BLOCK_TIMEOUT", "0.1"))
+        )
         self.voice_enabled = False  # Flag for future voice integration
         self._speech_callbacks: List[Callable[[str], None]] = []
     
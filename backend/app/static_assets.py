@@ -0,0 +1,122 @@
+"""In-memory table of the built frontend with precompressed variants
+
+The frontend build is scanned once; every file is kept in memory along
+with gzip (and, if the brotli package is installed, br) encodings, so
+serving a static file is a dict lookup with no filesystem access.
+
+Usage: python -m app.static_assets [dist]   (writes .gz/.br files next to the build output)
+"""
+import gzip
+import hashlib
+import mimetypes
+import sys
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import Response
+
+from .logger import log_info
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are served
+    brotli = None
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/manifest+json")
+MIN_COMPRESS_SIZE = 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+def _compressible(media_type: str, size: int) -> bool:
+    return size >= MIN_COMPRESS_SIZE and media_type.startswith(COMPRESSIBLE)
+
+def _accepts(accept_encoding: str, coding: str) -> bool:
+    """Whether an Accept-Encoding header allows coding (q=0 excludes it)"""
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip() in (coding, "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+class StaticAsset:
+    __slots__ = ("body", "gzip", "br", "etag", "media_type", "cache_control")
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str,
+                 gzip_body: Optional[bytes] = None, br_body: Optional[bytes] = None):
+        self.body = body
+        self.gzip = gzip_body
+        self.br = br_body
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+        self.media_type = media_type
+        self.cache_control = cache_control
+
+class AssetTable:
+    """Files of a frontend build keyed by URL path ("index.html", "assets/app-1a2b.js")"""
+    def __init__(self, root: Path):
+        self.root = root
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def load(self):
+        assets = {}
+        total = 0
+        for path in sorted(self.root.rglob("*")):
+            if not path.is_file() or path.suffix in (".gz", ".br"):
+                continue
+            rel = path.relative_to(self.root).as_posix()
+            body = path.read_bytes()
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            # Vite content-hashes everything under assets/, so those names never change meaning
+            cache_control = IMMUTABLE if rel.startswith("assets/") else REVALIDATE
+            gzip_body = br_body = None
+            if _compressible(media_type, len(body)):
+                gzip_body = self._variant(path, ".gz", lambda b: gzip.compress(b, 9, mtime=0), body)
+                if brotli is not None or path.with_name(path.name + ".br").exists():
+                    br_body = self._variant(path, ".br", lambda b: brotli.compress(b, quality=11), body)
+            assets[rel] = StaticAsset(body, media_type, cache_control, gzip_body, br_body)
+            total += len(body)
+        self.assets = assets
+        log_info(f"Loaded {len(assets)} frontend files ({total / 1024:.0f} KiB) from {self.root}")
+
+    @staticmethod
+    def _variant(path: Path, suffix: str, compress, body: bytes) -> Optional[bytes]:
+        """A precompressed file from the build if present, else compress now; None if it doesn't help"""
+        prebuilt = path.with_name(path.name + suffix)
+        data = prebuilt.read_bytes() if prebuilt.exists() else compress(body)
+        return data if len(data) < len(body) else None
+
+    def get(self, rel_path: str) -> Optional[StaticAsset]:
+        return self.assets.get(rel_path)
+
+    def response(self, asset: StaticAsset, accept_encoding: str = "", if_none_match: str = None) -> Response:
+        body, encoding = asset.body, None
+        if asset.br is not None and _accepts(accept_encoding, "br"):
+            body, encoding = asset.br, "br"
+        elif asset.gzip is not None and _accepts(accept_encoding, "gzip"):
+            body, encoding = asset.gzip, "gzip"
+
+        # Each encoding is a different representation, so it gets its own strong ETag
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {"ETag": etag, "Cache-Control": asset.cache_control}
+        if asset.gzip is not None or asset.br is not None:
+            headers["Vary"] = "Accept-Encoding"
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+def precompress(root: Path):
+    """Write .gz (and .br) files beside compressible build outputs"""
+    for path in root.rglob("*"):
+        if not path.is_file() or path.suffix in (".gz", ".br"):
+            continue
+        body = path.read_bytes()
+        if not _compressible(mimetypes.guess_type(path.name)[0] or "", len(body)):
+            continue
+        path.with_name(path.name + ".gz").write_bytes(gzip.compress(body, 9, mtime=0))
+        if brotli is not None:
+            path.with_name(path.name + ".br").write_bytes(brotli.compress(body, quality=11))
+        print(path.relative_to(root))
+
+if __name__ == "__main__":
+    precompress(Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent.parent.parent / "frontend" / "dist")
@@ -0,0 +1,154 @@
+"""Records sanitized request sequences for offline replay (see benchmarks/replay.py)"""
+import os
+import re
+import json
+import gzip
+import time
+import queue
+from threading import Thread, Lock
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from .logger import log_info, log_error
+from .db import db
+
+PHONE_RE = re.compile(r"\+\d{11}")
+# Body fields, at any depth, that are replaced rather than recorded
+REDACTED_FIELDS = ("payload",)  # RSA-encrypted payment details
+# Query parameters that are dropped (compared lowercased); event streams pass ?token=
+CREDENTIAL_PARAMS = {"token", "access_token", "refresh_token", "api_key", "apikey", "password", "secret"}
+
+def _redact(data):
+    if isinstance(data, dict):
+        return {k: "<redacted>" if k in REDACTED_FIELDS else _redact(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [_redact(v) for v in data]
+    return data
+
+class TraceRecorder:
+    """Appends one compact JSON line per request to a gzip file.
+
+    Users are recorded as aliases in first-seen order: ``{uN}`` stands for
+    the N-th user's id and ``{pN}`` for their phone number, wherever they
+    appear in the path, query or body. Tokens and other credential query
+    parameters are never recorded, and encrypted payment payloads are
+    redacted, including those nested in batch requests. Each line holds the arrival
+    offset ``t`` in seconds, method ``m``, path ``p``, query ``q``, user
+    alias ``u``, body ``b``, status ``s`` and duration ``d`` in ms.
+
+    Lines are written by a background thread so the request path only
+    pays for an in-memory enqueue.
+    """
+    def __init__(self, path: Optional[str], max_body: int = 65536, lookup_phone=None):
+        self.path = path
+        self.max_body = max_body
+        self.lookup_phone = lookup_phone  # phone -> user id, or None
+        self._aliases: Dict[str, int] = {}  # user id -> N
+        self._lock = Lock()
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue()
+        self._thread: Optional[Thread] = None
+        self._started_at = None
+        self.recorded = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None or not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._started_at = time.monotonic()
+        self._thread = Thread(target=self._write, name="trace-writer", daemon=True)
+        self._thread.start()
+        log_info(f"Recording request trace to {self.path}")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _alias(self, user_id: str) -> int:
+        with self._lock:
+            return self._aliases.setdefault(user_id, len(self._aliases) + 1)
+
+    def sanitize(self, text: str) -> str:
+        """Replace known user ids and phone numbers with their aliases"""
+        def phone_alias(match):
+            user_id = self.lookup_phone(match.group(0)) if self.lookup_phone else None
+            return f"{{p{self._alias(user_id)}}}" if user_id else match.group(0)
+
+        text = PHONE_RE.sub(phone_alias, text)
+        with self._lock:
+            aliases = list(self._aliases.items())
+        for user_id, n in aliases:
+            if user_id in text:
+                text = text.replace(user_id, f"{{u{n}}}")
+        return text
+
+    def _body(self, body: bytes) -> Optional[object]:
+        if not body or len(body) > self.max_body:
+            return None
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return self.sanitize(body.decode(errors="replace"))
+        return json.loads(self.sanitize(json.dumps(_redact(data))))
+
+    def _query(self, query: str) -> Optional[str]:
+        params = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k.lower() not in CREDENTIAL_PARAMS]
+        return self.sanitize(urlencode(params)) if params else None
+
+    def record(self, method: str, path: str, query: str, user_id: Optional[str], body: bytes,
+               status: int, started: float, duration: float):
+        """Queue one request; started is its time.monotonic() arrival"""
+        if self._thread is None:
+            return
+        alias = self._alias(user_id) if user_id else None
+        self._queue.put({
+            "t": round(started - self._started_at, 4),
+            "m": method,
+            "p": self.sanitize(path),
+            "q": self._query(query) if query else None,
+            "u": alias,
+            "b": self._body(body),
+            "s": status,
+            "d": round(duration * 1000, 2)
+        })
+
+    def _write(self):
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    break
+                try:
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                    self.recorded += 1
+                    if self._queue.empty():
+                        f.flush()
+                except Exception as e:
+                    log_error("Failed to write trace entry", e)
+
+    def stats(self) -> dict:
+        return {"path": self.path if self.running else None, "recorded": self.recorded, "users": len(self._aliases)}
+
+def read_trace(path: str):
+    """Yield the recorded entries of a trace file in order"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def _user_id_for_phone(phone: str) -> Optional[str]:
+    user = db.get_user_by_phone(phone)
+    return user["id"] if user else None
+
+# Global instance; records only when TRACE_RECORD_PATH is set
+trace_recorder = TraceRecorder(
+    os.getenv("TRACE_RECORD_PATH"),
+    max_body=int(os.getenv("TRACE_MAX_BODY", "65536")),
+    lookup_phone=_user_id_for_phone,
+)
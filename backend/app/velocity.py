@@ -0,0 +1,177 @@
+"""Fraud velocity limits: amount and count sent per user per minute, hour and day"""
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+
+from .logger import log_error
+
+class SlidingWindow:
+    """Amount and count over the last ``span`` seconds, kept in ``buckets`` ring slots.
+
+    Each slot covers ``span / buckets`` seconds and the window drops a
+    whole slot at a time as it slides, so totals are exact to within one
+    slot. Sliding clears at most ``buckets`` slots and usually none, so
+    an update is O(1).
+    """
+    __slots__ = ("width", "amounts", "counts", "head", "amount", "count")
+
+    def __init__(self, span: float, buckets: int):
+        self.width = span / buckets
+        self.amounts = [0.0] * buckets
+        self.counts = [0] * buckets
+        self.head = 0  # Absolute number of the newest slot
+        self.amount = 0.0
+        self.count = 0
+
+    def advance(self, now: float):
+        slot = int(now // self.width)
+        if slot <= self.head:
+            return
+        n = len(self.amounts)
+        if slot - self.head >= n:
+            self.amounts = [0.0] * n
+            self.counts = [0] * n
+            self.amount = 0.0
+            self.count = 0
+        else:
+            for s in range(self.head + 1, slot + 1):
+                i = s % n
+                self.amount -= self.amounts[i]
+                self.count -= self.counts[i]
+                self.amounts[i] = 0.0
+                self.counts[i] = 0
+            if self.count == 0:
+                self.amount = 0.0  # Don't let float error build up in an idle window
+        self.head = slot
+
+    def add(self, now: float, amount: float, count: int):
+        """Add to the slot holding now; ignored if that slot has already left the window"""
+        slot = int(now // self.width)
+        if self.head - slot >= len(self.amounts):
+            return
+        i = slot % len(self.amounts)
+        self.amounts[i] += amount
+        self.counts[i] += count
+        self.amount += amount
+        self.count += count
+
+class VelocityLimit:
+    """Caps on the amount and number of transfers a user sends within ``span`` seconds (0 = no cap)"""
+    def __init__(self, name: str, span: float, buckets: int, max_amount: float, max_count: int):
+        self.name = name
+        self.span = span
+        self.buckets = buckets
+        self.max_amount = max_amount
+        self.max_count = max_count
+        self.rejected = 0
+
+    def exceeded_by(self, window: SlidingWindow, amount: float) -> Optional[str]:
+        if self.max_count and window.count + 1 > self.max_count:
+            return f"velocity limit: more than {self.max_count} transfers per {self.name}"
+        if self.max_amount and window.amount + amount > self.max_amount + 1e-9:
+            return f"velocity limit: more than ${self.max_amount:.2f} sent per {self.name}"
+        return None
+
+class VelocityChecker:
+    """Per-sender sliding-window counters checked inside the transfer path.
+
+    ``record`` checks every limit and, if none would be exceeded, counts
+    the transfer right away under the sender's lock, so concurrent
+    payments from one account can't both slip under a cap. If the
+    transfer then fails, ``undo`` takes it back out.
+    """
+    def __init__(self, limits: List[VelocityLimit], enabled: bool = True, stripes: int = 64):
+        self.limits = limits
+        self.enabled = enabled and bool(limits)
+        self._windows: Dict[str, List[SlidingWindow]] = {}  # user id -> one window per limit
+        self._locks = [Lock() for _ in range(stripes)]
+        self.checked = 0
+
+    def _user_windows(self, user_id: str) -> List[SlidingWindow]:
+        windows = self._windows.get(user_id)
+        if windows is None:
+            windows = self._windows.setdefault(
+                user_id, [SlidingWindow(limit.span, limit.buckets) for limit in self.limits]
+            )
+        return windows
+
+    def record(self, user_id: str, amount: float, now: float = None) -> Optional[str]:
+        """Count a transfer from user_id; returns a rejection reason instead if it would exceed a limit.
+
+        amount must be positive (bank.transfer checks it first); a negative
+        one would lower the window totals.
+        """
+        if not self.enabled:
+            return None
+        now = time.time() if now is None else now
+        with self._locks[hash(user_id) % len(self._locks)]:
+            windows = self._user_windows(user_id)
+            self.checked += 1
+            for limit, window in zip(self.limits, windows):
+                window.advance(now)
+                reason = limit.exceeded_by(window, amount)
+                if reason:
+                    limit.rejected += 1
+                    return reason
+            for window in windows:
+                window.add(now, amount, 1)
+        return None
+
+    def undo(self, user_id: str, amount: float, now: float):
+        """Take back a transfer recorded at now that did not go through"""
+        if not self.enabled:
+            return
+        with self._locks[hash(user_id) % len(self._locks)]:
+            for window in self._windows.get(user_id, ()):
+                window.add(now, -amount, -1)
+
+    def reset(self):
+        self._windows.clear()
+        self.checked = 0
+        for limit in self.limits:
+            limit.rejected = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "checked": self.checked,
+            "users": len(self._windows),
+            "limits": {
+                limit.name: {"max_amount": limit.max_amount, "max_count": limit.max_count, "rejected": limit.rejected}
+                for limit in self.limits
+            }
+        }
+
+# name -> (span seconds, ring slots, default "max amount,max count")
+DEFAULT_LIMITS = {
+    "minute": (60, 12, "2000,30"),
+    "hour": (3600, 60, "10000,300"),
+    "day": (86400, 96, "25000,1000"),
+}
+
+# Bulk uploads pay many recipients at once, so they are counted separately against looser caps
+DEFAULT_BULK_LIMITS = {
+    "minute": (60, 12, "100000,2000"),
+    "hour": (3600, 60, "500000,20000"),
+    "day": (86400, 96, "1000000,50000"),
+}
+
+def checker_from_env(prefix: str = "VELOCITY", defaults: dict = DEFAULT_LIMITS) -> VelocityChecker:
+    """Build limits from <prefix>_<WINDOW>=max_amount,max_count (0 disables either cap)"""
+    limits = []
+    for name, (span, buckets, default) in defaults.items():
+        value = os.getenv(f"{prefix}_{name.upper()}", default)
+        try:
+            max_amount, max_count = (float(v) for v in value.split(","))
+        except ValueError:
+            log_error(f"Invalid {prefix}_{name.upper()}={value!r}, using {default}")
+            max_amount, max_count = (float(v) for v in default.split(","))
+        if max_amount > 0 or max_count > 0:
+            limits.append(VelocityLimit(name, span, buckets, max_amount, int(max_count)))
+    return VelocityChecker(limits, enabled=os.getenv("VELOCITY_ENABLED", "1") == "1")
+
+# Global instances: bank.transfer checks every sender against velocity,
+# and bank.transfer_batch (bulk uploads) against bulk_velocity instead
+velocity = checker_from_env()
+bulk_velocity = checker_from_env("VELOCITY_BULK", DEFAULT_BULK_LIMITS)
@@ -0,0 +1,48 @@
+"""Per-user version counters for conditional GETs"""
+from threading import Lock
+from typing import Dict
+from uuid import uuid4
+
+RESOURCES = ("balance", "transactions", "activities")
+
+class UserVersions:
+    """Counts changes to each user's resources so responses can carry ETags.
+
+    Writers bump a counter whenever a resource changes; readers build the
+    ETag from the counter alone, so an unchanged resource is recognised
+    without loading or serializing it. The boot id keeps ETags from a
+    previous process (whose counters started from zero too) from matching.
+    """
+    def __init__(self):
+        self.boot_id = uuid4().hex[:8]
+        self._versions: Dict[str, Dict[str, int]] = {}
+        self._lock = Lock()
+
+    def bump(self, user_id: str, *resources: str):
+        with self._lock:
+            counters = self._versions.setdefault(user_id, {})
+            for resource in resources:
+                counters[resource] = counters.get(resource, 0) + 1
+
+    def get(self, user_id: str, resource: str) -> int:
+        return self._versions.get(user_id, {}).get(resource, 0)
+
+    def etag(self, user_id: str, resource: str) -> str:
+        return f'W/"{resource}-{self.boot_id}-{self.get(user_id, resource)}"'
+
+    def reset(self):
+        with self._lock:
+            self._versions.clear()
+            self.boot_id = uuid4().hex[:8]
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header value covers etag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    strip_weak = lambda tag: tag.strip().removeprefix("W/")
+    return strip_weak(etag) in (strip_weak(tag) for tag in if_none_match.split(","))
+
+# Global instance
+versions = UserVersions()
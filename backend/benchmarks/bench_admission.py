@@ -0,0 +1,68 @@
+"""Payment latency while reads flood the server, with and without admission control
+
+A fixed pool of worker threads stands in for the CPU: every request holds
+a worker for its service time, as RSA decryption or serialization would.
+
+Usage: python -m benchmarks.bench_admission [--readers N] [--payers N] [--seconds S]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.admission import AdmissionController, RouteClass
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+async def client(controller, route_class, pool, service_time, deadline, latencies, shed):
+    loop = asyncio.get_running_loop()
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        if controller and not await controller.acquire(route_class):
+            shed.append(1)
+            await asyncio.sleep(0.01)  # A shed client backs off briefly
+            continue
+        try:
+            await loop.run_in_executor(pool, time.sleep, service_time)
+        finally:
+            if controller:
+                route_class.release(time.monotonic() - start)
+        latencies.append(time.monotonic() - start)
+
+async def scenario(enabled, args):
+    payments = RouteClass("payments", 0, ("/gateway/pay",), ("POST",), args.payment_target, 32, 2.0)
+    reads = RouteClass("reads", 2, ("/balances",), ("GET",), args.read_target, 64, 0.05)
+    controller = AdmissionController([payments, reads]) if enabled else None
+    pool = ThreadPoolExecutor(args.workers)
+    deadline = time.monotonic() + args.seconds
+    pay_lat, read_lat, shed = [], [], []
+    await asyncio.gather(
+        *[client(controller, payments, pool, args.payment_time, deadline, pay_lat, shed) for _ in range(args.payers)],
+        *[client(controller, reads, pool, args.read_time, deadline, read_lat, shed) for _ in range(args.readers)],
+    )
+    pool.shutdown()
+    label = "admission" if enabled else "no control"
+    print(f"  {label:<11} payments p50 {percentile(pay_lat, .5) * 1e3:7.1f}ms p99 {percentile(pay_lat, .99) * 1e3:7.1f}ms "
+          f"({len(pay_lat)} done)  reads p50 {statistics.median(read_lat) * 1e3:7.1f}ms ({len(read_lat)} done, {len(shed)} shed)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=200)
+    parser.add_argument("--payers", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--payment-time", type=float, default=0.01)
+    parser.add_argument("--read-time", type=float, default=0.002)
+    parser.add_argument("--payment-target", type=float, default=0.05)
+    parser.add_argument("--read-target", type=float, default=0.02)
+    args = parser.parse_args()
+
+    print(f"readers={args.readers} payers={args.payers} workers={args.workers} seconds={args.seconds}")
+    asyncio.run(scenario(False, args))
+    asyncio.run(scenario(True, args))
+
+if __name__ == "__main__":
+    main()
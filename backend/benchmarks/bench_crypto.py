@@ -0,0 +1,94 @@
+"""Gateway key handling: startup, per-payment decrypts and unknown key ids
+
+Usage: python -m benchmarks.bench_crypto [--payments N] [--retired K]
+
+What the KeyManager changed, on a scratch key directory:
+
+- startup: keys used to be generated or loaded at import, blocking it;
+  start() now returns at once and the load finishes in the background.
+- unknown key id: a decrypt with a key id nobody has re-read every key
+  file; it now only does so when the key directory changed.
+
+The per-payment round trip is printed as a control. Keys were always
+loaded once for it, and a cached padding object saves nothing measurable
+next to the RSA operation, so expect the two lines to match.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from base64 import b64encode, b64decode
+
+from app.rsa_utils import KeyManager, load_private_key
+
+PAYLOAD = json.dumps({"from": "user1", "to": "user2", "amount": 49.99, "order_id": "order-1"}).encode()
+
+def _fresh_padding():
+    return padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+def fresh_padding_round_trip(pub, priv):
+    """The old per-payment path: padding built for every encrypt and decrypt"""
+    token = b64encode(pub.encrypt(PAYLOAD, _fresh_padding())).decode()
+    return priv.decrypt(b64decode(token), _fresh_padding())
+
+def startup(key_dir: str) -> tuple:
+    """(seconds until start() returns, seconds until the keys are usable)"""
+    manager = KeyManager(key_dir)
+    start = time.perf_counter()
+    manager.start()
+    returned = time.perf_counter() - start
+    manager.wait()
+    return returned, time.perf_counter() - start
+
+def unknown_kid(manager: KeyManager, token: str, gated: bool):
+    """gated=False re-reads the key files first, as every unknown key id used to"""
+    if not gated:
+        manager.reload()
+    try:
+        manager.decrypt(token)
+    except ValueError:
+        pass
+
+def timed(label, fn, n, unit="payment"):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<30} {elapsed / n * 1e6:9.1f} us/{unit}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--retired", type=int, default=3, help="retired keys in the scratch directory")
+    args = parser.parse_args()
+
+    key_dir = os.path.join(tempfile.mkdtemp(), "keys")
+    print("startup")
+    returned, ready = startup(key_dir)
+    print(f"  {'first run (generates a key)':<30} start() {returned * 1e3:7.1f}ms  ready {ready * 1e3:7.1f}ms")
+    manager = KeyManager(key_dir)
+    manager.wait()
+    for _ in range(args.retired):
+        manager.rotate()
+    returned, ready = startup(key_dir)
+    print(f"  {f'existing keys ({args.retired} retired)':<30} start() {returned * 1e3:7.1f}ms  ready {ready * 1e3:7.1f}ms")
+    print("  (before: done at import, blocking startup until 'ready')")
+
+    bogus = "0" * 16 + "." + manager.encrypt(PAYLOAD).partition(".")[2]
+    lookups = max(1, args.payments // 10)
+    print(f"unknown key id, lookups={lookups}")
+    timed("reload on every miss (before)", lambda: unknown_kid(manager, bogus, gated=False), lookups, "lookup")
+    timed("reload if directory changed", lambda: unknown_kid(manager, bogus, gated=True), lookups, "lookup")
+
+    priv = load_private_key(manager.priv_path)
+    pub = priv.public_key()
+    print(f"round trip, payments={args.payments} (control, expected neutral)")
+    timed("fresh padding (before)", lambda: fresh_padding_round_trip(pub, priv), args.payments)
+    timed("KeyManager", lambda: manager.decrypt(manager.encrypt(PAYLOAD)), args.payments)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Chat intent resolution cost with the tiered resolver vs one model call per message
+
+Usage: python -m benchmarks.bench_intents [--messages N] [--clients C] [--latency SECONDS]
+"""
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.agent import parse_command
+from app.intents import IntentResolver, StubIntentBackend
+
+# What the regex parser already handles
+REGEX = ["buy me a mouse", "send $50 to +10000000002", "check balance", "yes",
+         "order a keyboard under $100", "how much did I spend this month"]
+# Paraphrases only the model backend understands
+PARAPHRASES = ["grab a {} please", "could you acquire a {}", "remit {} to user3", "reimburse {} to user2",
+               "what funds do I have", "hook me up with a {}"]
+ITEMS = ["mouse", "webcam", "monitor", "headset", "keyboard"]
+
+def utterances(n: int, paraphrase_share: float):
+    rng = random.Random(42)
+    for _ in range(n):
+        if rng.random() < paraphrase_share:
+            template = rng.choice(PARAPHRASES)
+            yield template.format(rng.choice(ITEMS) if "a {}" in template else rng.randint(5, 50))
+        else:
+            yield rng.choice(REGEX)
+
+def run(label, resolve, messages, clients):
+    latencies = []
+
+    def timed(msg):
+        start = time.perf_counter()
+        resolve(msg)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(timed, messages))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (f"  {label:<10} total {elapsed:6.2f}s  mean {statistics.mean(latencies) * 1e3:7.2f}ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:7.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated model round trip per call")
+    parser.add_argument("--paraphrases", type=float, default=0.2, help="share of messages the regex misses")
+    args = parser.parse_args()
+    messages = list(utterances(args.messages, args.paraphrases))
+
+    naive = StubIntentBackend(latency=args.latency)
+    tiered = IntentResolver(parse_command, StubIntentBackend(latency=args.latency), batch_window=0.005, max_batch=16)
+
+    print(f"messages={args.messages} clients={args.clients} model latency={args.latency * 1e3:.0f}ms")
+    # parse_command logs every message; keep that out of the terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [
+            run("naive", lambda m: naive.classify_batch([m]), messages, args.clients),
+            run("tiered", tiered.resolve, messages, args.clients),
+        ]
+    print("\n".join(results))
+    print(f"  naive model calls: {naive.calls}")
+    print(f"  tiered: {tiered.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Concurrent purchases of one product: reservations vs an unguarded stock check
+
+Usage: python -m benchmarks.bench_inventory [--stock N] [--buyers B] [--attempts A]
+"""
+import argparse
+import contextlib
+import io
+import random
+import sys
+import time
+from threading import Thread
+
+from app.db import db
+from app.inventory import inventory, OutOfStockError
+
+def add_product(stock: int) -> dict:
+    db.brands.setdefault("bench", {"id": "bench", "name": "Bench", "description": "", "rating": 5})
+    product_id = db.add_product({"brand_id": "bench", "title": "Bench Widget", "price": 1.0, "stock": stock})
+    return db.products[product_id]
+
+def unguarded(product: dict, attempts: int, sold: list):
+    """What the purchase path did before: check stock, then decrement"""
+    for _ in range(attempts):
+        if product["stock"] > 0:
+            time.sleep(0)  # Another buyer can get in between check and write
+            product["stock"] -= 1
+            sold.append(1)
+
+def reserved(product: dict, attempts: int, sold: list, cancel_rate: float):
+    rng = random.Random()
+    items = [{"id": product["id"], "title": product["title"], "price": product["price"]}]
+    for _ in range(attempts):
+        try:
+            order_id = db.create_pending_order("bench-user", items, product["price"])
+        except OutOfStockError:
+            continue
+        time.sleep(0)
+        if rng.random() < cancel_rate:
+            db.cancel_order(order_id, "Payment failed")
+        else:
+            db.confirm_order(order_id)
+            sold.append(1)
+
+def run(label, target, stock, buyers, attempts, *args):
+    product = add_product(stock)
+    sold = []
+    threads = [Thread(target=target, args=(product, attempts, sold, *args)) for _ in range(buyers)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # confirm_order logs every purchase
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - start
+    total = buyers * attempts
+    status = "OVERSOLD" if len(sold) > stock or product["stock"] < 0 else "ok"
+    print(f"  {label:<11} sold {len(sold):>6}/{stock} stock left {product['stock']:>6}  "
+          f"{total / elapsed:>9,.0f} attempts/s  {status}")
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stock", type=int, default=1000)
+    parser.add_argument("--buyers", type=int, default=32)
+    parser.add_argument("--attempts", type=int, default=200)
+    parser.add_argument("--cancel-rate", type=float, default=0.2)
+    args = parser.parse_args()
+    sys.setswitchinterval(1e-6)  # Switch threads as often as possible to expose races
+
+    print(f"stock={args.stock} buyers={args.buyers} attempts per buyer={args.attempts}")
+    run("unguarded", unguarded, args.stock, args.buyers, args.attempts)
+    status = run("reserved", reserved, args.stock, args.buyers, args.attempts, args.cancel_rate)
+    print(f"  {inventory.stats()}")
+    if status != "ok":
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
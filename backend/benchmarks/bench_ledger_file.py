@@ -0,0 +1,76 @@
+"""Ledger file: append cost, and per-user totals from the mapped file vs the in-memory records
+
+Usage: python -m benchmarks.bench_ledger_file [--transactions N] [--users U]
+
+The totals scan runs on a NumPy view of the mapping when numpy is
+installed and on struct.iter_unpack otherwise. A second process maps
+the same file and checks it sees every record.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from uuid import uuid4
+
+from app import ledger_file as lf
+from app.models import Transaction
+
+def read_in_child(path, queue):
+    reader = lf.LedgerFileReader(path)
+    queue.put((len(reader), round(sum(t["sent"] for t in reader.totals().values()), 2)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transactions", type=int, default=500000)
+    parser.add_argument("--users", type=int, default=10000)
+    args = parser.parse_args()
+
+    users = [str(uuid4()) for _ in range(args.users)]
+    txs = [Transaction(str(uuid4()), *random.sample(users, 2), round(random.uniform(1, 100), 2), time.time())
+           for _ in range(args.transactions)]
+
+    path = os.path.join(tempfile.mkdtemp(), "ledger.bin")
+    writer = lf.LedgerFile(path)
+    writer.open()
+    start = time.perf_counter()
+    for tx in txs:
+        writer.append(tx)
+    appended = time.perf_counter() - start
+    writer.close()
+
+    start = time.perf_counter()
+    totals = {}
+    for tx in txs:
+        for user_id, field in ((tx.from_id, "sent"), (tx.to_id, "received")):
+            t = totals.setdefault(user_id, {"sent": 0.0, "received": 0.0, "count": 0})
+            t[field] += tx.amount
+            t["count"] += 1
+    scanned_records = time.perf_counter() - start
+
+    reader = lf.LedgerFileReader(path)
+    start = time.perf_counter()
+    file_totals = reader.totals()
+    scanned_file = time.perf_counter() - start
+    assert file_totals.keys() == totals.keys()
+    assert all(abs(file_totals[u]["sent"] - totals[u]["sent"]) < 1e-6 for u in totals)
+
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=read_in_child, args=(path, queue))
+    child.start()
+    seen, total = queue.get(timeout=60)
+    child.join()
+    assert seen == args.transactions
+
+    scan = "numpy view" if lf.np is not None else "struct.iter_unpack (numpy not installed)"
+    print(f"transactions={args.transactions} users={args.users} file={os.path.getsize(path) / 1e6:.1f}MB "
+          f"({lf.RECORD.size} bytes per record)")
+    print(f"  append:                 {appended / args.transactions * 1e6:8.2f}us per transfer  "
+          f"(synced every {writer.flush_records} records / {writer.flush_seconds:g}s)")
+    print(f"  totals, record objects: {scanned_records * 1e3:8.1f}ms")
+    print(f"  totals, mapped file:    {scanned_file * 1e3:8.1f}ms  ({scan})")
+    print(f"  other process saw {seen} records, ${total:,.2f} sent")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Memory per ledger record: the old dicts vs the slotted records in app/models.py
+
+Usage: python -m benchmarks.bench_records [--records N]
+
+Builds N transactions, N activities and N orders shaped like the ones
+bank.transfer and db.confirm_order create, once as dicts and once as
+records, and reports the bytes allocated per record (tracemalloc).
+User ids, names and product lists are shared, as they are in the app,
+so only what each record owns is counted.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from uuid import uuid4
+
+from app.models import Activity, Order, Transaction
+
+def transaction_dict(i, users):
+    return {"id": str(uuid4()), "from": users[i % len(users)], "to": users[(i + 1) % len(users)],
+            "amount": random.uniform(1, 100), "ts": time.time(), "meta": {"order_id": None}, "type": "transfer"}
+
+def transaction_record(i, users):
+    return Transaction(str(uuid4()), users[i % len(users)], users[(i + 1) % len(users)],
+                       random.uniform(1, 100), time.time(), {"order_id": None})
+
+def activity_dict(i, users):
+    activity = {"id": str(uuid4()), "user_id": users[i % len(users)], "type": "transfer_sent", "timestamp": time.time()}
+    activity.update({"amount": random.uniform(1, 100), "to_user": "Alice", "transaction_id": str(uuid4())})
+    return activity
+
+def activity_record(i, users):
+    return Activity(str(uuid4()), users[i % len(users)], "transfer_sent", time.time(),
+                    {"amount": random.uniform(1, 100), "to_user": "Alice", "transaction_id": str(uuid4())})
+
+PRODUCTS = [{"id": "p1", "title": "Mouse", "price": 29.99}]
+
+def order_dict(i, users):
+    order = {"id": str(uuid4()), "user_id": users[i % len(users)], "products": PRODUCTS, "total": 29.99,
+             "status": "pending", "created_at": time.time()}
+    order.update({"status": "completed", "completed_at": time.time(), "payment_id": None})
+    return order
+
+def order_record(i, users):
+    order = Order(str(uuid4()), users[i % len(users)], PRODUCTS, 29.99, "pending", time.time())
+    order.status, order.completed_at, order.payment_id = "completed", time.time(), None
+    return order
+
+def measure(make, n, users) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [make(i, users) for i in range(n)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(records) == n
+    return used / n
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+    users = [str(uuid4()) for _ in range(1000)]
+
+    print(f"records={args.records}  bytes per record, including its own id, floats and details")
+    print(f"  {'kind':<13}{'dict':>8}{'record':>8}{'saved':>8}")
+    for kind, as_dict, as_record in (("transaction", transaction_dict, transaction_record),
+                                     ("activity", activity_dict, activity_record),
+                                     ("order", order_dict, order_record)):
+        before = measure(as_dict, args.records, users)
+        after = measure(as_record, args.records, users)
+        print(f"  {kind:<13}{before:>8.0f}{after:>8.0f}{1 - after / before:>8.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Startup cost: rebuilding a dataset vs attaching a snapshot of it
+
+Usage: python -m benchmarks.bench_snapshot [--users N] [--transactions M]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from uuid import uuid4
+
+from app.db import Database
+from app.models import Activity, Transaction
+from app.snapshot import SECTIONS, load_snapshot, save_snapshot
+
+def build(db: Database, users: int, transactions: int):
+    """Seed-style construction: uuid4 ids and random values for every record"""
+    bank_id = str(uuid4())
+    db.banks = {bank_id: {"id": bank_id, "name": "Quantum Bank", "code": "QNT"}}
+    ids = []
+    for i in range(users):
+        uid, account_id = str(uuid4()), str(uuid4())
+        db.add_user({"id": uid, "name": f"User{i}", "phone": f"+1{i:010d}", "bank_id": bank_id, "account_id": account_id})
+        db.bank_accounts[account_id] = {"id": account_id, "user_id": uid, "bank_id": bank_id,
+                                        "account_number": f"{random.randint(10**9, 10**10 - 1)}", "balance": 1000.0}
+        ids.append(uid)
+    for _ in range(transactions):
+        a, b = random.sample(ids, 2)
+        tx = Transaction(str(uuid4()), a, b, round(random.uniform(1, 100), 2), time.time())
+        db.add_transaction(tx)
+        db.activity_log.setdefault(a, []).append(Activity(str(uuid4()), a, "transfer_sent", tx.ts,
+                                                          {"amount": tx.amount, "transaction_id": tx.id}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=200000)
+    args = parser.parse_args()
+
+    db = Database()
+    start = time.perf_counter()
+    build(db, args.users, args.transactions)
+    built = time.perf_counter() - start
+
+    path = os.path.join(tempfile.mkdtemp(), "snapshot.bin")
+    start = time.perf_counter()
+    save_snapshot(db, path)
+    saved = time.perf_counter() - start
+
+    restored = Database()
+    start = time.perf_counter()
+    load_snapshot(restored, path)
+    attached = time.perf_counter() - start
+
+    print(f"users={args.users} transactions={args.transactions} snapshot={os.path.getsize(path) / 1e6:.1f}MB")
+    print(f"  rebuild:        {built * 1e3:9.1f}ms")
+    print(f"  save:           {saved * 1e3:9.1f}ms")
+    print(f"  attach:         {attached * 1e3:9.1f}ms  (time to first request)")
+    for section, names in SECTIONS.items():
+        start = time.perf_counter()
+        restored.materialize(names[0])
+        print(f"  load {section:<10}{(time.perf_counter() - start) * 1e3:9.1f}ms  (on first use)")
+    assert len(restored.transactions) == args.transactions
+
+if __name__ == "__main__":
+    main()
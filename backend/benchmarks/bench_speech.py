@@ -0,0 +1,58 @@
+"""Throughput benchmark for the speech MessageQueue
+
+Usage: python -m benchmarks.bench_speech [--messages N] [--producers P] [--overflow drop_oldest|block]
+"""
+import argparse
+import contextlib
+import io
+import time
+from threading import Thread
+
+from app.speech import AudioFeedback, MessageQueue
+
+def run(messages: int, producers: int, overflow: str, maxsize: int):
+    feedback = AudioFeedback()
+    feedback.message_queue.stop()
+    feedback.message_queue = MessageQueue(maxsize=maxsize, overflow=overflow)
+    per_producer = messages // producers
+
+    def produce(n):
+        for i in range(per_producer):
+            if i % 2:
+                feedback.speak(f"Message {n}-{i}")
+            else:
+                feedback.speak_transaction(12.5, "transfer_sent", {"recipient_name": f"User{n}"})
+
+    # The worker prints every message; keep that out of the terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        threads = [Thread(target=produce, args=(n,)) for n in range(producers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        enqueued = time.perf_counter() - start
+        feedback.message_queue.join()
+        drained = time.perf_counter() - start
+
+    stats = feedback.message_queue.stats()
+    total = per_producer * producers
+    print(f"overflow={overflow} maxsize={maxsize} producers={producers} messages={total}")
+    print(f"  enqueue: {enqueued:.3f}s ({total / enqueued:,.0f} msg/s)")
+    print(f"  drain:   {drained:.3f}s ({stats['processed'] / drained:,.0f} msg/s processed)")
+    print(f"  processed={stats['processed']} dropped={stats['dropped']} history={len(feedback.get_message_history())}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--maxsize", type=int, default=1000)
+    parser.add_argument("--overflow", choices=["drop_oldest", "block", "both"], default="both")
+    args = parser.parse_args()
+
+    policies = ["drop_oldest", "block"] if args.overflow == "both" else [args.overflow]
+    for policy in policies:
+        run(args.messages, args.producers, policy, args.maxsize)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Velocity check cost per transfer: sliding-window counters vs scanning the sender's history
+
+Usage: python -m benchmarks.bench_velocity [--users N] [--history H] [--checks C]
+
+Each of N users already has H transfers spread over the last day.
+"""
+import argparse
+import random
+import time
+from uuid import uuid4
+
+from app.models import Transaction
+from app.velocity import VelocityChecker, VelocityLimit, DEFAULT_LIMITS
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def scan(history, now):
+    """What a check without counters would do: sum the sender's transfers per window"""
+    totals = {}
+    for name, (span, _, _) in DEFAULT_LIMITS.items():
+        recent = [tx.amount for tx in history if tx.ts > now - span]
+        totals[name] = (sum(recent), len(recent))
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--history", type=int, default=500)
+    parser.add_argument("--checks", type=int, default=100000)
+    args = parser.parse_args()
+
+    # Caps high enough that every check passes and is recorded
+    checker = VelocityChecker([VelocityLimit(name, span, buckets, 1e12, 10**9)
+                               for name, (span, buckets, _) in DEFAULT_LIMITS.items()])
+    users = [str(uuid4()) for _ in range(args.users)]
+    now = time.time()
+    histories = {}
+    for user_id in users:
+        history = histories[user_id] = []
+        for ts in sorted(now - random.uniform(0, 86400) for _ in range(args.history)):
+            checker.record(user_id, 10.0, ts)
+            history.append(Transaction(str(uuid4()), user_id, users[0], 10.0, ts))
+
+    counters, scans = [], []
+    for i in range(args.checks):
+        user_id = random.choice(users)
+        at = now + i * 0.001
+        start = time.perf_counter()
+        checker.record(user_id, 10.0, at)
+        counters.append(time.perf_counter() - start)
+        if i % 100 == 0:
+            start = time.perf_counter()
+            scan(histories[user_id], at)
+            scans.append(time.perf_counter() - start)
+
+    counters.sort()
+    scans.sort()
+    print(f"users={args.users} history={args.history} transfers each, checks={args.checks}")
+    for label, samples in (("counters", counters), ("history scan", scans)):
+        print(f"  {label:<13} p50 {percentile(samples, .5) * 1e6:8.2f}us  p99 {percentile(samples, .99) * 1e6:8.2f}us"
+              f"  max {samples[-1] * 1e6:8.2f}us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Replay a recorded request trace against an in-process app and report latencies
+
+Record with TRACE_RECORD_PATH set on the server, then:
+
+Usage: python -m benchmarks.replay TRACE [--speed N] [--snapshot PATH] [--workers W]
+
+Requests are issued at their recorded offsets divided by --speed (0 sends
+them back to back); each user's requests stay in recorded order. Trace
+user aliases are mapped onto the app's users in phone order, skipping
+the shop. Redacted gateway payloads, batched ones included, are replaced
+by a freshly encrypted $0.01 payment from the same user, so the RSA
+work is still exercised.
+The app is seeded from --snapshot when given.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ALIAS_RE = re.compile(r"\{([up])(\d+)\}")
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--snapshot", help="snapshot to seed the app from instead of the seed data")
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        os.environ["SNAPSHOT_PATH"] = os.path.abspath(args.snapshot)
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")  # Replays run far faster than any one client
+    os.environ.setdefault("VELOCITY_ENABLED", "0")  # ...and compress hours of payments into seconds
+    os.environ.pop("TRACE_RECORD_PATH", None)
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.db import db
+    from app.rsa_utils import key_manager
+    from app.tracing import read_trace
+
+    entries = sorted(read_trace(args.trace), key=lambda e: e["t"])
+    if not entries:
+        print("Trace is empty")
+        return 1
+
+    quiet = contextlib.redirect_stdout(io.StringIO())  # The app logs every request
+    with quiet, TestClient(app) as client:
+        users = sorted((u for u in db.users.values() if u["id"] != db.shop_id), key=lambda u: u["phone"])
+        aliases = sorted({int(n) for e in entries for _, n in ALIAS_RE.findall(json.dumps(e))} |
+                         {e["u"] for e in entries if e["u"]})
+        if len(aliases) > len(users):
+            print(f"Trace has {len(aliases)} users but the app only {len(users)}; extra users wrap around",
+                  file=sys.__stdout__)
+        mapped = {n: users[i % len(users)] for i, n in enumerate(aliases)}
+        tokens = {n: client.post("/login", json={"phone": u["phone"]}).json()["token"] for n, u in mapped.items()}
+
+        def substitute(text):
+            return ALIAS_RE.sub(lambda m: mapped[int(m.group(2))]["id" if m.group(1) == "u" else "phone"], text)
+
+        def fill_payloads(body, user_id):
+            """Replace redacted payment payloads, at any depth, with fresh one-cent payments"""
+            if isinstance(body, dict):
+                if body.get("payload") == "<redacted>":
+                    payment = {"from_id": user_id, "to_id": db.shop_id, "amount": 0.01}
+                    body = {**body, "payload": key_manager.encrypt(json.dumps(payment).encode())}
+                return {k: fill_payloads(v, user_id) for k, v in body.items()}
+            if isinstance(body, list):
+                return [fill_payloads(v, user_id) for v in body]
+            return body
+
+        def prepare(entry):
+            path = substitute(entry["p"]) + (f"?{substitute(entry['q'])}" if entry.get("q") else "")
+            body = entry.get("b")
+            if body is not None:
+                body = json.loads(substitute(json.dumps(body)))
+            if entry["u"]:
+                body = fill_payloads(body, mapped[entry["u"]]["id"])
+            headers = {"Authorization": f"Bearer {tokens[entry['u']]}"} if entry["u"] else {}
+            return entry["m"], path, body, headers
+
+        results = defaultdict(list)  # route -> [(latency, status matched)]
+        start = time.monotonic()
+
+        def send(entry):
+            due = start + (entry["t"] / args.speed if args.speed > 0 else 0)
+            time.sleep(max(0.0, due - time.monotonic()))
+            method, path, body, headers = prepare(entry)
+            sent = time.monotonic()
+            response = client.request(method, path, json=body if isinstance(body, (dict, list)) else None,
+                                      content=body if isinstance(body, str) else None, headers=headers)
+            route = f"{entry['m']} {ALIAS_RE.sub('{user}', entry['p'])}"
+            results[route].append((time.monotonic() - sent, response.status_code == entry["s"]))
+
+        # A user's chat turns depend on each other, so each user's requests run in order
+        chains = defaultdict(list)
+        for i, entry in enumerate(entries):
+            chains[entry["u"] or f"anonymous-{i}"].append(entry)
+
+        def run_chain(chain):
+            for entry in chain:
+                send(entry)
+
+        with ThreadPoolExecutor(args.workers) as pool:
+            list(pool.map(run_chain, chains.values()))
+        elapsed = time.monotonic() - start
+
+    print(f"replayed {len(entries)} requests in {elapsed:.2f}s at {args.speed:g}x "
+          f"(recorded span {entries[-1]['t']:.2f}s)")
+    print(f"  {'route':<40} {'count':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'status diff':>11}")
+    for route, samples in sorted(results.items(), key=lambda kv: -len(kv[1])):
+        latencies = sorted(s[0] * 1000 for s in samples)
+        mismatched = sum(1 for s in samples if not s[1])
+        print(f"  {route[:40]:<40} {len(latencies):>6} {percentile(latencies, .5):>8.1f} {percentile(latencies, .9):>8.1f} "
+              f"{percentile(latencies, .99):>8.1f} {latencies[-1]:>8.1f} {mismatched:>11}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""Shared fixtures: an in-process app seeded fresh for each test
+
+Run from backend/: python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+# Configure before app modules read their settings at import time
+os.environ["INTENT_BACKEND"] = "none"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+os.environ["CONVERSATION_STORE"] = "memory"
+os.environ["GATEWAY_DECRYPT_WORKERS"] = "0"
+os.environ["SNAPSHOT_PATH"] = os.path.join(tempfile.mkdtemp(), "snapshot.bin")
+for name in ("TRACE_RECORD_PATH", "LEDGER_FILE_PATH", "GROQ_API_KEY"):
+    os.environ.pop(name, None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.db import db
+
+@pytest.fixture
+def client():
+    with TestClient(app) as c:
+        yield c
+
+def login(client, phone: str):
+    """(user, auth headers) for the seeded user with this phone"""
+    data = client.post("/login", json={"phone": phone}).json()
+    return data["user"], {"Authorization": f"Bearer {data['token']}"}
+
+@pytest.fixture
+def alice(client):
+    return login(client, "+10000000001")
+
+@pytest.fixture
+def bob(client):
+    return login(client, "+10000000002")
+
+def balance(user_id: str) -> float:
+    return db.bank_accounts[db.users[user_id]["account_id"]]["balance"]
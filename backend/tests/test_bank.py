@@ -0,0 +1,20 @@
+"""Transfers: bank.transfer rejects bad amounts before the velocity limits or the ledger see them"""
+import pytest
+
+from app import bank
+from app.velocity import velocity
+
+from conftest import balance
+
+@pytest.mark.parametrize("amount", [0, -5, float("nan")])
+def test_non_positive_amount_rejected(client, alice, bob, amount):
+    sender, recipient = alice[0]["id"], bob[0]["id"]
+    before = balance(sender), balance(recipient), velocity.checked
+    assert bank.transfer(sender, recipient, amount) == {"ok": False, "reason": "amount must be positive"}
+    assert (balance(sender), balance(recipient), velocity.checked) == before
+
+def test_transfer_moves_money(client, alice, bob):
+    sender, recipient = alice[0]["id"], bob[0]["id"]
+    before = balance(sender), balance(recipient)
+    assert bank.transfer(sender, recipient, 5)["ok"]
+    assert (balance(sender), balance(recipient)) == pytest.approx((before[0] - 5, before[1] + 5))
@@ -0,0 +1,56 @@
+"""Pending actions: expiry never deletes an action put after the expired one"""
+import threading
+import time
+
+from app.conversation_store import MemoryConversationStore
+
+def test_expire_due_reports_and_removes(monkeypatch):
+    expired = []
+    store = MemoryConversationStore(ttl=10, on_expire=lambda u, a: expired.append((u, a)))
+    store.put("u1", {"n": 1})
+    store.put("u2", {"n": 2})
+    assert store.pop("u2") == {"n": 2}
+    assert store.expire_due(time.time() + 11) == 1
+    assert expired == [("u1", {"n": 1})] and "u1" not in store and store.expired_total == 1
+
+def test_put_during_sweep_survives():
+    expired = []
+    store = MemoryConversationStore(ttl=0.01, on_expire=lambda u, a: expired.append((u, a)))
+    store.put("u1", {"n": "old"})
+    time.sleep(0.02)
+
+    # Land a put right after the sweep picked its due keys
+    pop_due = store._expiry.pop_due
+    def racing_pop_due(now=None):
+        due = pop_due(now)
+        writer = threading.Thread(target=store.put, args=("u1", {"n": "new"}))
+        writer.start()
+        writer.join(0.05)
+        racing_pop_due.writer = writer
+        return due
+    store._expiry.pop_due = racing_pop_due
+
+    store.expire_due()
+    racing_pop_due.writer.join()
+    assert expired == [("u1", {"n": "old"})]
+    assert store.get("u1") == {"n": "new"}
+
+def test_concurrent_puts_and_sweeps_lose_nothing():
+    expired = []
+    store = MemoryConversationStore(ttl=0, on_expire=lambda u, a: expired.append(a["n"]))
+    stop = threading.Event()
+
+    def sweep():
+        while not stop.is_set():
+            store.expire_due()
+
+    sweeper = threading.Thread(target=sweep)
+    sweeper.start()
+    for n in range(2000):
+        store.put("u1", {"n": n})
+    stop.set()
+    sweeper.join()
+    store.expire_due(time.time() + 1)
+    # Every action was expired exactly once, or replaced before its sweep; none expired twice
+    assert len(expired) == len(set(expired)) and expired == sorted(expired)
+    assert expired[-1] == 1999 and len(store) == 0
@@ -0,0 +1,18 @@
+"""Decrypt pool: spawned workers decrypt batches in order and report bad items"""
+import json
+
+from app.decrypt_pool import DecryptPool
+from app.rsa_utils import key_manager
+
+def test_spawned_workers_decrypt_batches():
+    pool = DecryptPool(workers=2)
+    pool.start()
+    try:
+        assert pool._executor._mp_context.get_start_method() == "spawn"
+        payloads = [key_manager.encrypt(json.dumps({"amount": i}).encode()) for i in range(5)]
+        results = pool.decrypt_many(payloads + ["bogus"])
+        assert [r["amount"] for r in results[:5]] == list(range(5))
+        assert isinstance(results[5], Exception)
+        assert pool.decrypt(payloads[2]) == {"amount": 2}
+    finally:
+        pool.stop()
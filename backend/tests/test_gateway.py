@@ -0,0 +1,71 @@
+"""Gateway idempotency: retries replay, reused keys for other payments conflict"""
+import json
+
+import pytest
+
+from app.db import db
+from app.rsa_utils import key_manager
+
+from conftest import balance
+
+def encrypt(from_id, amount, order_id=None):
+    payment = {"from_id": from_id, "to_id": db.shop_id, "amount": amount, "order_id": order_id}
+    return key_manager.encrypt(json.dumps(payment).encode())
+
+def pay(client, headers, payload, key=None):
+    extra = {"Idempotency-Key": key} if key else {}
+    return client.post("/gateway/pay", json={"payload": payload}, headers={**headers, **extra})
+
+def test_same_ciphertext_replays(client, alice):
+    user, headers = alice
+    before = balance(user["id"])
+    payload = encrypt(user["id"], 10)
+    first, second = pay(client, headers, payload).json(), pay(client, headers, payload).json()
+    assert first["ok"] and second["replayed"] and second["tx"]["id"] == first["tx"]["id"]
+    assert balance(user["id"]) == pytest.approx(before - 10)
+
+def test_reencrypted_retry_with_same_key_replays(client, alice):
+    user, headers = alice
+    before = balance(user["id"])
+    first = pay(client, headers, encrypt(user["id"], 10), key="k1").json()
+    retry = pay(client, headers, encrypt(user["id"], 10), key="k1")
+    assert retry.status_code == 200
+    assert retry.json()["replayed"] and retry.json()["tx"]["id"] == first["tx"]["id"]
+    assert balance(user["id"]) == pytest.approx(before - 10)
+
+def test_key_reused_for_other_payment_conflicts(client, alice):
+    user, headers = alice
+    pay(client, headers, encrypt(user["id"], 10), key="k2")
+    assert pay(client, headers, encrypt(user["id"], 11), key="k2").status_code == 409
+
+def test_replayed_ciphertext_under_other_key_conflicts(client, alice):
+    user, headers = alice
+    payload = encrypt(user["id"], 10)
+    pay(client, headers, payload)
+    pay(client, headers, encrypt(user["id"], 12), key="k3")
+    assert pay(client, headers, payload, key="k3").status_code == 409
+
+def test_keys_are_scoped_per_user(client, alice, bob):
+    before = balance(bob[0]["id"])
+    pay(client, alice[1], encrypt(alice[0]["id"], 10), key="shared")
+    r = pay(client, bob[1], encrypt(bob[0]["id"], 7), key="shared")
+    assert r.status_code == 200 and not r.json().get("replayed")
+    assert balance(bob[0]["id"]) == pytest.approx(before - 7)
+
+def test_order_paid_once(client, alice):
+    user, headers = alice
+    before = balance(user["id"])
+    results = [pay(client, headers, encrypt(user["id"], 5, order_id="o-1")).json() for _ in range(3)]
+    assert [r.get("replayed", False) for r in results] == [False, True, True]
+    assert balance(user["id"]) == pytest.approx(before - 5)
+
+def test_batch_replays_and_conflicts(client, alice):
+    user, headers = alice
+    pay(client, headers, encrypt(user["id"], 10), key="b1")
+    batch = {"payments": [{"payload": encrypt(user["id"], 10), "idempotency_key": "b1"},
+                          {"payload": encrypt(user["id"], 11), "idempotency_key": "b1"},
+                          {"payload": encrypt(user["id"], 3)}]}
+    replayed, conflict, fresh = client.post("/gateway/pay/batch", json=batch, headers=headers).json()["results"]
+    assert replayed["replayed"]
+    assert not conflict["ok"] and "idempotency key" in conflict["reason"]
+    assert fresh["ok"] and not fresh.get("replayed")
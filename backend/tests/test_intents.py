@@ -0,0 +1,71 @@
+"""Confirming pending payments: only an exact yes may execute them"""
+import pytest
+
+from app import agent
+from app.agent import parse_command
+from app.intents import IntentResolver, StubIntentBackend, backend_from_env
+
+from conftest import balance
+
+@pytest.fixture
+def stub_backend():
+    """The chat resolver with the stub model tier, as in benchmarks"""
+    resolver = agent.intent_resolver
+    old = resolver.backend
+    resolver.backend = StubIntentBackend()
+    resolver.clear()
+    yield resolver
+    resolver.backend = old
+    resolver.clear()
+
+def chat(client, headers, message):
+    return client.post("/agent/chat", json={"message": message}, headers=headers).json()
+
+@pytest.mark.parametrize("message", ["yes", "Yes!", "ok", "yeah", "sure, go ahead", "yes please", "confirm"])
+def test_exact_confirmations(message):
+    assert parse_command(message) == {"type": "confirm"}
+
+@pytest.mark.parametrize("message", ["absolutely not", "yeah no, cancel that", "not ok", "no", "nope",
+                                     "i am not sure", "took too long", "yes but cancel"])
+def test_negations_do_not_confirm(message):
+    cmd = parse_command(message)
+    assert not cmd or cmd["type"] != "confirm"
+
+def test_model_tier_never_confirms():
+    resolver = IntentResolver(lambda m: None, StubIntentBackend(), batch_window=0)
+    for message in ("absolutely", "yeah no, cancel that", "sounds good", "please do"):
+        intent = resolver.resolve(message)
+        assert not intent or intent["type"] != "confirm"
+
+def test_stub_transfer_words_match_whole_words():
+    assert StubIntentBackend()._classify("remove 5 items from my cart") is None
+    assert StubIntentBackend()._classify("move 5 to +10000000002")["type"] == "transfer"
+
+def test_default_backend(monkeypatch):
+    monkeypatch.delenv("INTENT_BACKEND", raising=False)
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+    assert backend_from_env() is None
+    monkeypatch.setenv("INTENT_BACKEND", "bogus")
+    assert backend_from_env() is None
+
+@pytest.mark.parametrize("reply", ["absolutely not", "yeah no, cancel that"])
+def test_denied_purchase_is_not_charged(client, alice, stub_backend, reply):
+    user, headers = alice
+    before = balance(user["id"])
+    assert "(say 'yes' to confirm)" in chat(client, headers, "buy me a mouse")["reply"]
+    assert chat(client, headers, reply)["reply"].startswith("Cancelled previous purchase")
+    assert balance(user["id"]) == before
+
+def test_denied_transfer_is_not_sent(client, alice, bob, stub_backend):
+    user, headers = alice
+    before = balance(bob[0]["id"])
+    chat(client, headers, "send $5 to +10000000002")
+    assert chat(client, headers, "yeah no, cancel that")["reply"].startswith("Cancelled previous transfer")
+    assert balance(bob[0]["id"]) == before
+
+def test_confirmed_transfer_is_sent(client, alice, bob):
+    user, headers = alice
+    before = balance(bob[0]["id"])
+    chat(client, headers, "send $5 to +10000000002")
+    assert chat(client, headers, "yes")["ok"]
+    assert balance(bob[0]["id"]) == pytest.approx(before + 5)
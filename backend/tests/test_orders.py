@@ -0,0 +1,44 @@
+"""Orders: cancelled orders leave the index when dropped, also after a snapshot restore"""
+import time
+
+from app.db import db, CANCELLED_ORDER_RETENTION
+from app.snapshot import load_snapshot, save_snapshot
+
+def pending_order(user_id):
+    product = next(iter(db.products.values()))
+    return db.create_pending_order(user_id, [product], product["price"])
+
+def test_dropped_cancelled_order_leaves_index(client, alice):
+    user, _ = alice
+    kept, dropped = pending_order(user["id"]), pending_order(user["id"])
+    db.cancel_order(dropped, "test")
+    db._drop_cancelled_order(dropped)
+    assert dropped not in db.orders
+    assert db.user_orders[user["id"]][-1] == kept
+    assert [o.id for o in db.get_user_orders(user["id"])][0] == kept
+
+def test_read_does_not_replace_index(client, alice):
+    user, _ = alice
+    order_ids = db.user_orders.setdefault(user["id"], [])
+    order_ids.append("gone")  # Dropped between a read and the prune it used to do
+    assert all(o.id != "gone" for o in db.get_user_orders(user["id"]))
+    # An order created concurrently appends to this same list, so it must stay in place
+    assert db.user_orders[user["id"]] is order_ids
+    new = pending_order(user["id"])
+    assert db.user_orders[user["id"]][-1] == new
+
+def test_snapshot_restores_cancelled_order_expiry(client, alice, tmp_path):
+    user, _ = alice
+    recent, old = pending_order(user["id"]), pending_order(user["id"])
+    for order_id in (recent, old):
+        db.cancel_order(order_id, "test")
+    db.orders[old].cancelled_at -= CANCELLED_ORDER_RETENTION + 1
+    save_snapshot(db, str(tmp_path / "snapshot.bin"))
+
+    db.cancelled_order_expiry.clear()
+    load_snapshot(db, str(tmp_path / "snapshot.bin"))
+    assert recent in db.orders and old not in db.orders
+    assert old not in db.user_orders[user["id"]]
+    # The remaining cancelled order is dropped once its retention runs out again
+    assert db.cancelled_order_expiry.expire_due(time.time() + CANCELLED_ORDER_RETENTION + 1) == 1
+    assert recent not in db.orders and recent not in db.user_orders[user["id"]]
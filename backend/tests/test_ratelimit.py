@@ -0,0 +1,51 @@
+"""Rate limits: tokens are spent only when every bucket allows, batches pay per payment"""
+import json
+
+import pytest
+
+from app.ratelimit import RateLimiter, RouteLimit, TokenBucket, rate_limiter
+from app.rsa_utils import key_manager
+from app.db import db
+
+def test_user_over_limit_does_not_drain_ip_bucket():
+    limit = RouteLimit("t", "/", rate=0.001, burst=2, ip_factor=2)  # Per IP: burst 4
+    assert [limit.check("u1", "1.1.1.1")[0] for _ in range(5)] == [True, True, False, False, False]
+    assert [limit.check("u2", "1.1.1.1")[0] for _ in range(3)] == [True, True, False]
+
+def test_cost_spends_several_tokens():
+    bucket = TokenBucket(rate=0.001, burst=10)
+    assert bucket.take("k", now=0, cost=7)[0]
+    assert not bucket.take("k", now=0, cost=4)[0]
+    assert bucket.take("k", now=0, cost=3) == (True, 0.0, 0)
+
+def test_batch_route_matched_before_single_payments():
+    limiter = RateLimiter([RouteLimit("gateway_batch", "/gateway/pay/batch", 5, 100, per_item=True),
+                           RouteLimit("gateway", "/gateway/pay", 5, 20)])
+    assert limiter.match("/gateway/pay/batch").name == "gateway_batch"
+    assert limiter.match("/gateway/pay").name == "gateway"
+    # The middleware's per-request check leaves per-item limits to the route
+    assert limiter.check("/gateway/pay/batch", "u", None) is None
+    assert limiter.check("/gateway/pay/batch", "u", None, items=101) is not None
+
+@pytest.fixture
+def batch_limit(client, monkeypatch):
+    """Rate limiting on, with the batch route allowing a burst of 5 payments"""
+    limit = rate_limiter.match("/gateway/pay/batch")
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    monkeypatch.setattr(limit, "users", TokenBucket(0.001, 5))
+    monkeypatch.setattr(limit, "ips", TokenBucket(0.001, 20))
+    return limit
+
+def payments(user_id, n):
+    payload = lambda: key_manager.encrypt(json.dumps({"from_id": user_id, "to_id": db.shop_id, "amount": 1}).encode())
+    return {"payments": [{"payload": payload()} for _ in range(n)]}
+
+def test_batch_charged_per_payment(client, alice, batch_limit):
+    user, headers = alice
+    r = client.post("/gateway/pay/batch", json=payments(user["id"], 4), headers=headers)
+    assert r.status_code == 200 and all(res["ok"] for res in r.json()["results"])
+    # One token left: a batch of two is refused, and costs nothing
+    r = client.post("/gateway/pay/batch", json=payments(user["id"], 2), headers=headers)
+    assert r.status_code == 429 and "Retry-After" in r.headers
+    r = client.post("/gateway/pay/batch", json=payments(user["id"], 1), headers=headers)
+    assert r.status_code == 200
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { products, agentChat, getUserTransactions, getUserActivities, getBalance } from './api';
+import { products, agentChat, getUserTransactions, getUserActivities, getBalance, subscribeEvents } from './api';
 import Login from './components/Login';
 import BanksMonitor from './components/BanksMonitor';
 import GatewayPipeline from './components/GatewayPipeline';
@@ -177,6 +177,17 @@ function Transactions({ userId, token }) {
       .finally(() => setLoading(false));
   }, [userId]);
 
+  // Refresh when the server pushes a new transaction
+  useEffect(() => {
+    return subscribeEvents(userId, token, {
+      transaction: () => {
+        getUserTransactions(userId, token)
+          .then(setTransactions)
+          .catch(err => console.error('Failed to refresh transactions:', err));
+      },
+    });
+  }, [userId, token]);
+
   if (error) return <div className="error">{error}</div>;
   if (loading) return <div className="loading">Loading transactions...</div>;
 
@@ -235,6 +246,13 @@ function Activities({ userId, token }) {
       .finally(() => setLoading(false));
   }, [userId, token]);
 
+  // Prepend new activities pushed by the server
+  useEffect(() => {
+    return subscribeEvents(userId, token, {
+      activity: (activity) => setActivities(prev => [activity, ...prev]),
+    });
+  }, [userId, token]);
+
   const getActivityMessage = (activity) => {
     switch (activity.type) {
       case 'transfer_sent':
@@ -371,17 +389,13 @@ export default function App() {
     }
   }, [session, initialized]);
 
-  // Real-time balance polling every 2 seconds
+  // Real-time balance updates pushed over the event stream
   useEffect(() => {
     if (!session?.user?.id || !session?.token) return;
 
-    const intervalId = setInterval(() => {
-      getBalance(session.user.id, session.token)
-        .then((data) => setBalance(data.balance))
-        .catch((err) => console.error('Balance polling error:', err));
-    }, 2000);
-
-    return () => clearInterval(intervalId);
+    return subscribeEvents(session.user.id, session.token, {
+      balance: (data) => setBalance(data.balance),
+    });
   }, [session]);
 
   const handleOrderComplete = (r) => {
@@ -174,4 +174,46 @@ export async function getBalance(userId, token) {
     console.error('Balance error:', error);
     throw new Error('Failed to load balance. Please try again.');
   }
-}
\ No newline at end of file
+}
+// One EventSource per session, shared by every subscriber: key -> { source, subscribers }
+const eventStreams = new Map();
+
+// Subscribe to the server-sent event stream for a user. `handlers` maps event
+// names (activity, transaction, balance, voice) to callbacks receiving parsed
+// data. Subscribers of the same session share one stream, which is closed when
+// the last of them unsubscribes. Returns a function that unsubscribes.
+export function subscribeEvents(userId, token, handlers) {
+  const key = `${userId}:${token}`;
+  let stream = eventStreams.get(key);
+  if (!stream) {
+    const source = new EventSource(`${API_URL}/events/${userId}?token=${encodeURIComponent(token)}`);
+    source.onerror = (error) => console.error('Event stream error:', error);
+    stream = { source, subscribers: 0 };
+    eventStreams.set(key, stream);
+  }
+  stream.subscribers += 1;
+
+  const listeners = Object.entries(handlers).map(([eventName, handler]) => {
+    const listener = (e) => {
+      try {
+        handler(JSON.parse(e.data));
+      } catch (error) {
+        console.error(`Event ${eventName} error:`, error);
+      }
+    };
+    stream.source.addEventListener(eventName, listener);
+    return [eventName, listener];
+  });
+
+  let subscribed = true;
+  return () => {
+    if (!subscribed) return;
+    subscribed = false;
+    listeners.forEach(([eventName, listener]) => stream.source.removeEventListener(eventName, listener));
+    stream.subscribers -= 1;
+    if (stream.subscribers === 0) {
+      stream.source.close();
+      eventStreams.delete(key);
+    }
+  };
+}